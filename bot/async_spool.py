@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+通信バックエンドへの非同期アクセス
+スプールのファイル操作（一覧・読み込み・書き込み・削除）とジャーナルの追記を
+専用の1スレッドで行い、Discordのイベントループを止めないようにする。
+監視ループの1回分は、一覧の取得と内容の読み込みを1回のスレッド呼び出しにまとめる。
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSpool:
+    """通信バックエンド（と送信済みジャーナル）をコルーチンから使うためのラッパー"""
+
+    def __init__(self, comm, journal=None):
+        self.comm = comm
+        self.journal = journal
+        # 操作の順序を保つため1スレッドだけで実行する
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool")
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """任意のブロッキング処理をスプール用のスレッドで実行"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def write_record(self, kind: str, name: str, data: Dict[str, Any]) -> str:
+        return await self.run(self.comm.write_record, kind, name, data)
+
+    async def list_responses(self, limit: int = 100) -> List[Tuple[str, Dict[str, Any]]]:
+        return await self.run(self.comm.list_responses, limit)
+
+    async def pending_snapshot(self, known: Set[str]) -> Tuple[List[str], List[Tuple[str, Dict[str, Any]]]]:
+        """承認待ちの名前の一覧と、known に無いものの内容をまとめて取得"""
+        def snapshot():
+            names = self.comm.list_pending_names()
+            entries = []
+            for name in names:
+                if name in known:
+                    continue
+                data = self.comm.get_pending(name)
+                if data is not None:
+                    entries.append((name, data))
+            return names, entries
+
+        return await self.run(snapshot)
+
+    async def ack(self, names: Iterable[str], delivered: Iterable[Tuple[str, str]] = ()):
+        """レスポンスをまとめて削除（delivered の (キー, 状態) を先にジャーナルへ記録する）"""
+        names = list(names)
+        delivered = list(delivered)
+        if not names and not delivered:
+            return
+
+        def ack_all():
+            for key, state in delivered:
+                self.journal.record(key, state)
+            for name in names:
+                self.comm.ack_response(name)
+            if delivered:
+                self.journal.compact_if_needed()
+
+        await self.run(ack_all)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -5,9 +5,10 @@ Discord Bridge - Claude Code通信用Discord Bot
 
 import os
 import sys
-import json
+import time
 import asyncio
 import logging
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
@@ -17,6 +18,25 @@ from discord import app_commands
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.transport import create_communicator
+from bot.outbound import OutboundQueue, PRIORITY_APPROVAL, PRIORITY_RESPONSE
+from bot.pending_index import PendingIndex
+from bot.async_spool import AsyncSpool
+from bot.loop_monitor import LoopLagMonitor
+from bridge.socket_channel import AsyncSocketClient, ACK_TIMEOUT
+from bridge.journal import JobJournal, STATE_DELIVERED
+from bridge.executor_stats import read_executor_states
+from bridge.job_registry import JOB_RUNNING, write_cancel_request
+from bridge.batch import BatchError, parse_batch
+from bridge.metrics import MetricsRegistry, MetricsServer
+from bridge.records import (
+    KIND_COMMAND, KIND_RESPONSE, KIND_PENDING, KIND_APPROVAL,
+    build_command, build_approval,
+)
+
 # 環境変数読み込み
 load_dotenv()
 
@@ -36,15 +56,61 @@ DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_GUILD_ID = int(os.getenv('DISCORD_GUILD_ID', 0))
 DISCORD_CHANNEL_ID = int(os.getenv('DISCORD_CHANNEL_ID', 0))
 COMM_DIR = Path(os.getenv('COMM_DIR', '/tmp/claude-discord'))
+# ストリーミング表示のメッセージ編集間隔（Discordの編集レート制限に合わせる）
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.0))
+# 更新が途絶えたストリーミング表示を破棄するまでの秒数
+STREAM_IDLE_EXPIRE = 600
+# 添付ファイルの上限サイズ（Discordのアップロード上限）
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_MB', 10)) * 1024 * 1024
+# 回答されない承認要求を自動で拒否するまでの秒数 / 同時に追跡する承認待ちの上限
+PENDING_EXPIRE = float(os.getenv('PENDING_EXPIRE', 3600))
+PENDING_MAX = int(os.getenv('PENDING_MAX', 200))
+# /batch で添付できるステップ定義ファイルの上限サイズ
+BATCH_FILE_MAX_BYTES = 64 * 1024
+# 実行エンジンのハートビートがこの秒数途絶えたら停止中とみなす（書き出し間隔の3倍）
+EXECUTOR_STALE_SECONDS = float(os.getenv('STATS_INTERVAL', 5)) * 3
 
-# 通信ディレクトリの確認
-COMMAND_DIR = COMM_DIR / 'commands'
-RESPONSE_DIR = COMM_DIR / 'responses'
-PENDING_DIR = COMM_DIR / 'pending'
+# 通信バックエンド（BRIDGE_TRANSPORT: file / sqlite）
+comm = create_communicator(COMM_DIR)
+# 送信済みレスポンスの記録（送信後・削除前に停止しても再送しない）
+delivery_journal = JobJournal(
+    COMM_DIR / "journal" / "bot.log",
+    fsync=os.getenv('JOURNAL_FSYNC', 'true').lower() in ('1', 'true', 'yes')
+)
+# スプール・ジャーナルの操作はイベントループの外（専用スレッド）で行う
+spool = AsyncSpool(comm, delivery_journal)
+# 実行エンジンとの直接通信（接続できない間はスプール経由）
+BRIDGE_SOCKET = os.getenv('BRIDGE_SOCKET', 'false').lower() in ('1', 'true', 'yes')
+BRIDGE_SOCKET_PATH = Path(os.getenv('BRIDGE_SOCKET_PATH', str(COMM_DIR / 'bridge.sock')))
+# メトリクスを公開するポート（0なら公開しない）
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
 
-# ディレクトリ作成
-for dir_path in [COMMAND_DIR, RESPONSE_DIR, PENDING_DIR]:
-    dir_path.mkdir(parents=True, exist_ok=True)
+# メトリクス（キューの状態は取得時にBotから読む）
+metrics = MetricsRegistry()
+commands_sent_total = metrics.counter('bridge_bot_commands_sent_total', 'Commands sent to the executor')
+responses_delivered_total = metrics.counter(
+    'bridge_bot_responses_delivered_total', 'Final responses posted to Discord, by status', ['status'])
+approvals_total = metrics.counter('bridge_bot_approvals_total', 'Approval decisions, by decision', ['decision'])
+end_to_end_seconds = metrics.histogram(
+    'bridge_bot_end_to_end_seconds', 'Time from /execute to the result being posted to Discord')
+metrics.counter('bridge_bot_discord_rate_limited_total',
+                'Discord rate limits hit, including 429s retried inside discord.py',
+                func=lambda: bot.outbound.stats['rate_limited'])
+metrics.counter('bridge_bot_outbound_throttled_seconds_total',
+                'Seconds queued Discord operations waited for a rate limit bucket',
+                func=lambda: bot.outbound.stats['throttled_seconds'])
+metrics.gauge('bridge_bot_outbound_queue_depth', 'Discord operations waiting to be sent',
+              func=lambda: len(bot.outbound.items))
+metrics.gauge('bridge_bot_pending_approvals', 'Approval requests awaiting a reaction',
+              func=lambda: len(bot.pending_confirmations))
+metrics.gauge('bridge_bot_responses_waiting', 'Responses in the spool at the last poll',
+              func=lambda: bot.spool_gauges['responses'])
+event_loop_lag_seconds = metrics.histogram(
+    'bridge_bot_event_loop_lag_seconds', 'How late the event loop woke a periodic timer',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+metrics.gauge('bridge_bot_event_loop_lag_max_seconds', 'Largest event loop lag over the last minute',
+              func=lambda: bot.loop_lag.recent_max())
 
 class ClaudeBridge(commands.Bot):
     def __init__(self):
@@ -60,7 +126,30 @@ class ClaudeBridge(commands.Bot):
         
         self.guild_id = DISCORD_GUILD_ID
         self.channel_id = DISCORD_CHANNEL_ID
-        self.pending_confirmations = {}
+        # 承認待ち（メッセージIDから引ける索引）
+        self.pending_confirmations = PendingIndex(
+            expire_after=PENDING_EXPIRE,
+            max_entries=PENDING_MAX
+        )
+        # 承認要求メッセージを送信中の承認待ち
+        self.announcing = set()
+        # 承認結果を書き込み中の承認待ち（続けて付いたリアクションで二重に回答しないため）
+        self.answering = set()
+        # Discordへの送信キュー
+        self.outbound = OutboundQueue()
+        # ストリーミング表示中のメッセージ（job_id → 状態）
+        self.stream_messages = {}
+        # 完了済みジョブ（遅れて届いた進捗レコードを無視するため）
+        self.finished_streams = OrderedDict()
+        # 送信中の最終応答の冪等キー（ソケットとポーリングで同じジョブの応答を二重に送らないため）
+        self.responses_inflight = set()
+        # 監視ループで最後に見えた件数（/status でスプールを数え直さないため）
+        self.spool_gauges = {'responses': 0, 'pending': 0}
+        # コマンドを送った時刻（job_id → monotonic、エンドツーエンドの所要時間用）
+        self.command_sent_at = OrderedDict()
+        self.metrics_server = MetricsServer(metrics, METRICS_HOST, BOT_METRICS_PORT) if BOT_METRICS_PORT else None
+        # イベントループの遅延（ブロッキング処理の検出用、0.5秒ごとに計測）
+        self.loop_lag = LoopLagMonitor(interval=0.5, histogram=event_loop_lag_seconds)
         
     async def setup_hook(self):
         """Bot起動時の初期設定"""
@@ -73,6 +162,17 @@ class ClaudeBridge(commands.Bot):
         else:
             await self.tree.sync()
             logger.info("Commands synced globally")
+        
+        # 送信キュー・イベントループ遅延の計測を開始
+        self.outbound.start()
+        self.loop_lag.start()
+        
+        if self.metrics_server:
+            self.metrics_server.start()
+        
+        # 実行エンジンとの直接通信を開始
+        if bridge_socket:
+            asyncio.create_task(bridge_socket.run())
     
     async def on_ready(self):
         """Bot準備完了時"""
@@ -98,29 +198,106 @@ class ClaudeBridge(commands.Bot):
                 )
                 await channel.send(embed=embed)
 
+async def deliver(kind: str, record: tuple) -> str:
+    """ソケットで実行エンジンに直接送り、受領が返ってこなければスプールに書き込む"""
+    name, data = record
+    if bridge_socket and await bridge_socket.send(kind, name, data, ack_timeout=ACK_TIMEOUT):
+        return name
+    return await spool.write_record(kind, name, data)
+
+async def handle_socket_message(kind: str, name: str, data: dict) -> bool:
+    """ソケット経由で届いたレスポンス・承認待ちを処理（Trueなら実行エンジンに受領を返す）
+    
+    最終応答はスプールに保存してすぐ受領を返し（実行エンジンをDiscordへの送信で待たせない）、
+    送信は別タスクで行う。送信済み・送信中の重複は送らない。
+    送信できなかったレコードはスプールに残り、ポーリングで再送する。
+    """
+    if kind == KIND_RESPONSE and data.get('type') != 'progress':
+        key = response_key(name, data)
+        if delivery_journal.get(key) == STATE_DELIVERED or key in bot.responses_inflight:
+            logger.info(f"Dropped delivered or in-flight response: {name}")
+            return True
+        saved = await spool.write_record(kind, name, data)
+        if not saved:
+            return False
+        channel = bot.get_channel(bot.channel_id)
+        if channel:
+            bot.responses_inflight.add(key)
+            asyncio.create_task(send_socket_response(channel, saved, data, key))
+        return True
+    
+    channel = bot.get_channel(bot.channel_id)
+    if not channel:
+        # 承認待ちは実行エンジンがスプールにも書き込んでいるので、チャンネルが見つかってから監視ループで通知する
+        # （進捗は最終応答で置き換わるので捨てる）
+        return kind in (KIND_RESPONSE, KIND_PENDING)
+    
+    try:
+        if kind == KIND_RESPONSE:
+            await handle_progress(channel, data)
+        elif kind == KIND_PENDING:
+            await announce_pending(channel, name, data)
+        else:
+            logger.warning(f"Unexpected socket message kind: {kind}")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"Error handling socket message {name}: {e}")
+        return bool(await spool.write_record(kind, name, data))
+
+async def send_socket_response(channel, response_name: str, data: dict, key: str):
+    """ソケットで届いて保存済みの最終応答を送信し、送信済みを記録してからスプールから削除"""
+    try:
+        await handle_response(channel, data)
+        await spool.ack([response_name], [(key, STATE_DELIVERED)])
+        logger.info(f"Response sent: {response_name}")
+    except Exception as e:
+        logger.error(f"Error processing response {response_name}: {e}")
+    finally:
+        bot.responses_inflight.discard(key)
+
 # Botインスタンス作成
 bot = ClaudeBridge()
+bridge_socket = AsyncSocketClient(BRIDGE_SOCKET_PATH, handle_socket_message) if BRIDGE_SOCKET else None
 
 @bot.tree.command(name="execute", description="Claude Codeでコマンドを実行")
-@app_commands.describe(command="実行するコマンド")
-async def execute(interaction: discord.Interaction, command: str):
+@app_commands.describe(
+    command="実行するコマンド",
+    stream="実行中の出力を逐次表示する",
+    session="自分専用のシェルで実行する（cdや環境変数が次のコマンドに引き継がれる）",
+    priority="実行待ちが多いときの優先度"
+)
+@app_commands.choices(priority=[
+    app_commands.Choice(name="高", value="high"),
+    app_commands.Choice(name="通常", value="normal"),
+    app_commands.Choice(name="低", value="low"),
+])
+async def execute(interaction: discord.Interaction, command: str,
+                  stream: Optional[bool] = None, session: Optional[bool] = None,
+                  priority: Optional[app_commands.Choice[str]] = None):
     """コマンド実行"""
     await interaction.response.defer()
     
-    # コマンドファイル作成
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    command_file = COMMAND_DIR / f"cmd_{timestamp}.json"
-    
-    command_data = {
-        "command": command,
+    # コマンド作成
+    user_info = {
         "user_id": str(interaction.user.id),
         "user_name": interaction.user.name,
-        "timestamp": timestamp,
         "channel_id": str(interaction.channel_id)
     }
+    if stream is not None:
+        user_info["stream"] = stream
+    if session is not None:
+        user_info["session"] = session
+    if priority is not None:
+        user_info["priority"] = priority.value
     
-    with open(command_file, 'w') as f:
-        json.dump(command_data, f, indent=2)
+    record = build_command(command, user_info)
+    job_id = Path(record[0]).stem
+    await deliver(KIND_COMMAND, record)
+    commands_sent_total.inc()
+    bot.command_sent_at[job_id] = time.monotonic()
+    while len(bot.command_sent_at) > 1000:
+        bot.command_sent_at.popitem(last=False)
     
     embed = discord.Embed(
         title="📤 コマンド送信",
@@ -128,119 +305,526 @@ async def execute(interaction: discord.Interaction, command: str):
         color=discord.Color.blue(),
         timestamp=datetime.utcnow()
     )
-    embed.set_footer(text=f"実行者: {interaction.user.name}")
+    embed.set_footer(text=f"実行者: {interaction.user.name} | ジョブID: {job_id}")
     
     await interaction.followup.send(embed=embed)
     logger.info(f"Command sent: {command} by {interaction.user.name}")
 
+@bot.tree.command(name="batch", description="複数のコマンドを1つのジョブとしてまとめて実行")
+@app_commands.describe(
+    steps="ステップを ;; で区切って指定（例: build: make ;; test [build]: make test ;; lint: ruff check .）",
+    file="ステップ定義ファイル（1行1ステップ、または JSON）",
+    priority="実行待ちが多いときの優先度"
+)
+@app_commands.choices(priority=[
+    app_commands.Choice(name="高", value="high"),
+    app_commands.Choice(name="通常", value="normal"),
+    app_commands.Choice(name="低", value="low"),
+])
+async def batch(interaction: discord.Interaction, steps: Optional[str] = None,
+                file: Optional[discord.Attachment] = None,
+                priority: Optional[app_commands.Choice[str]] = None):
+    """バッチ実行（依存関係の無いステップは実行エンジンで並列に実行される）"""
+    await interaction.response.defer()
+    
+    # スラッシュコマンドの引数は1行なので ;; を改行として扱う
+    text = (steps or "").replace(";;", "\n")
+    if file is not None:
+        if file.size > BATCH_FILE_MAX_BYTES:
+            await interaction.followup.send(
+                f"ステップ定義ファイルが大きすぎます（上限 {BATCH_FILE_MAX_BYTES // 1024}KB）。", ephemeral=True
+            )
+            return
+        try:
+            text += "\n" + (await file.read()).decode('utf-8')
+        except UnicodeDecodeError:
+            await interaction.followup.send("ステップ定義ファイルはUTF-8のテキストで指定してください。", ephemeral=True)
+            return
+    try:
+        batch_steps = parse_batch(text)
+    except BatchError as e:
+        await interaction.followup.send(f"バッチを受け付けられません: {e}", ephemeral=True)
+        return
+    
+    user_info = {
+        "user_id": str(interaction.user.id),
+        "user_name": interaction.user.name,
+        "channel_id": str(interaction.channel_id),
+        "batch": batch_steps,
+    }
+    if priority is not None:
+        user_info["priority"] = priority.value
+    
+    command = f"batch: {', '.join(step['name'] for step in batch_steps)}"[:200]
+    record = build_command(command, user_info)
+    job_id = Path(record[0]).stem
+    await deliver(KIND_COMMAND, record)
+    commands_sent_total.inc()
+    bot.command_sent_at[job_id] = time.monotonic()
+    while len(bot.command_sent_at) > 1000:
+        bot.command_sent_at.popitem(last=False)
+    
+    lines = []
+    for step in batch_steps:
+        needs = f" ← {', '.join(step['needs'])}" if step['needs'] else ""
+        shown = step['command'].replace('`', "'")[:80]
+        lines.append(f"`{step['name']}`{needs}: `{shown}`")
+    embed = discord.Embed(
+        title=f"📦 バッチ送信（{len(batch_steps)}ステップ）",
+        description="\n".join(lines)[:4096],
+        color=discord.Color.blue(),
+        timestamp=datetime.utcnow()
+    )
+    embed.set_footer(text=f"実行者: {interaction.user.name} | ジョブID: {job_id}")
+    
+    await interaction.followup.send(embed=embed)
+    logger.info(f"Batch sent: {len(batch_steps)} steps by {interaction.user.name}")
+
+async def read_live_jobs() -> list:
+    """動作中の実行エンジンの状態ファイルからジョブの一覧を読む（実行中を先に、古い順）"""
+    states = await spool.run(read_executor_states, COMM_DIR / "state")
+    now = time.time()
+    jobs = [
+        dict(job, worker_id=state.get('worker_id', '?'))
+        for state in states if now - state.get('heartbeat', 0) <= EXECUTOR_STALE_SECONDS
+        for job in state.get('jobs', [])
+    ]
+    jobs.sort(key=lambda job: (job.get('state') != JOB_RUNNING, job.get('queued_at', 0)))
+    return jobs
+
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+@bot.tree.command(name="jobs", description="実行待ち・実行中のジョブを表示")
+async def jobs(interaction: discord.Interaction):
+    """ジョブ一覧"""
+    await interaction.response.defer()
+    
+    live_jobs = await read_live_jobs()
+    now = time.time()
+    lines = []
+    for job in live_jobs[:20]:
+        if job.get('state') == JOB_RUNNING:
+            elapsed = now - (job.get('started_at') or now)
+            detail = f"⚙️ 実行中 {elapsed:.0f}秒 / 出力 {format_bytes(job.get('output_bytes', 0))}"
+        else:
+            detail = f"⏳ 待機中 {now - job.get('queued_at', now):.0f}秒"
+        command = job.get('command', '').replace('`', "'")[:80]
+        lines.append(f"`{job['job_id']}` {detail} - {job.get('user_name', '?')}\n　`{command}`")
+    if len(live_jobs) > 20:
+        lines.append(f"…他 {len(live_jobs) - 20}件")
+    
+    embed = discord.Embed(
+        title="📋 ジョブ一覧",
+        description="\n".join(lines)[:4096] if lines else "実行待ち・実行中のジョブはありません",
+        color=discord.Color.blue(),
+        timestamp=datetime.utcnow()
+    )
+    embed.set_footer(text="/cancel <ジョブID> でキャンセルできます（IDは末尾の一部でも可）")
+    await interaction.followup.send(embed=embed)
+
+@bot.tree.command(name="cancel", description="実行待ち・実行中のジョブをキャンセル")
+@app_commands.describe(job_id="キャンセルするジョブのID（/jobs で確認、末尾の一部でも可）")
+async def cancel(interaction: discord.Interaction, job_id: str):
+    """ジョブのキャンセル"""
+    await interaction.response.defer(ephemeral=True)
+    
+    job_id = job_id.strip().strip('`')
+    live_jobs = await read_live_jobs()
+    matches = [job['job_id'] for job in live_jobs if job['job_id'] == job_id]
+    if not matches:
+        matches = [job['job_id'] for job in live_jobs if job['job_id'].endswith(job_id)]
+    if not matches and job_id in bot.command_sent_at:
+        # 送ったばかりでまだ状態ファイルに載っていないジョブ
+        matches = [job_id]
+    
+    if not matches:
+        await interaction.followup.send("該当するジョブが見つかりません。", ephemeral=True)
+        return
+    if len(matches) > 1:
+        await interaction.followup.send(
+            f"{len(matches)}件のジョブが該当します。IDをもう少し長く指定してください。", ephemeral=True
+        )
+        return
+    
+    await spool.run(
+        write_cancel_request, COMM_DIR / "state", matches[0],
+        user_id=str(interaction.user.id), user_name=interaction.user.name
+    )
+    await interaction.followup.send(f"🛑 `{matches[0]}` のキャンセルを要求しました。", ephemeral=True)
+    logger.info(f"Cancel requested: {matches[0]} by {interaction.user.name}")
+
 @bot.tree.command(name="status", description="システムの状態を確認")
 async def status(interaction: discord.Interaction):
     """ステータス確認"""
     await interaction.response.defer()
     
-    # 各ディレクトリのファイル数を確認
-    cmd_count = len(list(COMMAND_DIR.glob("*.json")))
-    res_count = len(list(RESPONSE_DIR.glob("*.json")))
-    pending_count = len(list(PENDING_DIR.glob("*.json")))
+    # 実行エンジンが書き出した状態ファイルと、監視ループが最後に数えた件数を使う
+    states, comm_dir_ok = await spool.run(
+        lambda: (read_executor_states(COMM_DIR / "state"), COMM_DIR.exists())
+    )
+    now = time.time()
+    alive = [s for s in states if now - s.get('heartbeat', 0) <= EXECUTOR_STALE_SECONDS]
     
     embed = discord.Embed(
         title="📊 システムステータス",
-        color=discord.Color.green(),
+        color=discord.Color.green() if alive else discord.Color.red(),
         timestamp=datetime.utcnow()
     )
     
-    embed.add_field(name="📥 待機中のコマンド", value=f"{cmd_count}件", inline=True)
-    embed.add_field(name="📤 未送信の応答", value=f"{res_count}件", inline=True)
-    embed.add_field(name="⏳ 承認待ち", value=f"{pending_count}件", inline=True)
+    embed.add_field(name="📥 待機中のコマンド", value=f"{sum(s.get('queued', 0) for s in alive)}件", inline=True)
+    embed.add_field(name="⚙️ 実行中", value=f"{sum(s.get('active', 0) for s in alive)}件", inline=True)
+    embed.add_field(name="📤 未送信の応答", value=f"{bot.spool_gauges['responses']}件", inline=True)
+    embed.add_field(name="⏳ 承認待ち", value=f"{bot.spool_gauges['pending']}件", inline=True)
+    
+    # キュー待ち時間は最も遅い実行エンジンの値を、スループットは合計を表示する
+    def worst(key):
+        values = [s['latency'][key] for s in alive if s.get('latency', {}).get(key) is not None]
+        return f"{max(values):.1f}秒" if values else "-"
+    
+    embed.add_field(
+        name="⏱️ キュー待ち時間",
+        value=f"p50 {worst('p50')} / p90 {worst('p90')} / p99 {worst('p99')}",
+        inline=False
+    )
+    throughput = {
+        window: sum(s.get('throughput_per_min', {}).get(window, 0) for s in alive)
+        for window in ('1m', '5m', '15m')
+    }
+    embed.add_field(
+        name="📈 スループット（件/分）",
+        value=f"1分 {throughput['1m']:.1f} / 5分 {throughput['5m']:.1f} / 15分 {throughput['15m']:.1f}",
+        inline=False
+    )
+    
+    # 実行エンジンの死活（最後のハートビートからの経過秒数）
+    if states:
+        lines = []
+        for state in states:
+            age = now - state.get('heartbeat', 0)
+            mark = "✅" if age <= EXECUTOR_STALE_SECONDS else "❌"
+            lines.append(f"{mark} `{state.get('worker_id', '?')}` {age:.0f}秒前")
+        value = "\n".join(lines)[:1024]
+    else:
+        value = "❌ 状態ファイルがありません"
+    embed.add_field(name="🫀 実行エンジン", value=value, inline=False)
+    
+    # Bot自身のイベントループの遅延（ブロッキング処理があると大きくなる）
+    embed.add_field(
+        name="🔁 イベントループ遅延",
+        value=f"直近 {bot.loop_lag.last * 1000:.0f}ms / 1分間の最大 {bot.loop_lag.recent_max() * 1000:.0f}ms",
+        inline=False
+    )
     
     # 通信ディレクトリの存在確認
     embed.add_field(
         name="📁 通信ディレクトリ",
-        value="✅ 正常" if COMM_DIR.exists() else "❌ エラー",
+        value="✅ 正常" if comm_dir_ok else "❌ エラー",
         inline=False
     )
     
     await interaction.followup.send(embed=embed)
 
+async def announce_pending(channel, pending_name: str, data: dict):
+    """承認要求メッセージを送信（同じ承認待ちは1回だけ）"""
+    if bot.pending_confirmations.is_known(pending_name) or pending_name in bot.announcing:
+        return
+    bot.announcing.add(pending_name)
+    
+    try:
+        embed = discord.Embed(
+            title="⚠️ 承認が必要です",
+            description=data.get('message', '不明なコマンド'),
+            color=discord.Color.yellow(),
+            timestamp=datetime.utcnow()
+        )
+        embed.add_field(
+            name="コマンド",
+            value=f"```{data.get('command', 'N/A')}```",
+            inline=False
+        )
+        
+        message = await bot.outbound.send(channel, PRIORITY_APPROVAL, embed=embed)
+        
+        # リアクション追加
+        await bot.outbound.add_reaction(message, "✅")
+        await bot.outbound.add_reaction(message, "❌")
+        
+        # 索引に追加（上限を超えた古い承認待ちは期限切れとして扱う）
+        evicted = bot.pending_confirmations.add(pending_name, message, data)
+        
+        logger.info(f"Pending confirmation sent: {pending_name}")
+        for name, info in evicted:
+            await expire_pending(name, info)
+    finally:
+        bot.announcing.discard(pending_name)
+
+async def expire_pending(pending_name: str, info: dict):
+    """期限切れの承認待ちを拒否として実行エンジンに伝える"""
+    logger.info(f"Pending confirmation expired: {pending_name}")
+    approvals_total.inc(decision='expired')
+    await deliver(KIND_APPROVAL, build_approval(
+        pending_name,
+        False,
+        user_name='timeout',
+        reason='expired'
+    ))
+    
+    embed = discord.Embed(
+        title="⌛ 期限切れ",
+        description="一定時間承認されなかったため、実行をキャンセルしました",
+        color=discord.Color.dark_grey()
+    )
+    try:
+        await bot.outbound.edit(info['message'], PRIORITY_APPROVAL, embed=embed)
+    except discord.HTTPException as e:
+        logger.warning(f"Failed to update expired confirmation {pending_name}: {e}")
+
 @tasks.loop(seconds=1)
 async def check_pending():
     """承認待ちメッセージの確認"""
     try:
-        for pending_file in PENDING_DIR.glob("*.json"):
+        # 一覧と未通知の承認待ちの内容を1回でまとめて読む（既に通知済み・処理済みなら読み込まない）
+        known = bot.pending_confirmations.known_names() | bot.announcing
+        pending_names, new_entries = await spool.pending_snapshot(known)
+        bot.spool_gauges['pending'] = len(pending_names)
+        bot.pending_confirmations.retain_closed(pending_names)
+        
+        channel = bot.get_channel(bot.channel_id)
+        for pending_name, data in new_entries if channel else []:
             try:
-                with open(pending_file, 'r') as f:
-                    data = json.load(f)
-                
-                # 既に処理済みかチェック
-                if pending_file.name in bot.pending_confirmations:
-                    continue
-                
                 # 承認要求メッセージ送信
-                channel = bot.get_channel(bot.channel_id)
-                if channel:
-                    embed = discord.Embed(
-                        title="⚠️ 承認が必要です",
-                        description=data.get('message', '不明なコマンド'),
-                        color=discord.Color.yellow(),
-                        timestamp=datetime.utcnow()
-                    )
-                    embed.add_field(
-                        name="コマンド",
-                        value=f"```{data.get('command', 'N/A')}```",
-                        inline=False
-                    )
-                    
-                    message = await channel.send(embed=embed)
-                    
-                    # リアクション追加
-                    await message.add_reaction("✅")
-                    await message.add_reaction("❌")
-                    
-                    # 管理辞書に追加
-                    bot.pending_confirmations[pending_file.name] = {
-                        'message': message,
-                        'file': pending_file,
-                        'data': data
-                    }
-                    
-                    logger.info(f"Pending confirmation sent: {pending_file.name}")
-                
+                await announce_pending(channel, pending_name, data)
             except Exception as e:
-                logger.error(f"Error processing pending file {pending_file}: {e}")
+                logger.error(f"Error processing pending entry {pending_name}: {e}")
+        
+        # 回答されないまま期限切れになった承認待ち
+        for pending_name, info in bot.pending_confirmations.expire():
+            await expire_pending(pending_name, info)
                 
     except Exception as e:
         logger.error(f"Error in check_pending: {e}")
 
+def build_response_embed(data: dict) -> discord.Embed:
+    """レスポンスレコードから応答Embedを作成"""
+    embed = discord.Embed(
+        title="📨 応答",
+        description=data.get('message', ''),
+        color=discord.Color.green() if data.get('status') == 'success' else discord.Color.red(),
+        timestamp=datetime.utcnow()
+    )
+    
+    if 'error' in data:
+        embed.add_field(name="エラー", value=data['error'], inline=False)
+    
+    # 実行エンジンが記録したリソース使用量
+    resources = data.get('resources') or {}
+    usage = []
+    if resources.get('cpu_seconds') is not None:
+        usage.append(f"CPU {resources['cpu_seconds']:.2f}秒")
+    if resources.get('peak_rss_kb') is not None:
+        usage.append(f"最大メモリ {resources['peak_rss_kb'] / 1024:.1f}MB")
+    if usage:
+        embed.set_footer(text=" / ".join(usage))
+    
+    return embed
+
+def build_progress_embed(data: dict) -> discord.Embed:
+    """進捗レコードから実行中Embedを作成"""
+    if data.get('queued'):
+        embed = discord.Embed(
+            title="🕒 実行待ち",
+            description=f"`{data.get('command', '')}`",
+            color=discord.Color.light_grey(),
+            timestamp=datetime.utcnow()
+        )
+        embed.set_footer(text=f"実行待ち {data.get('position', '?')}番目")
+        return embed
+    
+    embed = discord.Embed(
+        title="⏳ 実行中",
+        description=f"`{data.get('command', '')}`\n```\n{data.get('output', '')}\n```",
+        color=discord.Color.blue(),
+        timestamp=datetime.utcnow()
+    )
+    embed.set_footer(text=f"出力 {data.get('total_chars', 0)}文字 / 更新 #{data.get('seq', 0)}")
+    return embed
+
+async def flush_stream_edit(state: dict):
+    """保留中の進捗があり、編集間隔を過ぎていればメッセージを編集"""
+    if state['pending'] is None:
+        return
+    if time.monotonic() - state['last_edit'] < STREAM_EDIT_INTERVAL:
+        return
+    
+    await bot.outbound.edit(state['message'], embed=build_progress_embed(state['pending']))
+    state['pending'] = None
+    state['last_edit'] = time.monotonic()
+
+def mark_stream_finished(job_id: str):
+    """ジョブを完了済みとして記録（古いものから破棄）"""
+    bot.stream_messages.pop(job_id, None)
+    bot.finished_streams[job_id] = True
+    while len(bot.finished_streams) > 1000:
+        bot.finished_streams.popitem(last=False)
+
+async def handle_progress(channel, data: dict):
+    """進捗レコードを1つのメッセージに反映"""
+    job_id = data.get('job_id')
+    seq = data.get('seq', 0)
+    if not job_id or job_id in bot.finished_streams:
+        return
+    
+    state = bot.stream_messages.get(job_id)
+    if state is None:
+        # 最初の進捗は新規メッセージとして送信
+        message = await bot.outbound.send(channel, PRIORITY_RESPONSE, embed=build_progress_embed(data))
+        bot.stream_messages[job_id] = {
+            'message': message,
+            'seq': seq,
+            'pending': None,
+            'last_edit': time.monotonic()
+        }
+        return
+    
+    if seq <= state['seq']:
+        return
+    state['seq'] = seq
+    state['pending'] = data
+    await flush_stream_edit(state)
+
+def build_attachment_files(data: dict) -> tuple:
+    """レスポンスの出力ファイルを添付用に変換（上限を超えるものはパスのみ返す）"""
+    files = []
+    too_large = []
+    for attachment in data.get('attachments', []):
+        path = Path(attachment['path'])
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            logger.warning(f"Attachment not found: {path}")
+            continue
+        
+        if size > ATTACHMENT_MAX_BYTES:
+            too_large.append(path)
+        else:
+            files.append(discord.File(path, filename=attachment.get('filename', path.name)))
+    return files, too_large
+
+async def handle_response(channel, data: dict):
+    """最終レスポンスを送信（ストリーミング中のジョブはメッセージを置き換え）"""
+    embed = build_response_embed(data)
+    files, too_large = await spool.run(build_attachment_files, data)
+    if too_large:
+        embed.add_field(
+            name="📁 添付できない大きさの出力",
+            value="\n".join(f"`{path}`" for path in too_large)[:1024],
+            inline=False
+        )
+    
+    kwargs = {'embed': embed}
+    state = bot.stream_messages.get(data.get('job_id'))
+    
+    if state is not None:
+        if files:
+            kwargs['attachments'] = files
+        await bot.outbound.edit(state['message'], **kwargs)
+    else:
+        if files:
+            kwargs['files'] = files
+        # 添付の無い応答は、滞留時に同じチャンネルの応答とまとめて送られる
+        await bot.outbound.send(channel, PRIORITY_RESPONSE, coalesce=True, **kwargs)
+    
+    responses_delivered_total.inc(status=data.get('status', 'unknown'))
+    sent_at = bot.command_sent_at.pop(data.get('job_id'), None)
+    if sent_at is not None:
+        end_to_end_seconds.observe(time.monotonic() - sent_at)
+    
+    if data.get('job_id'):
+        mark_stream_finished(data['job_id'])
+
+def response_key(response_name: str, data: dict) -> str:
+    """レスポンスの冪等キー（同じジョブの応答は同じキーになる）"""
+    return data.get('idempotency_key') or response_name
+
 @tasks.loop(seconds=1)
 async def check_responses():
     """レスポンスファイルの確認"""
     try:
-        for response_file in RESPONSE_DIR.glob("*.json"):
+        responses = await spool.list_responses()
+        bot.spool_gauges['responses'] = len(responses)
+        channel = bot.get_channel(bot.channel_id)
+        # 処理したレスポンスは最後にまとめて削除する
+        acked = []
+        
+        # 進捗は順番に反映（ストリーミング表示のメッセージを先に作るため）
+        progress = sorted((r for r in responses if r[1].get('type') == 'progress'), key=lambda r: r[0])
+        for response_name, data in progress:
             try:
-                with open(response_file, 'r') as f:
-                    data = json.load(f)
-                
-                # チャンネルに送信
-                channel = bot.get_channel(bot.channel_id)
                 if channel:
-                    embed = discord.Embed(
-                        title="📨 応答",
-                        description=data.get('message', ''),
-                        color=discord.Color.green() if data.get('status') == 'success' else discord.Color.red(),
-                        timestamp=datetime.utcnow()
-                    )
-                    
-                    if 'error' in data:
-                        embed.add_field(name="エラー", value=data['error'], inline=False)
-                    
-                    await channel.send(embed=embed)
-                    
-                # 送信済みファイルを削除
-                response_file.unlink()
-                logger.info(f"Response sent and deleted: {response_file.name}")
-                
+                    await handle_progress(channel, data)
+                acked.append(response_name)
             except Exception as e:
-                logger.error(f"Error processing response file {response_file}: {e}")
+                logger.error(f"Error processing progress {response_name}: {e}")
+        
+        # 最終応答はまとめて送信キューに入れる（滞留時は1メッセージにまとめられる）
+        finals = []
+        keys = set()
+        # ソケットで届いて処理を待っている最終応答は、そちらで送る
+        queued = {
+            response_key(queued_name, queued_data)
+            for queued_name, queued_data in list(bridge_socket.queued.items())
+            if queued_data.get('type') != 'progress'
+        } if bridge_socket else set()
+        for response_name, data in responses:
+            if data.get('type') == 'progress':
+                continue
+            key = response_key(response_name, data)
+            if delivery_journal.get(key) == STATE_DELIVERED:
+                # 送信済み（再起動前に送ったもの、または同じジョブの重複レスポンス）
+                acked.append(response_name)
+                logger.info(f"Dropped already delivered response: {response_name}")
+                continue
+            if key in keys or key in bot.responses_inflight or key in queued:
+                # 同じジョブの応答は1つだけ送る（残りは次回、送信済みとして削除される）
+                continue
+            if not channel:
+                # チャンネルが見つかるまで最終応答はスプールに残す
+                continue
+            keys.add(key)
+            finals.append((response_name, data))
+        
+        # 送信済みを記録するまではソケットで届いた同じ応答を送らない
+        bot.responses_inflight.update(keys)
+        try:
+            results = await asyncio.gather(
+                *(handle_response(channel, data) for _, data in finals),
+                return_exceptions=True
+            )
+            
+            delivered = []
+            for (response_name, data), result in zip(finals, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error processing response {response_name}: {result}")
+                    continue
+                # 送信済みを記録してからレスポンスを削除
+                delivered.append((response_key(response_name, data), STATE_DELIVERED))
+                acked.append(response_name)
+                logger.info(f"Response sent: {response_name}")
+            await spool.ack(acked, delivered)
+        finally:
+            bot.responses_inflight.difference_update(keys)
+        
+        # 編集間隔待ちの進捗を反映し、更新の途絶えた表示を破棄
+        for job_id, state in list(bot.stream_messages.items()):
+            if state['pending'] is None and time.monotonic() - state['last_edit'] > STREAM_IDLE_EXPIRE:
+                del bot.stream_messages[job_id]
+                continue
+            await flush_stream_edit(state)
                 
     except Exception as e:
         logger.error(f"Error in check_responses: {e}")
@@ -253,53 +837,54 @@ async def on_reaction_add(reaction: discord.Reaction, user: discord.User):
         return
     
     # 承認待ちメッセージの確認
-    for filename, info in list(bot.pending_confirmations.items()):
-        if info['message'].id == reaction.message.id:
-            if str(reaction.emoji) == "✅":
-                # 承認
-                approval_file = RESPONSE_DIR / f"approval_{filename}"
-                with open(approval_file, 'w') as f:
-                    json.dump({
-                        "approval": True,
-                        "user_id": str(user.id),
-                        "user_name": user.name,
-                        "timestamp": datetime.now().isoformat()
-                    }, f)
-                
-                # 承認通知
-                embed = discord.Embed(
-                    title="✅ 承認されました",
-                    description=f"{user.name}が実行を承認しました",
-                    color=discord.Color.green()
-                )
-                await reaction.message.edit(embed=embed)
-                
-                # 元のファイルを削除
-                info['file'].unlink()
-                del bot.pending_confirmations[filename]
-                
-            elif str(reaction.emoji) == "❌":
-                # 拒否
-                approval_file = RESPONSE_DIR / f"approval_{filename}"
-                with open(approval_file, 'w') as f:
-                    json.dump({
-                        "approval": False,
-                        "user_id": str(user.id),
-                        "user_name": user.name,
-                        "timestamp": datetime.now().isoformat()
-                    }, f)
-                
-                # 拒否通知
-                embed = discord.Embed(
-                    title="❌ 拒否されました",
-                    description=f"{user.name}が実行を拒否しました",
-                    color=discord.Color.red()
-                )
-                await reaction.message.edit(embed=embed)
-                
-                # 元のファイルを削除
-                info['file'].unlink()
-                del bot.pending_confirmations[filename]
+    found = bot.pending_confirmations.get_by_message(reaction.message.id)
+    if found is None:
+        return
+    filename, info = found
+    
+    emoji = str(reaction.emoji)
+    if emoji not in ("✅", "❌"):
+        return
+    approved = emoji == "✅"
+    if filename in bot.answering:
+        return
+    
+    # 書き込めてから索引から外す（失敗したらリアクションを付け直して再試行できる）
+    # （承認待ちは結果を処理した実行エンジンが削除する）
+    bot.answering.add(filename)
+    try:
+        written = await deliver(KIND_APPROVAL, build_approval(
+            filename,
+            approved,
+            user_id=str(user.id),
+            user_name=user.name
+        ))
+    except Exception as e:
+        logger.error(f"Error writing approval for {filename}: {e}")
+        written = ""
+    finally:
+        bot.answering.discard(filename)
+    if not written:
+        logger.error(f"Approval for {filename} was not written; waiting for another reaction")
+        return
+    bot.pending_confirmations.pop(filename)
+    approvals_total.inc(decision='approved' if approved else 'rejected')
+    
+    if approved:
+        # 承認通知
+        embed = discord.Embed(
+            title="✅ 承認されました",
+            description=f"{user.name}が実行を承認しました",
+            color=discord.Color.green()
+        )
+    else:
+        # 拒否通知
+        embed = discord.Embed(
+            title="❌ 拒否されました",
+            description=f"{user.name}が実行を拒否しました",
+            color=discord.Color.red()
+        )
+    await bot.outbound.edit(reaction.message, PRIORITY_APPROVAL, embed=embed)
 
 # エラーハンドリング
 @bot.tree.error
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+イベントループの遅延の計測
+一定間隔で起きるタスクが予定より何秒遅れて起きたかを記録する。
+ループ上でブロッキング処理が走ると、その時間だけ遅延として現れる。
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """イベントループの遅延
+
+    - interval: 計測の間隔（秒）
+    - window: 直近の最大値を求める件数
+    - histogram: 各計測値を記録するヒストグラム（bridge.metrics.Histogram）
+    - warn_after: この秒数以上遅れたら警告ログを出す
+    """
+
+    def __init__(self, interval: float = 0.5, window: int = 120, histogram=None, warn_after: float = 1.0):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.histogram = histogram
+        self.warn_after = warn_after
+        self.last = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """計測を開始（実行中のイベントループから呼ぶ）"""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def record(self, lag: float):
+        self.last = lag
+        self.samples.append(lag)
+        if self.histogram is not None:
+            self.histogram.observe(lag)
+        if lag >= self.warn_after:
+            logger.warning(f"Event loop blocked for {lag:.2f}s")
+
+    def recent_max(self) -> float:
+        """直近 window 回の最大の遅延（秒）"""
+        return max(self.samples, default=0.0)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - started - self.interval))
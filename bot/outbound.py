@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Discordへの送信キュー
+ルートごとのレート制限を考慮して送信・編集・リアクションを順に処理し、
+承認要求を通常の応答より優先する。滞留した小さな応答は1メッセージにまとめる。
+discord.py は429（レート制限）を受けると自分で待って再送し、例外はほとんど上がらないので、
+レート制限の回数は discord.py のHTTPクライアントのログから数える。
+"""
+
+import asyncio
+import logging
+import itertools
+from typing import Dict, Any, Optional, List, Tuple
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# 優先度（小さいほど優先）
+PRIORITY_APPROVAL = 0
+PRIORITY_EDIT = 1
+PRIORITY_RESPONSE = 2
+
+# Discordの制限
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+
+# discord.py がレート制限を受けたときに警告を出すロガー
+DISCORD_HTTP_LOGGER = 'discord.http'
+
+# ルートごとの上限（回数, 秒）。Discordのバケットより少し控えめにしている
+ROUTE_LIMITS = {
+    'send': (5, 5.0),
+    'edit': (5, 5.0),
+    'reaction': (1, 0.25),
+    'global': (50, 1.0),
+}
+
+
+class RouteBucket:
+    """トークンバケット方式のレート制限"""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = 0.0
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if self.updated:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """次に送信できるまでの秒数"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now: float, retry_after: float):
+        """429を受けたらretry_afterの間止める"""
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.tokens = 0.0
+
+
+class RateLimitLogCounter(logging.Handler):
+    """discord.py が内部で待って再送したレート制限を、HTTPクライアントの警告ログから数える
+
+    429 を受けたとき（"We are being rate limited. ..."）とグローバル制限に達したとき
+    （"Global rate limit has been hit. ..."）の警告がどちらも "rate limit" を含む。
+    """
+
+    def __init__(self, stats: Dict[str, Any]):
+        super().__init__(level=logging.WARNING)
+        self.stats = stats
+
+    def emit(self, record: logging.LogRecord):
+        if 'rate limit' in str(record.msg).lower():
+            self.stats['rate_limited'] += 1
+
+
+class OutboundItem:
+    """キュー内の送信操作"""
+
+    def __init__(self, action: str, priority: int, seq: int, target,
+                 kwargs: Dict[str, Any], future: asyncio.Future, coalesce: bool = False):
+        self.action = action
+        self.priority = priority
+        self.seq = seq
+        self.target = target
+        self.kwargs = kwargs
+        self.future = future
+        self.coalesce = coalesce
+
+    @property
+    def channel_id(self) -> int:
+        channel = self.target if self.action == 'send' else self.target.channel
+        return channel.id
+
+    @property
+    def route(self) -> Tuple[str, int]:
+        return self.action, self.channel_id
+
+
+class OutboundQueue:
+    """優先度・レート制限付きの送信キュー"""
+
+    def __init__(self):
+        self.items: List[OutboundItem] = []
+        self.buckets: Dict[Any, RouteBucket] = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # rate_limited: Discordのレート制限に達した回数（discord.py が再送した分を含む）
+        # throttled_seconds: 送信待ちがあるのにバケットの空きを待っていた秒数の合計
+        self.stats = {'sent': 0, 'coalesced': 0, 'rate_limited': 0, 'throttled_seconds': 0.0}
+        self.rate_limit_counter = RateLimitLogCounter(self.stats)
+
+    def start(self):
+        """送信ループを開始"""
+        if self.task is None or self.task.done():
+            logging.getLogger(DISCORD_HTTP_LOGGER).addHandler(self.rate_limit_counter)
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """送信ループを停止"""
+        logging.getLogger(DISCORD_HTTP_LOGGER).removeHandler(self.rate_limit_counter)
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.items)
+
+    async def send(self, channel, priority: int = PRIORITY_RESPONSE,
+                   coalesce: bool = False, **kwargs) -> discord.Message:
+        """メッセージ送信（coalesce=Trueなら同じチャンネルの応答とまとめてよい）"""
+        can_coalesce = coalesce and set(kwargs) == {'embed'}
+        return await self._enqueue('send', priority, channel, kwargs, can_coalesce)
+
+    async def edit(self, message: discord.Message, priority: int = PRIORITY_EDIT,
+                   **kwargs) -> discord.Message:
+        """メッセージ編集"""
+        return await self._enqueue('edit', priority, message, kwargs)
+
+    async def add_reaction(self, message: discord.Message, emoji: str,
+                           priority: int = PRIORITY_APPROVAL):
+        """リアクション追加"""
+        return await self._enqueue('reaction', priority, message, {'emoji': emoji})
+
+    def _enqueue(self, action: str, priority: int, target, kwargs: Dict[str, Any],
+                 coalesce: bool = False) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.items.append(OutboundItem(
+            action, priority, next(self.counter), target, kwargs, future, coalesce
+        ))
+        self.wakeup.set()
+        return future
+
+    def _bucket(self, key) -> RouteBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            rate, per = ROUTE_LIMITS[key[0] if isinstance(key, tuple) else key]
+            bucket = self.buckets[key] = RouteBucket(rate, per)
+        return bucket
+
+    def _delay(self, item: OutboundItem, now: float) -> float:
+        return max(self._bucket(item.route).delay(now), self._bucket('global').delay(now))
+
+    def _coalesce(self, first: OutboundItem, ordered: List[OutboundItem]) -> List[OutboundItem]:
+        """同じチャンネル宛ての小さな応答をまとめる"""
+        batch = [first]
+        if not first.coalesce:
+            return batch
+
+        total = len(first.kwargs['embed'])
+        for item in ordered:
+            if len(batch) >= MAX_EMBEDS_PER_MESSAGE:
+                break
+            if item is first or not item.coalesce or item.channel_id != first.channel_id:
+                continue
+            size = len(item.kwargs['embed'])
+            if total + size > MAX_EMBED_CHARS_PER_MESSAGE:
+                continue
+            batch.append(item)
+            total += size
+        return batch
+
+    async def _perform(self, batch: List[OutboundItem]):
+        item = batch[0]
+        if item.action == 'send':
+            if len(batch) > 1:
+                return await item.target.send(embeds=[i.kwargs['embed'] for i in batch])
+            return await item.target.send(**item.kwargs)
+        if item.action == 'edit':
+            return await item.target.edit(**item.kwargs)
+        return await item.target.add_reaction(item.kwargs['emoji'])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # キャンセル済みの操作は捨てる
+            self.items = [i for i in self.items if not i.future.done()]
+            if not self.items:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            now = loop.time()
+            ordered = sorted(self.items, key=lambda i: (i.priority, i.seq))
+            delays = [(self._delay(i, now), i) for i in ordered]
+            ready = [i for d, i in delays if d <= 0]
+            if not ready:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=min(d for d, _ in delays))
+                except asyncio.TimeoutError:
+                    pass
+                self.stats['throttled_seconds'] += loop.time() - now
+                continue
+
+            batch = self._coalesce(ready[0], ordered)
+            for item in batch:
+                self.items.remove(item)
+            self._bucket(batch[0].route).consume(now)
+            self._bucket('global').consume(now)
+
+            try:
+                result = await self._perform(batch)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    # discord.py が再送をあきらめた429。待ってからこちらで再送する
+                    retry_after = float(getattr(e, 'retry_after', None) or 1.0)
+                    self.stats['rate_limited'] += 1
+                    self._bucket(batch[0].route).block(loop.time(), retry_after)
+                    self.items.extend(batch)
+                    logger.warning(f"Rate limited on {batch[0].route}, retrying in {retry_after:.2f}s")
+                    continue
+                self._fail(batch, e)
+                continue
+            except Exception as e:
+                self._fail(batch, e)
+                continue
+
+            self.stats['sent'] += 1
+            if len(batch) > 1:
+                self.stats['coalesced'] += len(batch) - 1
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(result)
+
+    @staticmethod
+    def _fail(batch: List[OutboundItem], error: Exception):
+        for item in batch:
+            if not item.future.done():
+                item.future.set_exception(error)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+承認待ちの管理
+承認要求メッセージのIDから承認待ちをO(1)で引けるようにし、
+回答されないまま残った承認待ちは期限切れ・上限超過で取り除く。
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+
+
+class PendingIndex:
+    """承認待ちの索引（承認待ち名 ⇔ DiscordメッセージID）
+
+    - expire_after: 承認要求を送ってから期限切れにするまでの秒数
+    - max_entries: 同時に追跡する承認待ちの上限（超えたら古いものから取り除く）
+    - 回答・期限切れになった名前は closed に残し、スプールから消えるまで再通知しない
+    """
+
+    def __init__(self, expire_after: float = 3600, max_entries: int = 200, closed_limit: int = 1000):
+        self.expire_after = expire_after
+        self.max_entries = max(1, max_entries)
+        self.closed_limit = closed_limit
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.by_message: Dict[int, str] = {}
+        self.closed: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def is_known(self, name: str) -> bool:
+        """追跡中または処理済みの承認待ちならTrue（ファイルを読む前の確認用）"""
+        return name in self.entries or name in self.closed
+
+    def known_names(self) -> set:
+        """追跡中・処理済みの承認待ち名の集合（別スレッドに渡すためのコピー）"""
+        return set(self.entries) | set(self.closed)
+
+    def add(self, name: str, message, data: Dict[str, Any],
+            now: Optional[float] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """承認要求メッセージを登録し、上限超過で取り除いた承認待ちを返す"""
+        now = time.monotonic() if now is None else now
+        self.entries[name] = {'message': message, 'data': data, 'created': now}
+        self.by_message[message.id] = name
+
+        evicted = []
+        while len(self.entries) > self.max_entries:
+            oldest = next(iter(self.entries))
+            evicted.append((oldest, self.pop(oldest)))
+        return evicted
+
+    def get_by_message(self, message_id: int) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """メッセージIDから承認待ちを引く"""
+        name = self.by_message.get(message_id)
+        if name is None:
+            return None
+        return name, self.entries[name]
+
+    def pop(self, name: str) -> Optional[Dict[str, Any]]:
+        """承認待ちを取り除き、処理済みとして記録する"""
+        info = self.entries.pop(name, None)
+        if info is not None:
+            self.by_message.pop(info['message'].id, None)
+        self.closed[name] = None
+        while len(self.closed) > self.closed_limit:
+            self.closed.popitem(last=False)
+        return info
+
+    def retain_closed(self, present_names) -> None:
+        """スプールから消えた承認待ちの処理済み記録を消す"""
+        present = set(present_names)
+        for name in [n for n in self.closed if n not in present]:
+            del self.closed[name]
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """期限切れの承認待ちを取り除いて返す（登録順なので先頭から見ればよい）"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.entries:
+            name, info = next(iter(self.entries.items()))
+            if now - info['created'] < self.expire_after:
+                break
+            expired.append((name, self.pop(name)))
+        return expired
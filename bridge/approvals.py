@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+承認待ちのコマンドの保持
+危険なコマンドを承認待ちにした実行エンジンは、そのコマンドをジョブIDで引けるように手元に置いておく。
+承認結果が届いたらスプールを探さずにO(1)で取り出して実行を始める。
+手元に無い場合（他の実行エンジンが承認待ちにした、再起動した）は呼び出し側がスプールの承認待ちを読む。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class HeldCommands:
+    """承認待ちのコマンド（ジョブID → 承認待ちの内容）
+
+    - max_entries: 保持する件数の上限（超えたら古いものから手放す。手放したものはスプールから読まれる）
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max(1, max_entries)
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def hold(self, job_id: str, data: Dict[str, Any]):
+        """承認待ちにしたコマンドを保持"""
+        with self.lock:
+            self.entries[job_id] = data
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def take(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """承認結果が届いたコマンドを取り出す（保持していなければNone）"""
+        with self.lock:
+            return self.entries.pop(job_id, None)
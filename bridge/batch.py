@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+バッチ実行
+複数のコマンドを1つのジョブとして投入し、依存関係（DAG）に従って独立したステップを並列に実行する。
+
+ステップの書式（1行1ステップ、空行と # で始まる行は無視）::
+
+    build: make
+    lint: ruff check .
+    test [build]: make test
+    echo done
+
+- "名前: コマンド" で名前を付ける（名前は英数字・_・-、コロンの後に空白が必要）
+- "名前 [依存1, 依存2]: コマンド" で依存するステップを指定する
+- 名前の無い行は step1, step2, ... と番号で呼ばれる
+JSON（[{"name": ..., "command": ..., "needs": [...]}, ...]）でも指定できる。
+
+依存するステップが失敗（終了コード0以外を含む）したステップは実行せずにスキップする。
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 1バッチのステップ数の上限
+MAX_STEPS = int(os.getenv('BATCH_MAX_STEPS', 50))
+
+# ステップの状態
+STEP_PENDING = "pending"
+STEP_RUNNING = "running"
+STEP_SUCCESS = "success"
+STEP_FAILED = "failed"
+STEP_SKIPPED = "skipped"
+STEP_CANCELLED = "cancelled"
+
+# 始まる前にキャンセルされたステップの結果
+CANCELLED_RESULT = {'success': False, 'cancelled': True, 'error': 'Cancelled before start'}
+
+_STEP_LINE = re.compile(r"^([A-Za-z0-9_-]+)\s*(?:\[([^\]]*)\])?\s*:\s+(\S.*)$")
+_STEP_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class BatchError(ValueError):
+    """バッチの指定が正しくない（メッセージはそのままユーザーに表示する）"""
+
+
+def parse_batch(text: str) -> List[Dict[str, Any]]:
+    """バッチの指定（行形式またはJSON）をステップの一覧に変換して検証する"""
+    text = text.strip()
+    if text.startswith('['):
+        try:
+            steps = json.loads(text)
+        except ValueError as e:
+            raise BatchError(f"JSONとして読めません: {e}")
+        if not isinstance(steps, list) or not all(isinstance(step, dict) for step in steps):
+            raise BatchError("JSONはステップのオブジェクトの配列で指定してください")
+        return validate_steps(steps)
+
+    steps = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = _STEP_LINE.match(line)
+        if match:
+            name, needs, command = match.groups()
+            steps.append({
+                'name': name,
+                'command': command,
+                'needs': [n.strip() for n in (needs or "").split(',') if n.strip()],
+            })
+        else:
+            steps.append({'command': line})
+    return validate_steps(steps)
+
+
+def validate_steps(steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """名前の補完・重複・未定義の依存・循環・ステップ数を確認し、正規化した一覧を返す"""
+    if not steps:
+        raise BatchError("ステップがありません")
+    if len(steps) > MAX_STEPS:
+        raise BatchError(f"ステップが多すぎます（{len(steps)}件、上限{MAX_STEPS}件）")
+
+    normalized = []
+    names = set()
+    for i, step in enumerate(steps, 1):
+        name = str(step.get('name') or f"step{i}")
+        command = str(step.get('command') or "").strip()
+        needs = step.get('needs') or []
+        if isinstance(needs, str):
+            needs = [needs]
+        if not _STEP_NAME.match(name):
+            raise BatchError(f"ステップ名に使えない文字があります: {name}")
+        if name in names:
+            raise BatchError(f"ステップ名が重複しています: {name}")
+        if not command:
+            raise BatchError(f"ステップ {name} のコマンドが空です")
+        names.add(name)
+        normalized.append({'name': name, 'command': command, 'needs': [str(n) for n in needs]})
+
+    for step in normalized:
+        for need in step['needs']:
+            if need not in names:
+                raise BatchError(f"ステップ {step['name']} の依存先 {need} がありません")
+            if need == step['name']:
+                raise BatchError(f"ステップ {need} が自分自身に依存しています")
+
+    # 循環の確認（依存の無いステップから順に取り除き、残ったものが循環）
+    remaining = {step['name']: set(step['needs']) for step in normalized}
+    while True:
+        ready = [name for name, needs in remaining.items() if not needs]
+        if not ready:
+            break
+        for name in ready:
+            del remaining[name]
+        for needs in remaining.values():
+            needs.difference_update(ready)
+    if remaining:
+        raise BatchError(f"依存関係が循環しています: {', '.join(sorted(remaining))}")
+    return normalized
+
+
+def step_succeeded(result: Dict[str, Any]) -> bool:
+    """依存するステップを実行してよい結果か（実行でき、終了コードが0）"""
+    return bool(result.get('success')) and result.get('returncode') == 0
+
+
+class BatchPlan:
+    """ステップの状態を管理し、実行できるステップを依存関係の順に渡す（スレッドセーフではない）"""
+
+    def __init__(self, steps: List[Dict[str, Any]]):
+        self.steps = {step['name']: step for step in steps}
+        self.order = [step['name'] for step in steps]
+        self.states = {name: STEP_PENDING for name in self.order}
+        self.dependents: Dict[str, List[str]] = {name: [] for name in self.order}
+        for step in steps:
+            for need in step['needs']:
+                self.dependents[need].append(step['name'])
+
+    def take_ready(self) -> List[Dict[str, Any]]:
+        """依存するステップがすべて成功した実行待ちのステップを実行中にして返す（指定順）"""
+        ready = []
+        for name in self.order:
+            if self.states[name] != STEP_PENDING:
+                continue
+            if all(self.states[need] == STEP_SUCCESS for need in self.steps[name]['needs']):
+                self.states[name] = STEP_RUNNING
+                ready.append(self.steps[name])
+        return ready
+
+    def finish(self, name: str, succeeded: bool, cancelled: bool = False):
+        """ステップの終了を記録（失敗したら依存するステップをすべてスキップにする）"""
+        if cancelled:
+            self.states[name] = STEP_CANCELLED
+        else:
+            self.states[name] = STEP_SUCCESS if succeeded else STEP_FAILED
+        if self.states[name] == STEP_SUCCESS:
+            return
+        stack = list(self.dependents[name])
+        while stack:
+            dependent = stack.pop()
+            if self.states[dependent] == STEP_PENDING:
+                self.states[dependent] = STEP_SKIPPED
+                stack.extend(self.dependents[dependent])
+
+    def cancel_pending(self):
+        """まだ始まっていないステップをキャンセル済みにする"""
+        for name in self.order:
+            if self.states[name] == STEP_PENDING:
+                self.states[name] = STEP_CANCELLED
+
+    def counts(self) -> Dict[str, int]:
+        """状態ごとのステップ数"""
+        counts: Dict[str, int] = {}
+        for state in self.states.values():
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+
+def _finish_step(plan: BatchPlan, step: Dict[str, Any], result: Dict[str, Any],
+                 results: Dict[str, Dict[str, Any]]):
+    results[step['name']] = result
+    plan.finish(step['name'], step_succeeded(result), cancelled=bool(result.get('cancelled')))
+
+
+def run_plan(plan: BatchPlan, run_step: Callable[[Dict[str, Any]], Dict[str, Any]],
+             max_parallel: int = 4,
+             is_cancelled: Optional[Callable[[], bool]] = None) -> Dict[str, Dict[str, Any]]:
+    """ステップをスレッドで並列に実行し、ステップ名 → 実行結果 を返す
+
+    run_step はステップの実行結果（execute_command の戻り値）を返す。
+    結果には実行時間（duration）を追加する。is_cancelled が真になったら新しいステップを始めない。
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def timed(step):
+        if is_cancelled is not None and is_cancelled():
+            # 空きを待っている間にキャンセルされた
+            return dict(CANCELLED_RESULT)
+        start = time.monotonic()
+        try:
+            result = run_step(step)
+        except Exception as e:
+            logger.error(f"Batch step {step['name']} failed: {e}")
+            result = {'success': False, 'error': str(e)}
+        return dict(result, duration=time.monotonic() - start)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix="batch") as workers:
+        running = {}
+        while True:
+            if is_cancelled is not None and is_cancelled():
+                plan.cancel_pending()
+            for step in plan.take_ready():
+                running[workers.submit(timed, step)] = step
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                _finish_step(plan, running.pop(future), future.result(), results)
+    return results
+
+
+async def run_plan_async(plan: BatchPlan, run_step, max_parallel: int = 4,
+                         is_cancelled: Optional[Callable[[], bool]] = None) -> Dict[str, Dict[str, Any]]:
+    """run_plan のasyncio版（run_step はコルーチン関数）"""
+    results: Dict[str, Dict[str, Any]] = {}
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+
+    async def timed(step):
+        async with semaphore:
+            if is_cancelled is not None and is_cancelled():
+                return dict(CANCELLED_RESULT)
+            start = time.monotonic()
+            try:
+                result = await run_step(step)
+            except Exception as e:
+                logger.error(f"Batch step {step['name']} failed: {e}")
+                result = {'success': False, 'error': str(e)}
+            return dict(result, duration=time.monotonic() - start)
+
+    running = {}
+    try:
+        while True:
+            if is_cancelled is not None and is_cancelled():
+                plan.cancel_pending()
+            for step in plan.take_ready():
+                running[asyncio.ensure_future(timed(step))] = step
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                _finish_step(plan, running.pop(task), task.result(), results)
+    finally:
+        for task in running:
+            task.cancel()
+    return results
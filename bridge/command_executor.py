@@ -10,13 +10,40 @@ import subprocess
 import logging
 import signal
 import time
+import asyncio
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, List
+
+from dotenv import load_dotenv
 
 # プロジェクトルートをPythonパスに追加
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from bridge.file_comm import FileCommunicator, FileWatcher
+from bridge.file_comm import FileCommunicator, AsyncFileWatcher, create_file_watcher, default_worker_id
+from bridge.transport import create_communicator
+from bridge.socket_channel import SocketServer, ChannelCommunicator
+from bridge.records import KIND_COMMAND, KIND_APPROVAL, job_id_of
+from bridge.worker_pool import WorkerPool, AsyncJobPool
+from bridge.scheduler import FairScheduler, parse_priority
+from bridge.streaming import stream_process, stream_process_async, ProgressPublisher
+from bridge.output_store import OutputStore
+from bridge.janitor import FileIndex, SpoolJanitor
+from bridge.result_cache import ResultCache
+from bridge.job_limits import LimitPolicy
+from bridge.job_process import AsyncProcess
+from bridge.job_registry import JobRegistry, read_cancel_requests, remove_cancel_request
+from bridge.approvals import HeldCommands
+from bridge.batch import BatchError, BatchPlan, validate_steps, run_plan, run_plan_async, \
+    STEP_SUCCESS, STEP_FAILED, STEP_SKIPPED, STEP_CANCELLED
+from bridge.command_rules import CommandClassifier
+from bridge.shell_session import SessionManager
+from bridge.journal import JobJournal, STATE_RECEIVED, STATE_RUNNING, STATE_DONE
+from bridge.executor_stats import ExecutorStats
+from bridge.metrics import MetricsRegistry, MetricsServer
+
+# 環境変数読み込み
+load_dotenv()
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,111 +55,663 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ストリーミングモード（コマンドJSONの "stream" で個別に上書き可能）
+STREAM_OUTPUT = os.getenv('STREAM_OUTPUT', 'false').lower() in ('1', 'true', 'yes')
+STREAM_INTERVAL = float(os.getenv('STREAM_INTERVAL', 1.0))
+
+# 出力の保存設定（メッセージに収まらない出力は添付ファイルとして送る）
+OUTPUT_PREVIEW_CHARS = 4000
+OUTPUT_STORE_MAX_MB = int(os.getenv('OUTPUT_STORE_MAX_MB', 500))
+OUTPUT_GZIP_THRESHOLD = int(os.getenv('OUTPUT_GZIP_THRESHOLD', 64 * 1024))
+OUTPUT_MAX_FILE_MB = int(os.getenv('OUTPUT_MAX_FILE_MB', 100))
+OUTPUT_STORE_MAX_FILES = int(os.getenv('OUTPUT_STORE_MAX_FILES', 0))
+
+# スプールの掃除（期限切れ・上限超過のファイルを JANITOR_INTERVAL 秒ごとに JANITOR_BATCH 件ずつ削除）
+SPOOL_MAX_AGE_HOURS = float(os.getenv('SPOOL_MAX_AGE_HOURS', 24))
+SPOOL_MAX_FILES = int(os.getenv('SPOOL_MAX_FILES', 50000))
+SPOOL_MAX_MB = int(os.getenv('SPOOL_MAX_MB', 512))
+JANITOR_INTERVAL = float(os.getenv('JANITOR_INTERVAL', 1))
+JANITOR_BATCH = int(os.getenv('JANITOR_BATCH', 100))
+# SQLiteバックエンドの古いレコードの削除とジャーナルの圧縮の間隔（秒）
+MAINTENANCE_INTERVAL = 3600
+
+# SQLiteバックエンドで新しいコマンドを確認する間隔（秒）
+SQLITE_POLL_INTERVAL = float(os.getenv('SQLITE_POLL_INTERVAL', 0.2))
+
+# Botとの直接通信用ソケット（接続が無い間はスプール経由）
+BRIDGE_SOCKET = os.getenv('BRIDGE_SOCKET', 'false').lower() in ('1', 'true', 'yes')
+
+# ユーザーごとの常駐シェルで実行する（コマンドJSONの "session" で個別に上書き可能）
+SESSION_MODE = os.getenv('SESSION_MODE', 'false').lower() in ('1', 'true', 'yes')
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', 1800))
+SESSION_MAX = int(os.getenv('SESSION_MAX', 8))
+
+# 取得したコマンドのリース（秒）。この間延長されなければ停止したとみなし、他の実行エンジンが再取得する
+LEASE_SECONDS = float(os.getenv('LEASE_SECONDS', 60))
+
+# ジョブ状態のジャーナル（追記ごとにfsyncするか）
+JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', 'true').lower() in ('1', 'true', 'yes')
+
+# 統計・死活情報の状態ファイルを書き出す間隔（秒）
+STATS_INTERVAL = float(os.getenv('STATS_INTERVAL', 5))
+# ジョブがある間は /jobs の表示のためにこの間隔（秒）で書き出す
+JOBS_REFRESH_INTERVAL = 1
+# Botからのキャンセル要求を確認する間隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+
+# バッチ実行で同時に実行するステップ数の上限（バッチはワーカープールの枠を1つだけ使う）
+BATCH_MAX_PARALLEL = int(os.getenv('BATCH_MAX_PARALLEL', 4))
+
+# メトリクスを公開するポート（0なら公開しない）
+EXECUTOR_METRICS_PORT = int(os.getenv('EXECUTOR_METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# 実行方式（thread: ワーカースレッド / asyncio: イベントループ）
+EXECUTOR_RUNTIME = os.getenv('EXECUTOR_RUNTIME', 'thread').lower()
+# 停止時に実行中のジョブの完了を待つ最大秒数
+DRAIN_TIMEOUT = float(os.getenv('EXECUTOR_DRAIN_TIMEOUT', 300))
+
 class CommandExecutor:
     """コマンド実行クラス"""
     
-    # 危険なコマンドのパターン
-    DANGEROUS_PATTERNS = [
-        'rm -rf /',
-        'rm -rf ~',
-        'dd if=/dev/zero',
-        'mkfs',
-        ':(){ :|:& };:',  # Fork bomb
-        'sudo rm',
-        'chmod -R 000',
-        '> /dev/sda',
-    ]
+    # メッセージに埋め込む出力の最大文字数
+    PREVIEW_LIMITS = {'stdout': 1000, 'stderr': 500}
     
     def __init__(self):
-        self.comm = FileCommunicator()
+        # 旧バックエンドのスプールの取り込みは実行エンジンだけが行う
+        self.backend = create_communicator(migrate=True)
+        self.comm = self.backend
+        self.socket_server = None
+        if BRIDGE_SOCKET:
+            self.socket_server = SocketServer(
+                Path(os.getenv('BRIDGE_SOCKET_PATH', str(self.backend.base_dir / 'bridge.sock'))),
+                self.handle_socket_message
+            )
+            self.comm = ChannelCommunicator(self.backend, self.socket_server)
+        self.classifier = CommandClassifier.from_file()
+        # ジョブごとのリソース上限（既定値とユーザーごとの上書き、使えれば cgroup v2）
+        self.limits = LimitPolicy.from_env()
+        self.sessions = SessionManager(idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=SESSION_MAX,
+                                       limits=self.limits)
+        # 停止前の処理状況を復元（複数の実行エンジンで共有する）
+        self.journal = JobJournal(
+            self.backend.base_dir / "journal" / "executor.log",
+            fsync=JOURNAL_FSYNC
+        )
+        self.last_lease_check = 0.0
+        # /status 用の統計（スプールを数えずに済むよう状態ファイルに書き出す）
+        self.stats = ExecutorStats(
+            getattr(self.backend, 'worker_id', None) or default_worker_id(),
+            self.backend.base_dir / "state"
+        )
+        self.last_stats_write = 0.0
+        # 実行待ち・実行中のジョブ（/jobs・/cancel 用）
+        self.jobs = JobRegistry()
+        self.stats_had_jobs = False
+        # 承認待ちにしたコマンド（承認結果が届いたらスプールを読まずに実行する）
+        self.held = HeldCommands()
         self.running = True
         self.command_watcher = None
+        self.response_watcher = None
+        self.approval_watcher = None
+        self.pending_watcher = None
+        self.claim_thread = None
+        self.pool = WorkerPool(
+            max_workers=int(os.getenv('EXECUTOR_MAX_WORKERS', 4)),
+            per_user_limit=int(os.getenv('EXECUTOR_PER_USER_LIMIT', 2)),
+            max_queue=int(os.getenv('EXECUTOR_MAX_QUEUE', 100)),
+            scheduler=FairScheduler.from_env()
+        )
+        self.output_store = OutputStore(
+            self.backend.base_dir / "outputs",
+            max_bytes=OUTPUT_STORE_MAX_MB * 1024 * 1024,
+            gzip_threshold=OUTPUT_GZIP_THRESHOLD,
+            max_file_bytes=OUTPUT_MAX_FILE_MB * 1024 * 1024,
+            max_files=OUTPUT_STORE_MAX_FILES
+        )
+        # 冪等なコマンドの結果キャッシュ（RESULT_CACHE=true のときだけ）
+        self.result_cache = ResultCache.from_env()
+        self.setup_janitor()
+        self.setup_metrics()
         
+    def setup_janitor(self):
+        """スプール・出力保存領域の掃除を準備（スプールの索引はファイル監視のイベントで更新する）
+        
+        件数・容量の上限で削除するのはレスポンスだけ。未処理のコマンド・承認待ち・承認結果は
+        消すとユーザーに何も返らずに失われるので、期限切れの場合だけ削除する。
+        """
+        indexes = [self.output_store.index]
+        self.spool_index = None
+        self.queue_index = None
+        if isinstance(self.backend, FileCommunicator):
+            self.spool_index = FileIndex(
+                "spool",
+                [self.backend.response_dir],
+                pattern="*.json",
+                max_age=SPOOL_MAX_AGE_HOURS * 3600,
+                max_bytes=SPOOL_MAX_MB * 1024 * 1024,
+                max_files=SPOOL_MAX_FILES
+            )
+            self.queue_index = FileIndex(
+                "queue",
+                [self.backend.command_dir, self.backend.pending_dir, self.backend.approval_dir],
+                pattern="*.json",
+                max_age=SPOOL_MAX_AGE_HOURS * 3600
+            )
+            indexes[:0] = [self.spool_index, self.queue_index]
+        self.janitor = SpoolJanitor(indexes, batch_size=JANITOR_BATCH)
+        self.last_janitor_run = 0.0
+        self.last_maintenance = time.monotonic()
+    
+    def run_janitor(self, force: bool = False):
+        """期限切れ・上限超過のファイルを少しずつ削除し、1時間ごとに保守処理を行う"""
+        now = time.monotonic()
+        if not force and now - self.last_janitor_run < JANITOR_INTERVAL:
+            return
+        self.last_janitor_run = now
+        self.janitor.run_once()
+        if now - self.last_maintenance >= MAINTENANCE_INTERVAL:
+            self.last_maintenance = now
+            if self.spool_index is None:
+                self.comm.cleanup_old_files(hours=SPOOL_MAX_AGE_HOURS)
+            self.journal.compact_if_needed()
+    
+    def on_command_file(self, filepath: Path):
+        """コマンドディレクトリの監視コールバック"""
+        self.queue_index.track(filepath)
+        self.process_command_file(filepath)
+    
+    def on_approval_file(self, filepath: Path):
+        """承認結果ディレクトリの監視コールバック"""
+        self.queue_index.track(filepath)
+        self.handle_approval_response(filepath)
+    
+    def setup_metrics(self):
+        """メトリクスを登録（キューの状態は取得時にプールから読む）"""
+        self.metrics = MetricsRegistry()
+        self.commands_total = self.metrics.counter(
+            'bridge_executor_commands_total', 'Commands received, by outcome', ['outcome'])
+        self.approvals_total = self.metrics.counter(
+            'bridge_executor_approvals_total', 'Approval decisions processed', ['decision'])
+        self.jobs_total = self.metrics.counter(
+            'bridge_executor_jobs_total', 'Finished jobs, by status', ['status'])
+        self.queue_wait_seconds = self.metrics.histogram(
+            'bridge_executor_queue_wait_seconds', 'Time from enqueue to start of execution')
+        self.execution_seconds = self.metrics.histogram(
+            'bridge_executor_execution_seconds', 'Command execution time')
+        self.metrics.gauge(
+            'bridge_executor_queue_depth', 'Jobs waiting in the worker pool',
+            func=lambda: self.pool.stats()['queued'])
+        self.metrics.gauge(
+            'bridge_executor_jobs_in_flight', 'Jobs currently executing',
+            func=lambda: self.pool.stats()['active'])
+        self.metrics_server = None
+        if EXECUTOR_METRICS_PORT:
+            self.metrics_server = MetricsServer(self.metrics, METRICS_HOST, EXECUTOR_METRICS_PORT)
+    
     def is_dangerous_command(self, command: str) -> bool:
         """危険なコマンドかチェック"""
-        command_lower = command.lower().strip()
-        
-        # 明らかに危険なパターン
-        for pattern in self.DANGEROUS_PATTERNS:
-            if pattern.lower() in command_lower:
-                return True
+        return self.classifier.is_dangerous(command)
+    
+    def execute_command(self, command: str,
+                        on_output: Optional[Callable[[Optional[str], str], None]] = None,
+                        job_id: Optional[str] = None,
+                        session_user: Optional[str] = None,
+                        user_id: Optional[str] = None) -> Dict[str, Any]:
+        """コマンドを実行
         
-        # sudoを含む場合
-        if 'sudo' in command_lower:
-            return True
+        全出力は出力保存領域に逐次書き出し、戻り値には先頭部分のみ保持する。
+        on_outputを指定すると出力を逐次コールバックする（ストリーミングモード）。
+        session_userを指定するとそのユーザーの常駐シェルで実行する（セッションモード）。
+        常駐シェルには起動時にそのユーザーのリソース上限を適用している。
+        それ以外は新しいプロセスグループで起動し、user_id のリソース上限を適用する。
+        """
+        job_id = job_id or f"job_{time.time_ns()}"
+        spool = self.output_store.open_spool(job_id)
+        self.jobs.attach(job_id, output=spool)
         
-        # パイプやリダイレクトで危険な操作
-        if '>' in command and ('/dev/' in command or '/sys/' in command):
-            return True
+        def handle_output(stream_name, text):
+            spool.feed(stream_name, text)
+            if on_output is not None:
+                on_output(stream_name, text)
         
-        return False
-    
-    def execute_command(self, command: str) -> Dict[str, Any]:
-        """コマンドを実行"""
         try:
-            # タイムアウト設定（5分）
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=300,
-                cwd=os.path.expanduser("~")
-            )
-            
-            return {
-                'success': True,
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'returncode': result.returncode
-            }
-            
-        except subprocess.TimeoutExpired:
+            if session_user is not None:
+                # キャンセル時は常駐シェルごと終了させる（次のコマンドで作り直される）
+                self.jobs.attach(job_id, self.sessions.get(str(session_user)).proc)
+                result = self.sessions.run(
+                    session_user,
+                    command,
+                    timeout=300,
+                    on_output=handle_output,
+                    capture_limit=OUTPUT_PREVIEW_CHARS
+                )
+            else:
+                limits = self.limits.for_user(user_id)
+                cgroup = self.limits.create_cgroup(job_id, limits)
+                try:
+                    proc = subprocess.Popen(
+                        LimitPolicy.wrap(command, limits, cgroup),
+                        shell=True,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        cwd=os.path.expanduser("~"),
+                        start_new_session=True,
+                        preexec_fn=LimitPolicy.preexec(limits, cgroup)
+                    )
+                    self.jobs.attach(job_id, proc)
+                    # タイムアウト設定（5分）。タイムアウト時は孫プロセスも含めて終了させる
+                    result = stream_process(
+                        proc,
+                        timeout=300,
+                        on_output=handle_output,
+                        capture_limit=OUTPUT_PREVIEW_CHARS,
+                        process_group=True
+                    )
+                finally:
+                    usage = self.limits.release_cgroup(cgroup)
+                # cgroup があれば子孫のプロセスまで含めた使用量を使う
+                if usage:
+                    result['rusage'] = dict(result.get('rusage') or {}, **usage)
+        except Exception as e:
+            for path in spool.close().values():
+                self.output_store.discard(path)
             return {
                 'success': False,
-                'error': 'Command timed out after 5 minutes'
+                'error': str(e)
             }
-        except Exception as e:
+        
+        return self.build_result(result, spool.close())
+    
+    @staticmethod
+    def build_result(result: Dict[str, Any], outputs: Dict[str, Path]) -> Dict[str, Any]:
+        """stream_processの結果を実行結果に変換"""
+        if result['timed_out']:
             return {
                 'success': False,
-                'error': str(e)
+                'error': 'Command timed out after 5 minutes',
+                'timed_out': True,
+                'outputs': outputs,
+                'resources': result.get('rusage')
             }
+        
+        return {
+            'success': True,
+            'stdout': result['stdout'],
+            'stderr': result['stderr'],
+            'stdout_chars': result['stdout_chars'],
+            'stderr_chars': result['stderr_chars'],
+            'returncode': result['returncode'],
+            'outputs': outputs,
+            'resources': result.get('rusage')
+        }
+    
+    def build_attachments(self, result: Dict[str, Any]) -> List[Dict[str, str]]:
+        """メッセージに収まらなかった出力を添付ファイル情報にする（収まったものは削除）"""
+        attachments = []
+        for stream_name, path in result.get('outputs', {}).items():
+            limit = self.PREVIEW_LIMITS.get(stream_name, 0)
+            if not result['success'] or result.get(f'{stream_name}_chars', 0) > limit:
+                attachments.append({'path': str(path), 'filename': path.name})
+            else:
+                self.output_store.discard(path)
+        return attachments
     
     def process_command_file(self, filepath: Path):
-        """コマンドファイルを処理"""
+        """コマンドファイルを受け付けてワーカープールに投入"""
         logger.info(f"Processing command file: {filepath}")
         
-        # ファイル読み込み
-        data = self.comm.read_json_safe(filepath)
+        # 他の実行エンジンと取り合わないよう、処理中ディレクトリに移してから読む
+        data = self.comm.claim_command(filepath.name)
         if not data:
-            logger.error(f"Failed to read command file: {filepath}")
-            filepath.unlink()
+            logger.info(f"Command already claimed or unreadable: {filepath.name}")
             return
         
+        self.process_command(filepath.name, data)
+    
+    @staticmethod
+    def job_key(name: str, data: Dict[str, Any]) -> str:
+        """ジョブの冪等キー（Bot側でレスポンスの重複送信の判定にも使う）"""
+        return data.get('job_id') or Path(name).stem
+    
+    def process_command(self, name: str, data: Dict[str, Any]):
+        """コマンドを受け付けてワーカープールに投入（nameはバックエンド上の名前）"""
         command = data.get('command', '')
         user_name = data.get('user_name', 'unknown')
         
-        # 危険なコマンドチェック
-        if self.is_dangerous_command(command):
-            logger.warning(f"Dangerous command detected: {command}")
+        # ソケットの受領が遅れてスプールにも書き込まれたコマンドは、受け付け済みなら無視する
+        if self.jobs.get(self.job_key(name, data)) is not None:
+            logger.info(f"Ignoring duplicate delivery of {name}")
+            return
+        
+        # 停止前に処理済み・実行途中だったコマンドは再実行しない
+        if self.recover_job(name, data):
+            return
+        self.journal.record(self.job_key(name, data), STATE_RECEIVED)
+        
+        # 危険なコマンドチェック（バッチはいずれかのステップが危険ならバッチ全体を承認待ちにする）
+        dangerous = self.find_dangerous(data)
+        if dangerous:
+            rule, dangerous_command = dangerous
+            logger.warning(f"Dangerous command detected ({rule}): {dangerous_command}")
+            self.commands_total.inc(outcome='dangerous')
             
             # 承認待ちファイル作成
-            pending_file = self.comm.create_pending(
-                command=command,
-                message=f"⚠️ 危険なコマンドが検出されました:\\n`{command}`\\n\\n実行してもよろしいですか？",
-                original_file=filepath.name,
-                user_name=user_name
-            )
+            pending = {
+                'command': command,
+                'original_file': name,
+                'user_name': user_name,
+                'user_id': data.get('user_id', user_name),
+                # 承認後も元のコマンドと同じ優先度で実行する
+                'priority': data.get('priority', 'normal'),
+            }
+            if data.get('batch'):
+                pending['batch'] = data['batch']
+                message = f"⚠️ バッチに危険なコマンドが含まれています:\\n`{dangerous_command}`\\n\\nバッチ全体を実行してもよろしいですか？"
+            else:
+                message = f"⚠️ 危険なコマンドが検出されました:\\n`{command}`\\n\\n実行してもよろしいですか？"
+            pending_file = self.comm.create_pending(message=message, **pending)
             
             if pending_file:
                 logger.info(f"Created pending file: {pending_file}")
+                self.held.hold(job_id_of(pending_file), pending)
+                # 承認待ちにコマンドが含まれるので、取得したコマンドは処理済みにする
+                # （作成に失敗した場合はリース切れで再取得される）
+                self.journal.record(self.job_key(name, data), STATE_DONE)
+                self.comm.finish_command(name)
             
-            # 元のコマンドファイルは保持（承認後に実行するため）
             return
         
-        # 安全なコマンドは即実行
-        logger.info(f"Executing command: {command}")
-        result = self.execute_command(command)
+        # 冪等なコマンドは直近の結果を返すか、実行中の同じコマンドに相乗りする
+        cache_key = self.cache_key(data)
+        if cache_key is not None:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                age, result = cached
+                logger.info(f"Serving cached result ({age:.1f}s old): {command}")
+                self.commands_total.inc(outcome='cached')
+                self.respond_command_result(name, command, self.job_key(name, data), dict(result, cached_age=age))
+                return
+            if self.result_cache.join(cache_key, (name, data)):
+                logger.info(f"Sharing in-flight execution: {command}")
+                self.commands_total.inc(outcome='coalesced')
+                return
+        
+        # 安全なコマンドはワーカープールで実行
+        user_id = data.get('user_id', user_name)
+        priority = parse_priority(data.get('priority', 'normal'))
+        self.stats.job_queued(self.job_key(name, data))
+        self.jobs.add(self.job_key(name, data), name, command, user_id, user_name, data)
+        run_job = self.run_batch_job if data.get('batch') else self.run_command_job
+        if not self.pool.submit(name, user_id, run_job, name, data, priority=priority):
+            self.jobs.finish(self.job_key(name, data))
+            self.share_result(data, None)
+            self.stats.job_rejected(self.job_key(name, data))
+            self.commands_total.inc(outcome='rejected')
+            self.comm.create_response(
+                message=f"**コマンド実行拒否**\\n`{command}`\\n\\n実行キューが満杯です。しばらくしてから再試行してください。",
+                status='error',
+                command=command,
+                error='Execution queue is full',
+                idempotency_key=self.job_key(name, data)
+            )
+            self.journal.record(self.job_key(name, data), STATE_DONE)
+            self.comm.finish_command(name)
+            return
+        
+        self.commands_total.inc(outcome='queued')
+        logger.info(f"Command queued: {command} ({self.pool.stats()['queued']} waiting)")
+        self.notify_queue_position(name, data)
+    
+    def find_dangerous(self, data: Dict[str, Any]) -> Optional[tuple]:
+        """危険なコマンドなら (規則名, コマンド) を返す（バッチは最初に見つかった危険なステップ）"""
+        commands = [step.get('command', '') for step in data['batch']] if data.get('batch') \
+            else [data.get('command', '')]
+        for command in commands:
+            rule = self.classifier.classify(command)
+            if rule:
+                return rule, command
+        return None
+    
+    def cache_key(self, data: Dict[str, Any]):
+        """結果キャッシュのキー（キャッシュ無効・対象外のコマンド・セッションモード・バッチ・承認されたコマンドならNone）"""
+        if self.result_cache is None or data.get('session', SESSION_MODE) or data.get('batch') \
+                or data.get('approved'):
+            return None
+        return self.result_cache.key(data.get('command', ''), os.path.expanduser("~"))
+    
+    def share_result(self, data: Dict[str, Any], result: Optional[Dict[str, Any]]):
+        """相乗りしていたコマンドに同じ結果を返す（結果が無ければそれぞれ改めて受け付ける）"""
+        cache_key = self.cache_key(data)
+        if cache_key is None:
+            return
+        if result is not None and result.get('cancelled'):
+            # キャンセルは相乗りしていたコマンドには関係ないので、それぞれ改めて実行する
+            result = None
+        for name, waiter in self.result_cache.complete(cache_key, result):
+            if result is None:
+                self.process_command(name, waiter)
+            else:
+                self.respond_command_result(name, waiter.get('command', ''), self.job_key(name, waiter), result)
+    
+    def notify_queue_position(self, name: str, data: Dict[str, Any]):
+        """すぐに実行されなかったジョブの実行待ちの順番をBotに知らせる
+
+        seq 0 の進捗レコードとして書くので、Bot側では同じメッセージが進捗・結果で置き換わる。
+        """
+        position = self.pool.position(name)
+        if position is None:
+            return
+        # 空いているワーカーがすぐに取り出す順番なら知らせない（レコードを書く分だけ遅くなる）
+        stats = self.pool.stats()
+        if position <= stats['max_workers'] - stats['active']:
+            return
+        job_id = self.job_key(name, data)
+        self.comm.create_progress(
+            job_id, 0, "",
+            command=data.get('command', ''),
+            queued=True,
+            position=position
+        )
+        logger.info(f"Job {job_id} waiting at position {position}")
+    
+    def recover_job(self, name: str, data: Dict[str, Any]) -> bool:
+        """ジャーナルを見て、再実行してはいけないコマンドを片付ける（片付けたらTrue）"""
+        key = self.job_key(name, data)
+        self.journal.refresh()
+        state = self.journal.get(key)
+        
+        if state == STATE_DONE:
+            # レスポンスは書き込み済み（処理済みにする前に停止した）
+            logger.info(f"Skipping already completed job: {key}")
+        elif state == STATE_RUNNING:
+            # 実行途中で停止した。副作用があり得るため自動では再実行しない
+            command = data.get('command', '')
+            logger.warning(f"Job interrupted by executor restart: {key}")
+            self.comm.create_response(
+                message=f"**コマンド実行中断**\\n`{command}`\\n\\n実行中に実行エンジンが停止しました。必要であれば再実行してください。",
+                status='error',
+                command=command,
+                job_id=key,
+                error='Interrupted by executor restart',
+                idempotency_key=key
+            )
+            self.journal.record(key, STATE_DONE)
+        else:
+            return False
+        
+        self.commands_total.inc(outcome='recovered')
+        self.finish_job_record(name)
+        return True
+    
+    def begin_job(self, job_id: str):
+        """ジョブの実行開始を記録"""
+        self.journal.record(job_id, STATE_RUNNING)
+        self.jobs.start(job_id)
+        wait = self.stats.job_started(job_id)
+        if wait is not None:
+            self.queue_wait_seconds.observe(wait)
+    
+    def prepare_job(self, name: str, data: Dict[str, Any]) -> tuple:
+        """ジョブのコマンド・job_id・進捗配信・セッションのユーザーを準備"""
+        command = data.get('command', '')
+        job_id = self.job_key(name, data)
+        self.begin_job(job_id)
+        
+        # ストリーミングモードでは進捗レコードを逐次書き出す
+        publisher = None
+        if data.get('stream', STREAM_OUTPUT):
+            publisher = ProgressPublisher(self.comm, job_id, command, interval=STREAM_INTERVAL)
+        
+        # セッションモードではユーザーごとの常駐シェルで実行する
+        session_user = None
+        if data.get('session', SESSION_MODE):
+            session_user = str(data.get('user_id', data.get('user_name', 'unknown')))
+        
+        return command, job_id, publisher, session_user
+    
+    def run_command_job(self, name: str, data: Dict[str, Any]):
+        """ワーカースレッドでコマンドを実行し、レスポンスを1件書き込む"""
+        # 準備に失敗しても相乗りしている同じコマンドに結果（なし）を返すよう、準備から try の中で行う
+        job_id = self.job_key(name, data)
+        result = None
+        try:
+            command, job_id, publisher, session_user = self.prepare_job(name, data)
+            logger.info(f"Executing command: {command}")
+            
+            result = self.execute_command(
+                command,
+                on_output=publisher.feed if publisher else None,
+                job_id=job_id,
+                session_user=session_user,
+                user_id=data.get('user_id')
+            )
+            result = self.check_cancelled(job_id, result)
+            self.respond_command_result(name, command, job_id, result)
+        finally:
+            self.jobs.finish(job_id)
+            self.share_result(data, result)
+    
+    def run_batch_job(self, name: str, data: Dict[str, Any]):
+        """ワーカースレッドでバッチを実行し、まとめたレスポンスを1件書き込む
+        
+        独立したステップは BATCH_MAX_PARALLEL 件まで並列に実行する。
+        ステップはセッション・ストリーミングを使わず、それぞれ新しいプロセスグループで実行する。
+        """
+        job_id = self.job_key(name, data)
+        plan = self.start_batch(name, job_id, data)
+        if plan is None:
+            return
+        try:
+            results = run_plan(
+                plan,
+                lambda step: self.run_batch_step(job_id, step, data),
+                max_parallel=BATCH_MAX_PARALLEL,
+                is_cancelled=lambda: self.is_cancelled(job_id)
+            )
+            self.respond_batch_result(name, job_id, data, plan, results)
+        finally:
+            self.jobs.finish(job_id)
+    
+    def start_batch(self, name: str, job_id: str, data: Dict[str, Any]) -> Optional[BatchPlan]:
+        """バッチの実行開始を記録して実行計画を返す（指定が正しくなければエラーを返してNone）"""
+        self.begin_job(job_id)
+        try:
+            plan = BatchPlan(validate_steps(data.get('batch') or []))
+        except BatchError as e:
+            self.jobs.finish(job_id)
+            self.respond_command_result(name, data.get('command', ''), job_id, {'success': False, 'error': str(e)})
+            return None
+        logger.info(f"Executing batch {job_id}: {len(plan.order)} steps")
+        return plan
+    
+    def is_cancelled(self, job_id: str) -> bool:
+        entry = self.jobs.get(job_id)
+        return entry is not None and entry.cancelled
+    
+    def begin_batch_step(self, job_id: str, step: Dict[str, Any], data: Dict[str, Any]) -> str:
+        """バッチのステップをジョブ一覧に載せる（/jobs に表示され、個別にもキャンセルできる）"""
+        step_id = f"{job_id}.{step['name']}"
+        self.jobs.add(step_id, step_id, step['command'], data.get('user_id', ''),
+                      data.get('user_name', ''), parent=job_id)
+        self.jobs.start(step_id)
+        return step_id
+    
+    def run_batch_step(self, job_id: str, step: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        """バッチの1ステップを実行"""
+        step_id = self.begin_batch_step(job_id, step, data)
+        try:
+            result = self.execute_command(step['command'], job_id=step_id, user_id=data.get('user_id'))
+            return self.check_cancelled(step_id, result)
+        finally:
+            self.jobs.finish(step_id)
+    
+    def respond_batch_result(self, name: str, job_id: str, data: Dict[str, Any],
+                             plan: BatchPlan, results: Dict[str, Dict[str, Any]]):
+        """バッチの結果を1件のレスポンスにまとめ、ステップごとの出力を1つの添付ファイルにする"""
+        counts = plan.counts()
+        cancelled = self.check_cancelled(job_id, {})
+        succeeded = counts.get(STEP_SUCCESS, 0) == len(plan.order)
+        if cancelled.get('cancelled'):
+            title, status = f"**バッチ実行キャンセル**（{cancelled['cancelled_by']}がキャンセルしました）", 'cancelled'
+        elif succeeded:
+            title, status = "**バッチ実行完了**", 'success'
+        else:
+            title, status = "**バッチ実行失敗**", 'error'
+        
+        summary = " / ".join(
+            f"{label} {counts[state]}" for state, label in (
+                (STEP_SUCCESS, "成功"), (STEP_FAILED, "失敗"),
+                (STEP_SKIPPED, "スキップ"), (STEP_CANCELLED, "キャンセル"),
+            ) if counts.get(state)
+        )
+        lines = [f"{title}\\n{summary}\\n"]
+        for step_name in plan.order:
+            lines.append(self.format_batch_step(plan.steps[step_name], plan.states[step_name],
+                                                results.get(step_name)))
+        message = "\\n".join(lines)
+        if len(message) > 3800:
+            message = message[:3800] + "\\n…"
+        
+        # ステップごとの出力を <ステップ名>/stdout.log のようにまとめる
+        members = [
+            (f"{step_name}/{stream_name}.log", path)
+            for step_name in plan.order
+            for stream_name, path in (results.get(step_name) or {}).get('outputs', {}).items()
+        ]
+        bundle = self.output_store.bundle(f"{job_id}_batch", members)
+        attachments = [{'path': str(bundle), 'filename': bundle.name}] if bundle else []
+        
+        self.comm.create_response(
+            message=message,
+            status=status,
+            command=data.get('command', ''),
+            job_id=job_id,
+            steps={step_name: plan.states[step_name] for step_name in plan.order},
+            attachments=attachments,
+            idempotency_key=job_id
+        )
+        self.complete_job(name, job_id, {'success': succeeded, 'cancelled': cancelled.get('cancelled')})
+    
+    @staticmethod
+    def format_batch_step(step: Dict[str, Any], state: str, result: Optional[Dict[str, Any]]) -> str:
+        """バッチの結果のステップ1行分"""
+        command = step['command'].replace('`', "'")[:60]
+        line = f"`{step['name']}` `{command}`"
+        if state == STEP_SKIPPED:
+            return f"⏭️ {line} スキップ（依存先が成功しなかった）"
+        if state == STEP_CANCELLED:
+            return f"🛑 {line} キャンセル"
+        duration = f"{result['duration']:.1f}秒" if result and 'duration' in result else ""
+        if state == STEP_SUCCESS:
+            return f"✅ {line} {duration}"
+        if result and result.get('success'):
+            return f"❌ {line} 終了コード {result.get('returncode')} {duration}"
+        return f"❌ {line} エラー: {(result or {}).get('error', '不明')}"
+    
+    def respond_command_result(self, name: str, command: str, job_id: str, result: Dict[str, Any]):
+        """実行結果のレスポンスを書き込み、コマンドを処理済みにする"""
+        attachments = self.build_attachments(result)
         
         # 結果をレスポンスファイルに書き込み
         if result['success']:
@@ -140,91 +719,202 @@ class CommandExecutor:
             
             if result['stdout']:
                 message += f"**出力:**\\n```\\n{result['stdout'][:1000]}\\n```"
-                if len(result['stdout']) > 1000:
-                    message += "\\n*(出力は1000文字で切り詰められました)*"
+                if result['stdout_chars'] > 1000:
+                    message += "\\n*(出力は1000文字で切り詰められました。全出力は添付ファイルを参照)*"
             
             if result['stderr']:
                 message += f"\\n\\n**エラー出力:**\\n```\\n{result['stderr'][:500]}\\n```"
+                if result['stderr_chars'] > 500:
+                    message += "\\n*(エラー出力は500文字で切り詰められました。全出力は添付ファイルを参照)*"
+            
+            if result.get('cached_age') is not None:
+                message += f"\\n*({result['cached_age']:.0f}秒前の実行結果です)*"
             
             self.comm.create_response(
                 message=message,
                 status='success',
                 command=command,
-                returncode=result['returncode']
+                job_id=job_id,
+                returncode=result['returncode'],
+                attachments=attachments,
+                resources=result.get('resources'),
+                idempotency_key=job_id
+            )
+        elif result.get('cancelled'):
+            self.comm.create_response(
+                message=f"**コマンド実行キャンセル**\\n`{command}`\\n\\n{result['cancelled_by']}がキャンセルしました。",
+                status='cancelled',
+                command=command,
+                job_id=job_id,
+                error=result['error'],
+                attachments=attachments,
+                resources=result.get('resources'),
+                idempotency_key=job_id
             )
         else:
             self.comm.create_response(
                 message=f"**コマンド実行失敗**\\n`{command}`\\n\\nエラー: {result['error']}",
                 status='error',
                 command=command,
-                error=result['error']
+                job_id=job_id,
+                error=result['error'],
+                attachments=attachments,
+                resources=result.get('resources'),
+                idempotency_key=job_id
             )
         
-        # 処理済みファイルを削除
-        filepath.unlink()
-        logger.info(f"Command processed and file deleted: {filepath}")
+        self.complete_job(name, job_id, result)
+    
+    def complete_job(self, name: str, job_id: str, result: Dict[str, Any]):
+        """レスポンスを書き込んだジョブを処理済みにし、メトリクスを記録"""
+        # 処理済みコマンドを削除（先に完了を記録し、削除前に停止しても再実行しない）
+        self.journal.record(job_id, STATE_DONE)
+        duration = self.stats.job_finished(job_id)
+        if duration is not None:
+            self.execution_seconds.observe(duration)
+        if result.get('timed_out'):
+            self.jobs_total.inc(status='timeout')
+        elif result.get('cancelled'):
+            self.jobs_total.inc(status='cancelled')
+        else:
+            self.jobs_total.inc(status='success' if result['success'] else 'error')
+        self.finish_job_record(name)
+        logger.info(f"Command processed and deleted: {name}")
+    
+    def finish_job_record(self, name: str):
+        """処理済みのジョブのレコードを削除
+        
+        承認されたジョブ（name が承認待ちの名前）は承認待ちと承認結果を削除する。
+        元のコマンドは承認待ちにした時点で処理済みなので、コマンドとしては何もしない。
+        """
+        if name.startswith('pending_'):
+            self.comm.remove_pending(name)
+            self.comm.finish_approval(f"approval_{name}")
+        else:
+            self.comm.finish_command(name)
     
     def handle_approval_response(self, approval_file: Path):
-        """承認レスポンスを処理"""
+        """承認レスポンスファイルを処理"""
         logger.info(f"Processing approval response: {approval_file}")
         
-        data = self.comm.read_json_safe(approval_file)
-        if not data:
-            approval_file.unlink()
-            return
-        
-        # 対応する pending ファイルを探す
-        pending_filename = approval_file.name.replace('approval_pending_', 'pending_')
-        pending_files = list(self.comm.pending_dir.glob(f"{pending_filename}*"))
+        data = self.comm.claim_approval(approval_file.name)
+        if data:
+            self.process_approval(approval_file.name, data)
+    
+    def process_approval(self, approval_name: str, data: Dict[str, Any]):
+        """承認/拒否の結果を処理
         
-        if not pending_files:
-            logger.warning(f"No pending file found for approval: {approval_file}")
-            approval_file.unlink()
+        承認待ちにしたコマンドは手元に保持しているのでジョブIDで取り出す。
+        保持していなければ（他の実行エンジンが承認待ちにした、再起動した）スプールの承認待ちを読む。
+        承認されたコマンドは承認待ちの名前をコマンド名として通常のジョブと同じ経路で実行し、
+        承認待ちと承認結果はジャーナルに完了を記録してから削除する（Botは削除しない）。
+        途中で停止しても承認結果はリース切れで戻り、ジャーナルを見て再実行せずに片付けられる。
+        """
+        pending_name = approval_name[len('approval_'):]
+        job_id = data.get('job_id') or job_id_of(pending_name)
+        if self.jobs.get(job_id) is not None:
+            # 同じ承認待ちへの重複した回答（先に届いたものを実行中）
+            logger.info(f"Approval for job {job_id} is already being processed")
             return
+        pending_data = self.held.take(job_id) or self.comm.get_pending(pending_name)
         
-        # pending ファイルから元のコマンド情報を取得
-        pending_data = self.comm.read_json_safe(pending_files[0])
         if not pending_data:
-            approval_file.unlink()
+            logger.warning(f"No pending entry found for approval: {approval_name}")
+            self.comm.finish_approval(approval_name)
             return
         
-        # 承認された場合
-        if data.get('approval', False):
-            command = pending_data.get('command', '')
-            logger.info(f"Command approved, executing: {command}")
-            
-            # コマンド実行
-            result = self.execute_command(command)
-            
-            # 結果を送信
-            if result['success']:
-                message = f"**承認されたコマンドを実行しました**\\n`{command}`\\n\\n"
-                if result['stdout']:
-                    message += f"**出力:**\\n```\\n{result['stdout'][:1000]}\\n```"
-                self.comm.create_response(message=message, status='success')
-            else:
-                self.comm.create_response(
-                    message=f"**コマンド実行失敗**\\n`{command}`\\n\\nエラー: {result['error']}",
-                    status='error'
-                )
-        else:
+        command = pending_data.get('command', '')
+        job_data = dict(pending_data, job_id=job_id, approved=True, session=False)
+        
+        # 元のコマンドがあれば削除
+        original_file = pending_data.get('original_file')
+        if original_file:
+            self.comm.finish_command(original_file)
+        
+        if self.recover_job(pending_name, job_data):
+            return
+        self.journal.record(job_id, STATE_RECEIVED)
+        
+        if not data.get('approval', False):
             # 拒否された場合
             logger.info("Command rejected by user")
+            self.approvals_total.inc(decision='rejected')
             self.comm.create_response(
                 message="コマンドの実行がキャンセルされました。",
-                status='cancelled'
+                status='cancelled',
+                command=command,
+                job_id=job_id,
+                idempotency_key=job_id
             )
+            self.journal.record(job_id, STATE_DONE)
+            self.finish_job_record(pending_name)
+            return
         
-        # 元のコマンドファイルがあれば削除
-        original_file = pending_data.get('original_file')
-        if original_file:
-            original_path = self.comm.command_dir / original_file
-            if original_path.exists():
-                original_path.unlink()
+        # 承認された場合
+        logger.info(f"Command approved, queueing: {command}")
+        self.approvals_total.inc(decision='approved')
+        user_id = pending_data.get('user_id', pending_data.get('user_name', 'unknown'))
+        run_job = self.run_batch_job if job_data.get('batch') else self.run_command_job
+        self.stats.job_queued(job_id)
+        self.jobs.add(job_id, pending_name, command, user_id, pending_data.get('user_name', ''), job_data)
+        priority = parse_priority(pending_data.get('priority'))
+        if not self.pool.submit(pending_name, user_id, run_job, pending_name, job_data, priority=priority):
+            self.jobs.finish(job_id)
+            self.stats.job_rejected(job_id)
+            self.comm.create_response(
+                message=f"**コマンド実行拒否**\\n`{command}`\\n\\n実行キューが満杯です。しばらくしてから再試行してください。",
+                status='error',
+                command=command,
+                job_id=job_id,
+                error='Execution queue is full',
+                idempotency_key=job_id
+            )
+            self.journal.record(job_id, STATE_DONE)
+            self.finish_job_record(pending_name)
+    
+    def check_cancelled(self, job_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """実行中にキャンセルされたジョブの結果をキャンセルの結果に置き換える"""
+        entry = self.jobs.get(job_id)
+        if entry is None or not entry.cancelled:
+            return result
+        return {
+            'success': False,
+            'cancelled': True,
+            'cancelled_by': entry.cancelled_by,
+            'error': f"Cancelled by {entry.cancelled_by}",
+            'outputs': result.get('outputs', {}),
+            'resources': result.get('resources')
+        }
+    
+    def cancel_job(self, job_id: str, requested_by: str = "") -> bool:
+        """ジョブをキャンセル（このエンジンのジョブでなければFalse）
         
-        # クリーンアップ
-        approval_file.unlink()
-        pending_files[0].unlink()
+        実行待ちならプールから取り除いてすぐにキャンセルの結果を返し、
+        実行中ならプロセスグループごと終了させる（結果は実行していたワーカーが返す）。
+        """
+        entry = self.jobs.cancel(job_id, requested_by)
+        if entry is None:
+            return False
+        logger.info(f"Cancel requested for job {job_id} by {entry.cancelled_by}")
+        if self.pool.cancel(entry.pool_key) is None:
+            return True
+        
+        # 実行待ちだった
+        result = self.check_cancelled(job_id, {})
+        self.jobs.finish(job_id)
+        self.stats.job_rejected(job_id)
+        self.respond_command_result(entry.pool_key, entry.command, job_id, result)
+        self.share_result(entry.data or {}, None)
+        return True
+    
+    def process_cancel_requests(self):
+        """Botからのキャンセル要求のうち、このエンジンのジョブのものを処理する"""
+        for request in read_cancel_requests(self.stats.state_dir):
+            try:
+                if self.cancel_job(request.get('job_id', ''), request.get('user_name', '')):
+                    remove_cancel_request(request['path'])
+            except Exception as e:
+                logger.error(f"Failed to cancel job {request.get('job_id')}: {e}")
     
     def start(self):
         """実行エンジンを開始"""
@@ -234,30 +924,76 @@ class CommandExecutor:
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         
-        # コマンドファイル監視開始
-        self.command_watcher = FileWatcher(
-            self.comm.command_dir,
-            self.process_command_file
-        )
-        self.command_watcher.start()
+        # ワーカープール起動
+        self.pool.start()
         
-        # 承認レスポンス監視
-        self.approval_watcher = FileWatcher(
-            self.comm.response_dir,
-            lambda f: self.handle_approval_response(f) if f.name.startswith('approval_') else None
-        )
-        self.approval_watcher.start()
+        # 前回の実行で処理中のまま残ったコマンドを戻す（ジャーナルで再実行の要否を判定する）
+        self.comm.release_claims()
+        
+        # Botとの直接通信・メトリクスの公開を開始
+        if self.socket_server:
+            self.socket_server.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+        
+        if isinstance(self.backend, FileCommunicator):
+            self.backend.move_legacy_approvals()
+            
+            # コマンドファイル監視開始
+            self.command_watcher = create_file_watcher(
+                self.comm.command_dir,
+                self.on_command_file,
+                on_remove=self.queue_index.forget
+            )
+            self.command_watcher.start()
+            
+            # 承認結果の監視
+            self.approval_watcher = create_file_watcher(
+                self.comm.approval_dir,
+                self.on_approval_file,
+                on_remove=self.queue_index.forget
+            )
+            self.approval_watcher.start()
+            
+            # レスポンス・承認待ちファイルは掃除の索引に登録するだけ
+            self.response_watcher = create_file_watcher(
+                self.comm.response_dir,
+                self.spool_index.track,
+                on_remove=self.spool_index.forget
+            )
+            self.response_watcher.start()
+            self.pending_watcher = create_file_watcher(
+                self.comm.pending_dir,
+                self.queue_index.track,
+                on_remove=self.queue_index.forget
+            )
+            self.pending_watcher.start()
+        else:
+            # データベースから未処理のコマンドと承認結果を取得
+            self.claim_thread = threading.Thread(target=self._claim_loop, daemon=True)
+            self.claim_thread.start()
         
         logger.info("Command executor started. Waiting for commands...")
         
         # メインループ
         try:
             while self.running:
-                time.sleep(1)
+                time.sleep(CANCEL_POLL_INTERVAL)
+                
+                # Botからのキャンセル要求
+                self.process_cancel_requests()
+                
+                # 使われていない常駐シェルを終了
+                self.sessions.evict_idle()
                 
-                # 定期的なクリーンアップ（1時間ごと）
-                if int(time.time()) % 3600 == 0:
-                    self.comm.cleanup_old_files(hours=24)
+                # リースの延長と、停止した実行エンジンのコマンドの再取得
+                self.maintain_leases()
+                
+                # 統計と死活情報（ハートビート）を書き出す
+                self.write_stats()
+                
+                # 期限切れ・上限超過のファイルを少しずつ削除
+                self.run_janitor()
                     
         except KeyboardInterrupt:
             logger.info("Received keyboard interrupt")
@@ -273,18 +1009,381 @@ class CommandExecutor:
             self.command_watcher.stop()
         if self.approval_watcher:
             self.approval_watcher.stop()
+        if self.response_watcher:
+            self.response_watcher.stop()
+        if self.pending_watcher:
+            self.pending_watcher.stop()
+        if self.claim_thread:
+            self.claim_thread.join(timeout=5)
+        if self.socket_server:
+            self.socket_server.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        
+        # 実行中のジョブの完了を待つ
+        self.pool.stop()
+        self.sessions.close_all()
+        self.stats.remove()
         
         logger.info("Command executor stopped")
     
+    def write_stats(self, force: bool = False):
+        """一定間隔で統計と死活情報を状態ファイルに書き出す
+        
+        ジョブがある間（と無くなった直後の1回）は、/jobs の出力量などが古くならないよう
+        JOBS_REFRESH_INTERVAL ごとに書き出す。
+        """
+        now = time.monotonic()
+        elapsed = now - self.last_stats_write
+        busy = len(self.jobs) > 0 or self.stats_had_jobs
+        if not force and elapsed < STATS_INTERVAL and not (busy and elapsed >= JOBS_REFRESH_INTERVAL):
+            return
+        self.last_stats_write = now
+        pool_stats = self.pool.stats()
+        jobs = self.jobs.snapshot()
+        self.stats_had_jobs = bool(jobs)
+        self.stats.write(queued=pool_stats['queued'], active=pool_stats['active'], jobs=jobs)
+    
+    def maintain_leases(self, force: bool = False):
+        """処理中のコマンドのリースを延長し、期限切れのものを未処理に戻す（リースの1/3ごと）"""
+        now = time.monotonic()
+        if not force and now - self.last_lease_check < LEASE_SECONDS / 3:
+            return
+        self.last_lease_check = now
+        try:
+            self.comm.renew_leases()
+            self.comm.reclaim_expired(LEASE_SECONDS)
+        except Exception as e:
+            logger.error(f"Lease maintenance error: {e}")
+    
+    def handle_socket_message(self, kind: str, name: str, data: Dict[str, Any]) -> bool:
+        """ソケット経由で届いたコマンド・承認結果を処理中として保存してから処理
+        
+        保存できたときだけTrueを返してBotに受領を返す（返さなければBotがスプールに書き込む）。
+        保存したレコードはスプール経由のものと同じく、停止してもジャーナルで回復される。
+        """
+        if kind not in (KIND_COMMAND, KIND_APPROVAL):
+            logger.warning(f"Unexpected socket message kind: {kind}")
+            return False
+        if not self.backend.adopt_record(kind, name, data):
+            return False
+        try:
+            if kind == KIND_COMMAND:
+                self.process_command(name, data)
+            else:
+                self.process_approval(name, data)
+        except Exception as e:
+            # 保存済みなので受領は返す（スプール経由で処理に失敗した場合と同じく取得済みのまま残る）
+            logger.error(f"Error processing socket message {name}: {e}")
+        return True
+    
+    def _claim_loop(self):
+        """データベースバックエンド用の取得ループ"""
+        while self.running:
+            try:
+                claimed = False
+                
+                approval = self.comm.claim_next_approval()
+                if approval:
+                    claimed = True
+                    self.process_approval(*approval)
+                
+                command = self.comm.claim_next_command()
+                if command:
+                    claimed = True
+                    self.process_command(*command)
+                
+                if not claimed:
+                    time.sleep(SQLITE_POLL_INTERVAL)
+                    
+            except Exception as e:
+                logger.error(f"Claim loop error: {e}")
+                time.sleep(SQLITE_POLL_INTERVAL)
+    
     def _signal_handler(self, signum, frame):
         """シグナルハンドラ"""
         logger.info(f"Received signal {signum}")
         self.running = False
 
 
+class AsyncCommandExecutor(CommandExecutor):
+    """asyncio版のコマンド実行クラス
+    
+    監視・実行・タイムアウトを1つのイベントループで扱うため、ジョブごとのスレッドを使わない。
+    SIGTERM/SIGINTを受けると新規受付を止め、実行中のジョブの完了を待ってから終了する。
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.pool = AsyncJobPool(
+            max_workers=int(os.getenv('EXECUTOR_MAX_WORKERS', 4)),
+            per_user_limit=int(os.getenv('EXECUTOR_PER_USER_LIMIT', 2)),
+            max_queue=int(os.getenv('EXECUTOR_MAX_QUEUE', 100)),
+            scheduler=FairScheduler.from_env()
+        )
+        self.stop_event = None
+        self.background_tasks = []
+    
+    async def execute_command_async(self, command: str,
+                                    on_output: Optional[Callable[[Optional[str], str], None]] = None,
+                                    job_id: Optional[str] = None,
+                                    user_id: Optional[str] = None) -> Dict[str, Any]:
+        """コマンドを実行（execute_command のasyncio版、キャンセル可能）"""
+        job_id = job_id or f"job_{time.time_ns()}"
+        spool = self.output_store.open_spool(job_id)
+        self.jobs.attach(job_id, output=spool)
+        limits = self.limits.for_user(user_id)
+        cgroup = self.limits.create_cgroup(job_id, limits)
+        
+        def handle_output(stream_name, text):
+            spool.feed(stream_name, text)
+            if on_output is not None:
+                on_output(stream_name, text)
+        
+        try:
+            # rusage を取得するため asyncio の子プロセス監視を使わずに起動する
+            proc = await AsyncProcess.spawn(
+                LimitPolicy.wrap(command, limits, cgroup),
+                cwd=os.path.expanduser("~"),
+                preexec_fn=LimitPolicy.preexec(limits, cgroup)
+            )
+            self.jobs.attach(job_id, proc)
+            # タイムアウト設定（5分）。タイムアウト・キャンセル時は孫プロセスも含めて終了させる
+            result = await stream_process_async(
+                proc,
+                timeout=300,
+                on_output=handle_output,
+                capture_limit=OUTPUT_PREVIEW_CHARS,
+                process_group=True
+            )
+        except Exception as e:
+            for path in spool.close().values():
+                self.output_store.discard(path)
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        except asyncio.CancelledError:
+            for path in spool.close().values():
+                self.output_store.discard(path)
+            raise
+        finally:
+            usage = self.limits.release_cgroup(cgroup)
+        
+        # cgroup があれば子孫のプロセスまで含めた使用量を使う
+        if usage:
+            result['rusage'] = dict(result.get('rusage') or {}, **usage)
+        return self.build_result(result, spool.close())
+    
+    async def run_command_job(self, name: str, data: Dict[str, Any]):
+        """イベントループ上でコマンドを実行し、レスポンスを1件書き込む"""
+        # 準備に失敗しても相乗りしている同じコマンドに結果（なし）を返すよう、準備から try の中で行う
+        job_id = self.job_key(name, data)
+        result = None
+        try:
+            command, job_id, publisher, session_user = self.prepare_job(name, data)
+            logger.info(f"Executing command: {command}")
+            
+            if session_user is not None:
+                # 常駐シェルは同期APIのため別スレッドで待つ
+                result = await asyncio.to_thread(
+                    self.execute_command,
+                    command,
+                    on_output=publisher.feed if publisher else None,
+                    job_id=job_id,
+                    session_user=session_user
+                )
+            else:
+                result = await self.execute_command_async(
+                    command,
+                    on_output=publisher.feed if publisher else None,
+                    job_id=job_id,
+                    user_id=data.get('user_id')
+                )
+            result = self.check_cancelled(job_id, result)
+            # ソケットの受領待ちでイベントループを止めないよう、レスポンスは別スレッドで書き込む
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.respond_command_result, name, command, job_id, result
+            )
+        finally:
+            self.jobs.finish(job_id)
+            self.share_result(data, result)
+    
+    async def run_batch_job(self, name: str, data: Dict[str, Any]):
+        """イベントループ上でバッチを実行し、まとめたレスポンスを1件書き込む"""
+        job_id = self.job_key(name, data)
+        loop = asyncio.get_running_loop()
+        plan = await loop.run_in_executor(None, self.start_batch, name, job_id, data)
+        if plan is None:
+            return
+        
+        async def run_step(step):
+            step_id = self.begin_batch_step(job_id, step, data)
+            try:
+                result = await self.execute_command_async(
+                    step['command'], job_id=step_id, user_id=data.get('user_id')
+                )
+                return self.check_cancelled(step_id, result)
+            finally:
+                self.jobs.finish(step_id)
+        
+        try:
+            results = await run_plan_async(
+                plan, run_step,
+                max_parallel=BATCH_MAX_PARALLEL,
+                is_cancelled=lambda: self.is_cancelled(job_id)
+            )
+            await loop.run_in_executor(None, self.respond_batch_result, name, job_id, data, plan, results)
+        finally:
+            self.jobs.finish(job_id)
+    
+    def start(self):
+        """実行エンジンを開始"""
+        asyncio.run(self.run())
+    
+    async def run(self):
+        """イベントループ上のメイン処理"""
+        logger.info("Starting command executor (asyncio)...")
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        
+        # シグナルハンドラ設定
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self._request_stop, signum)
+        
+        self.pool.start()
+        self.comm.release_claims()
+        
+        # Botとの直接通信・メトリクスの公開を開始
+        if self.socket_server:
+            self.socket_server.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+        
+        if isinstance(self.backend, FileCommunicator):
+            self.backend.move_legacy_approvals()
+            
+            # コマンドファイル・承認結果の監視開始
+            self.command_watcher = AsyncFileWatcher(
+                self.comm.command_dir, self.on_command_file, on_remove=self.queue_index.forget
+            )
+            self.command_watcher.start()
+            self.approval_watcher = AsyncFileWatcher(
+                self.comm.approval_dir, self.on_approval_file, on_remove=self.queue_index.forget
+            )
+            self.approval_watcher.start()
+            self.response_watcher = AsyncFileWatcher(
+                self.comm.response_dir, self.spool_index.track, on_remove=self.spool_index.forget
+            )
+            self.response_watcher.start()
+            self.pending_watcher = AsyncFileWatcher(
+                self.comm.pending_dir, self.queue_index.track, on_remove=self.queue_index.forget
+            )
+            self.pending_watcher.start()
+        else:
+            self.background_tasks.append(loop.create_task(self._claim_loop_async()))
+        
+        self.background_tasks.append(loop.create_task(self._cleanup_loop()))
+        self.background_tasks.append(loop.create_task(self._janitor_loop()))
+        self.background_tasks.append(loop.create_task(self._lease_loop()))
+        self.background_tasks.append(loop.create_task(self._stats_loop()))
+        self.background_tasks.append(loop.create_task(self._cancel_loop()))
+        
+        logger.info("Command executor started. Waiting for commands...")
+        await self.stop_event.wait()
+        await self.shutdown()
+    
+    async def shutdown(self):
+        """新規受付を止め、実行中のジョブを待ってから停止"""
+        logger.info("Stopping command executor...")
+        self.running = False
+        
+        if self.command_watcher:
+            self.command_watcher.stop()
+        if self.approval_watcher:
+            self.approval_watcher.stop()
+        if self.response_watcher:
+            self.response_watcher.stop()
+        if self.pending_watcher:
+            self.pending_watcher.stop()
+        if self.socket_server:
+            self.socket_server.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        for task in self.background_tasks:
+            task.cancel()
+        
+        await self.pool.drain(timeout=DRAIN_TIMEOUT)
+        self.sessions.close_all()
+        self.stats.remove()
+        logger.info("Command executor stopped")
+    
+    def _request_stop(self, signum):
+        logger.info(f"Received signal {signum}")
+        self.stop_event.set()
+    
+    async def _claim_loop_async(self):
+        """データベースバックエンド用の取得ループ"""
+        while self.running:
+            try:
+                approval = self.comm.claim_next_approval()
+                if approval:
+                    self.process_approval(*approval)
+                
+                command = self.comm.claim_next_command()
+                if command:
+                    self.process_command(*command)
+                
+                if not approval and not command:
+                    await asyncio.sleep(SQLITE_POLL_INTERVAL)
+                    
+            except Exception as e:
+                logger.error(f"Claim loop error: {e}")
+                await asyncio.sleep(SQLITE_POLL_INTERVAL)
+    
+    async def _lease_loop(self):
+        """リースの延長と、停止した実行エンジンのコマンドの再取得"""
+        while True:
+            self.maintain_leases(force=True)
+            await asyncio.sleep(LEASE_SECONDS / 3)
+    
+    async def _stats_loop(self):
+        """統計と死活情報（ハートビート）の書き出し（間隔は write_stats が判断する）"""
+        while True:
+            self.write_stats()
+            await asyncio.sleep(JOBS_REFRESH_INTERVAL)
+    
+    async def _cancel_loop(self):
+        """Botからのキャンセル要求の確認"""
+        while True:
+            try:
+                self.process_cancel_requests()
+            except Exception as e:
+                logger.error(f"Cancel request error: {e}")
+            await asyncio.sleep(CANCEL_POLL_INTERVAL)
+    
+    async def _cleanup_loop(self):
+        """使われていない常駐シェルを1分ごとに終了"""
+        while True:
+            await asyncio.sleep(60)
+            self.sessions.evict_idle()
+    
+    async def _janitor_loop(self):
+        """期限切れ・上限超過のファイルの削除（ファイル操作はイベントループの外で行う）"""
+        while True:
+            try:
+                await asyncio.to_thread(self.run_janitor, True)
+            except Exception as e:
+                logger.error(f"Janitor error: {e}")
+            await asyncio.sleep(JANITOR_INTERVAL)
+
+
 def main():
     """メイン関数"""
-    executor = CommandExecutor()
+    if EXECUTOR_RUNTIME == 'asyncio':
+        executor = AsyncCommandExecutor()
+    else:
+        executor = CommandExecutor()
     executor.start()
 
 
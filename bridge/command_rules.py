@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+危険なコマンドの判定
+設定ファイルのルールを1つの正規表現にまとめ、コマンドをshlexで分解して1回の走査で判定する。
+パイプ・リダイレクト・サブシェル・sh -c・eval の中のコマンドも個別に判定する。
+引数の中の文字列リテラル（python3 -c 'os.system("...")' など）もコマンドとして判定する。
+"""
+
+import os
+import re
+import json
+import shlex
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_FILE = Path(__file__).parent / "dangerous_commands.json"
+
+# コマンドの区切りとみなす記号
+SEPARATORS = {';', '&', '&&', '|', '||', '|&', '(', ')', '()', '{', '}', '$', '$(', ';;', '\n'}
+# 入れ子になったコマンドの開始記号
+SUBSTITUTIONS = ('$(', '`', '<(', '>(')
+# パイプの記号（次の単純コマンドは標準入力を受け取る）
+PIPES = {'|', '|&'}
+# 引数の中の文字列リテラル（shlex が外側の引用符を外した後に残る内側の引用符）
+LITERAL_RE = re.compile(r"(?P<quote>[\"'])(?P<body>.+?)(?P=quote)")
+# sh -c などの入れ子を展開する深さの上限
+MAX_DEPTH = 4
+
+
+def _compile(rules: List[Dict[str, str]], prefix: str) -> Optional[re.Pattern]:
+    """ルールを名前付きグループの選択として1つの正規表現にまとめる"""
+    if not rules:
+        return None
+    parts = [f"(?P<{prefix}{i}>{rule['pattern']})" for i, rule in enumerate(rules)]
+    return re.compile("|".join(parts), re.MULTILINE)
+
+
+class CommandClassifier:
+    """危険なコマンドの判定器
+
+    ルールは4種類:
+    - command_rules: 正規化した単純コマンド（"rm -rf /" のように1行ずつ）に適用
+    - redirect_rules: リダイレクトの出力先に適用
+    - pipe_rules: パイプの受け手の単純コマンドに適用（"echo ... | sh" など）
+    - raw_rules: 空白を詰めたコマンド全体に適用（フォーク爆弾など分解できないもの）
+    ルールは1つの正規表現にまとめるため、後方参照には名前付きグループを使うこと。
+    """
+
+    def __init__(self, rules: Dict[str, Any], cache_size: int = 1024):
+        self.wrappers = set(rules.get('wrappers', []))
+        self.shells = set(rules.get('shells', []))
+        self.evaluators = set(rules.get('evaluators', []))
+        self.rule_names = {}
+        self.command_re = self._build(rules.get('command_rules', []), 'c')
+        self.redirect_re = self._build(rules.get('redirect_rules', []), 'r')
+        self.pipe_re = self._build(rules.get('pipe_rules', []), 'p')
+        self.raw_re = self._build(rules.get('raw_rules', []), 'w')
+        self._cached = lru_cache(maxsize=cache_size)(self._classify)
+
+    @classmethod
+    def from_file(cls, path: Optional[Path] = None, cache_size: int = 1024) -> 'CommandClassifier':
+        """設定ファイルから読み込む（未指定なら DANGEROUS_RULES_FILE または同梱のルール）"""
+        path = Path(path or os.getenv('DANGEROUS_RULES_FILE') or DEFAULT_RULES_FILE)
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+        classifier = cls(rules, cache_size=cache_size)
+        logger.info(f"Loaded {len(classifier.rule_names)} command rules from {path}")
+        return classifier
+
+    def _build(self, rules: List[Dict[str, str]], prefix: str) -> Optional[re.Pattern]:
+        for i, rule in enumerate(rules):
+            self.rule_names[f"{prefix}{i}"] = rule['name']
+        return _compile(rules, prefix)
+
+    def is_dangerous(self, command: str) -> bool:
+        """危険なコマンドならTrue"""
+        return self.classify(command) is not None
+
+    def classify(self, command: str) -> Optional[str]:
+        """該当したルール名を返す（該当なしならNone）"""
+        return self._cached(command.strip())
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+    def _classify(self, command: str) -> Optional[str]:
+        lowered = command.lower()
+
+        if self.raw_re:
+            match = self.raw_re.search(" ".join(lowered.split()))
+            if match:
+                return self.rule_names[match.lastgroup]
+
+        segments, targets, pipes = [], [], []
+        self._collect(lowered, segments, targets, pipes, 0)
+
+        for pattern, lines in ((self.command_re, segments), (self.redirect_re, targets), (self.pipe_re, pipes)):
+            if pattern and lines:
+                match = pattern.search("\n".join(lines))
+                if match:
+                    return self.rule_names[match.lastgroup]
+        return None
+
+    def _tokenize(self, command: str) -> List[str]:
+        # バッククォートは shlex が区切らないため、先に区切り記号に置き換える
+        lexer = shlex.shlex(command.replace('`', ' ; '), posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        try:
+            return list(lexer)
+        except ValueError:
+            # 引用符の閉じ忘れなど。判定を諦めず空白区切りで扱う
+            return command.replace('`', ' ; ').split()
+
+    def _collect(self, command: str, segments: List[str], targets: List[str], pipes: List[str], depth: int):
+        """コマンドを単純コマンド・リダイレクト先・パイプの受け手に分解する"""
+        if depth > MAX_DEPTH:
+            return
+
+        words: List[str] = []
+        piped = False
+        tokens = self._tokenize(command)
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if '>' in token and token.strip('<>&|') == '':
+                if i + 1 < len(tokens):
+                    targets.append(tokens[i + 1])
+                i += 2
+                continue
+            if token in SEPARATORS or token.strip('();&|{}$') == '':
+                self._flush(words, segments, targets, pipes, piped, depth)
+                # "| (sh)" のように受け手の前に括弧が続いてもパイプの受け手とみなす
+                piped = token in PIPES or (piped and not words)
+                words = []
+            else:
+                # 引用符内の $(...) などは1語になるため、中身を別のコマンドとして調べる
+                for marker in SUBSTITUTIONS:
+                    start = token.find(marker)
+                    if start >= 0:
+                        self._collect(token[start + len(marker):].rstrip(')'), segments, targets, pipes, depth + 1)
+                words.append(token)
+            i += 1
+        self._flush(words, segments, targets, pipes, piped, depth)
+
+    def _flush(self, words: List[str], segments: List[str], targets: List[str], pipes: List[str],
+               piped: bool, depth: int):
+        """単純コマンドを正規化して追加（ラッパーや変数代入は外す）"""
+        while words and ('=' in words[0] and not words[0].startswith('=')):
+            words = words[1:]
+        while words and os.path.basename(words[0]) in self.wrappers:
+            words = words[1:]
+            # env -i / timeout 10 / nice -n 5 などの引数を読み飛ばす
+            while words and (words[0].startswith('-') or '=' in words[0] or words[0].isdigit()):
+                words = words[1:]
+        if not words:
+            return
+
+        name = os.path.basename(words[0])
+        if name in self.shells:
+            script = self._shell_script(words[1:])
+            if script is not None:
+                self._collect(script, segments, targets, pipes, depth + 1)
+        elif name in self.evaluators:
+            self._collect(" ".join(words[1:]), segments, targets, pipes, depth + 1)
+        # 引数の中の文字列リテラルは別のコマンドとして調べる（外側の引用符だけの引数はデータとみなす）
+        for word in words[1:]:
+            for literal in LITERAL_RE.finditer(word):
+                self._collect(literal.group('body'), segments, targets, pipes, depth + 1)
+        segment = " ".join([name] + words[1:]).replace('\n', ' ')
+        segments.append(segment)
+        if piped:
+            pipes.append(segment)
+
+    @staticmethod
+    def _shell_script(args: List[str]) -> Optional[str]:
+        """sh -c / bash -lc などで渡されたスクリプト（-c がなければNone）"""
+        for i, arg in enumerate(args):
+            if arg.startswith('-') and not arg.startswith('--') and 'c' in arg[1:]:
+                for script in args[i + 1:]:
+                    if not script.startswith('-'):
+                        return script
+                return None
+        return None
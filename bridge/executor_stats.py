@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+実行エンジンの統計と死活情報
+キュー待ち時間・実行中件数・スループットを実行エンジンのメモリ上で集計し、
+小さな状態ファイル（state/executor-<worker_id>.json）に定期的に書き出す。
+Bot の /status はスプールを数え直さずに、この状態ファイルだけを読む。
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# スループットを集計する期間（秒）
+THROUGHPUT_WINDOWS = (60, 300, 900)
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """昇順に並んだ値のパーセンタイル（最近傍法、値が無ければNone）"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+class ExecutorStats:
+    """実行エンジンの統計
+
+    - job_queued / job_started / job_finished をジョブの状態遷移ごとに呼ぶ
+    - キュー待ち時間は直近 latency_samples 件から、スループットは直近15分の完了時刻から求める
+    """
+
+    def __init__(self, worker_id: str, state_dir: Path, latency_samples: int = 1000):
+        self.worker_id = worker_id
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.state_dir / f"executor-{worker_id}.json"
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.enqueued: Dict[str, float] = {}
+        self.running: Dict[str, float] = {}
+        self.latencies = deque(maxlen=latency_samples)
+        self.completions = deque()
+        self.completed_total = 0
+
+    def job_queued(self, job_id: str, now: Optional[float] = None):
+        """ジョブを実行待ちに入れた"""
+        with self.lock:
+            self.enqueued[job_id] = time.monotonic() if now is None else now
+
+    def job_started(self, job_id: str, now: Optional[float] = None) -> Optional[float]:
+        """ジョブの実行を開始した（待ち時間を記録して返す）"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.running[job_id] = now
+            enqueued = self.enqueued.pop(job_id, None)
+            if enqueued is None:
+                return None
+            self.latencies.append(now - enqueued)
+            return now - enqueued
+
+    def job_rejected(self, job_id: str):
+        """実行待ちに入れられなかった（キュー満杯など）"""
+        with self.lock:
+            self.enqueued.pop(job_id, None)
+
+    def job_finished(self, job_id: str, now: Optional[float] = None) -> Optional[float]:
+        """ジョブが完了した（実行時間を返す）"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.enqueued.pop(job_id, None)
+            started = self.running.pop(job_id, None)
+            self.completions.append(now)
+            self.completed_total += 1
+            self._trim(now)
+        return None if started is None else now - started
+
+    def _trim(self, now: float):
+        """最長の集計期間より古い完了時刻を捨てる（lock保持中に呼ぶ）"""
+        cutoff = now - THROUGHPUT_WINDOWS[-1]
+        while self.completions and self.completions[0] < cutoff:
+            self.completions.popleft()
+
+    def snapshot(self, queued: int, active: int, now: Optional[float] = None,
+                 jobs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """状態ファイルに書き出す内容（jobs は実行待ち・実行中のジョブの一覧）"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._trim(now)
+            latencies = sorted(self.latencies)
+            throughput = {
+                f"{window // 60}m": sum(1 for t in self.completions if t >= now - window) / (window / 60)
+                for window in THROUGHPUT_WINDOWS
+            }
+            completed_total = self.completed_total
+        return {
+            'worker_id': self.worker_id,
+            'pid': os.getpid(),
+            'heartbeat': time.time(),
+            'started_at': self.started_at,
+            'queued': queued,
+            'active': active,
+            'completed_total': completed_total,
+            'latency': {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'samples': len(latencies),
+            },
+            'throughput_per_min': throughput,
+            'jobs': jobs or [],
+        }
+
+    def write(self, queued: int, active: int, jobs: Optional[List[Dict[str, Any]]] = None):
+        """状態ファイルを書き出す（一時ファイルからの置き換えで、読み手は常に完全な内容を読む）"""
+        data = self.snapshot(queued, active, jobs=jobs)
+        temp_file = self.path.with_suffix('.tmp')
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temp_file, self.path)
+        except OSError as e:
+            logger.error(f"Failed to write executor state: {e}")
+
+    def remove(self):
+        """停止時に状態ファイルを削除"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def read_executor_states(state_dir: Path, max_age: float = 3600) -> List[Dict[str, Any]]:
+    """全実行エンジンの状態ファイルを読む（実行エンジンの数だけの小さなファイル）
+
+    max_age 秒以上更新されていない状態ファイルは、異常終了した実行エンジンのものとして削除する。
+    """
+    states = []
+    cutoff = time.time() - max_age
+    for path in sorted(Path(state_dir).glob("executor-*.json")):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                logger.info(f"Removed stale executor state: {path}")
+                continue
+            with open(path, 'r') as f:
+                states.append(json.load(f))
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read executor state {path}: {e}")
+    return states
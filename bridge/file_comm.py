@@ -5,117 +5,90 @@
 """
 
 import os
-import json
-import fcntl
+import sys
 import time
+import socket
+import select
+import struct
+import ctypes
+import ctypes.util
 import logging
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 import threading
+import asyncio
 import queue
 
+from bridge.spool_writer import SpoolWriter, read_record, decode_record
+from bridge.records import (
+    KIND_COMMAND, KIND_RESPONSE, KIND_PENDING, KIND_APPROVAL,
+    build_command, build_response, build_progress, build_pending, build_approval,
+)
+
 logger = logging.getLogger(__name__)
 
 class FileCommunicator:
     """ファイルベース通信を管理するクラス"""
     
-    def __init__(self, base_dir: str = "/tmp/claude-discord"):
+    def __init__(self, base_dir: str = "/tmp/claude-discord", worker_id: Optional[str] = None):
         self.base_dir = Path(base_dir)
         self.command_dir = self.base_dir / "commands"
         self.response_dir = self.base_dir / "responses"
         self.pending_dir = self.base_dir / "pending"
+        # 承認結果は専用のディレクトリに置く（レスポンスとして送信されないように）
+        self.approval_dir = self.base_dir / "approvals"
+        # 実行エンジンごとの処理中ディレクトリ（claimed/<worker_id>/）
+        self.claimed_root = self.base_dir / "claimed"
+        self.worker_id = worker_id or default_worker_id()
+        self.claimed_dir = self.claimed_root / self.worker_id
+        # Bot・実行エンジン共通の書き込み（アトミックな配置・形式・fsyncの設定）
+        self.writer = SpoolWriter.from_env()
         
         # ディレクトリ作成
-        for dir_path in [self.command_dir, self.response_dir, self.pending_dir]:
+        for dir_path in [self.command_dir, self.response_dir, self.pending_dir, self.approval_dir]:
             dir_path.mkdir(parents=True, exist_ok=True)
     
     def write_json_safe(self, filepath: Path, data: Dict[str, Any]) -> bool:
-        """ファイルロックを使用して安全にJSONを書き込む"""
-        try:
-            # 一時ファイルに書き込み
-            temp_file = filepath.with_suffix('.tmp')
-            
-            with open(temp_file, 'w') as f:
-                # ファイルロック取得
-                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
-                json.dump(data, f, indent=2, ensure_ascii=False)
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-            
-            # アトミックに移動
-            temp_file.replace(filepath)
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to write {filepath}: {e}")
-            if temp_file.exists():
-                temp_file.unlink()
-            return False
+        """レコードを書き込む（読む側には書き終わったファイルしか見えない）"""
+        return self.writer.write(filepath, data)
     
     def read_json_safe(self, filepath: Path) -> Optional[Dict[str, Any]]:
-        """ファイルロックを使用して安全にJSONを読み込む"""
-        try:
-            with open(filepath, 'r') as f:
-                # 共有ロック
-                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
-                data = json.load(f)
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-                return data
-        except Exception as e:
-            logger.error(f"Failed to read {filepath}: {e}")
-            return None
+        """レコードを読み込む"""
+        return read_record(filepath)
     
-    def create_command(self, command: str, user_info: Dict[str, str]) -> str:
-        """コマンドファイルを作成"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"cmd_{timestamp}.json"
-        filepath = self.command_dir / filename
+    def write_record(self, kind: str, name: str, data: Dict[str, Any]) -> str:
+        """レコードを種類に対応するディレクトリに書き込む"""
+        directory = {
+            KIND_COMMAND: self.command_dir,
+            KIND_RESPONSE: self.response_dir,
+            KIND_PENDING: self.pending_dir,
+            KIND_APPROVAL: self.approval_dir,
+        }[kind]
         
-        data = {
-            "command": command,
-            "timestamp": timestamp,
-            "status": "pending",
-            **user_info
-        }
-        
-        if self.write_json_safe(filepath, data):
-            return filename
+        if self.write_json_safe(directory / name, data):
+            return name
         return ""
     
+    def create_command(self, command: str, user_info: Dict[str, str]) -> str:
+        """コマンドファイルを作成"""
+        return self.write_record(KIND_COMMAND, *build_command(command, user_info))
+    
     def create_response(self, message: str, status: str = "success", **kwargs) -> str:
         """レスポンスファイルを作成"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"res_{timestamp}.json"
-        filepath = self.response_dir / filename
-        
-        data = {
-            "message": message,
-            "status": status,
-            "timestamp": timestamp,
-            **kwargs
-        }
-        
-        if self.write_json_safe(filepath, data):
-            return filename
-        return ""
+        return self.write_record(KIND_RESPONSE, *build_response(message, status, **kwargs))
+    
+    def create_progress(self, job_id: str, seq: int, output: str, **kwargs) -> str:
+        """実行中の進捗レコードを作成（ストリーミングモード用）"""
+        return self.write_record(KIND_RESPONSE, *build_progress(job_id, seq, output, **kwargs))
     
     def create_pending(self, command: str, message: str, **kwargs) -> str:
         """承認待ちファイルを作成"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        filename = f"pending_{timestamp}.json"
-        filepath = self.pending_dir / filename
-        
-        data = {
-            "command": command,
-            "message": message,
-            "timestamp": timestamp,
-            "status": "waiting",
-            **kwargs
-        }
-        
-        if self.write_json_safe(filepath, data):
-            return filename
-        return ""
+        return self.write_record(KIND_PENDING, *build_pending(command, message, **kwargs))
+    
+    def create_approval(self, pending_name: str, approval: bool, **kwargs) -> str:
+        """承認/拒否の結果ファイルを作成"""
+        return self.write_record(KIND_APPROVAL, *build_approval(pending_name, approval, **kwargs))
     
     def get_oldest_command(self) -> Optional[tuple[Path, Dict[str, Any]]]:
         """最も古いコマンドファイルを取得"""
@@ -129,11 +102,175 @@ class FileCommunicator:
             logger.error(f"Failed to get oldest command: {e}")
         return None
     
+    def _list_dir(self, directory: Path, limit: Optional[int] = None) -> List[tuple[str, Dict[str, Any]]]:
+        """ディレクトリ内のJSONファイルを名前順に (ファイル名, 内容) の一覧で返す
+
+        ディレクトリの一覧は1回だけ取得し、内容は先頭の limit 件だけ読む。
+        """
+        names = self._list_names(directory)
+        entries = []
+        for name in names if limit is None else names[:limit]:
+            data = self.read_json_safe(directory / name)
+            if data is not None:
+                entries.append((name, data))
+        return entries
+    
+    @staticmethod
+    def _list_names(directory: Path) -> List[str]:
+        """ディレクトリ内のJSONファイル名（同じ種類のレコードは名前順が作成順）"""
+        with os.scandir(directory) as it:
+            return sorted(
+                entry.name for entry in it
+                if entry.name.endswith('.json') and not entry.name.startswith('.')
+            )
+    
+    def _claim(self, directory: Path, name: str) -> Optional[Dict[str, Any]]:
+        """ファイルを自分の処理中ディレクトリに移して取得する
+        
+        rename はアトミックなので、複数の実行エンジンが同じファイルを取り合っても
+        取得できるのは1つだけ。移動前に更新時刻を現在にして、それをリースの開始時刻とする。
+        """
+        source = directory / name
+        target = self.claimed_dir / name
+        try:
+            self.claimed_dir.mkdir(parents=True, exist_ok=True)
+            os.utime(source)
+            os.rename(source, target)
+        except FileNotFoundError:
+            return None
+        
+        data = self.read_json_safe(target)
+        if data is None:
+            # 書き込み途中（他の書き込み方法・cp など）か壊れたファイル。消すとコマンドが失われるので
+            # 元の場所に戻し、書き終わったときのイベントで取得し直す（壊れたままなら古いファイルとして掃除される）
+            logger.warning(f"Returned unreadable file to {directory.name}: {name}")
+            try:
+                os.rename(target, source)
+            except FileNotFoundError:
+                pass
+        return data
+    
+    def claim_command(self, name: str) -> Optional[Dict[str, Any]]:
+        """コマンドを取得して処理中にする（他の実行エンジンが取得済みならNone）"""
+        return self._claim(self.command_dir, name)
+    
+    def claim_approval(self, name: str) -> Optional[Dict[str, Any]]:
+        """承認結果を取得して処理中にする（他の実行エンジンが取得済みならNone）"""
+        return self._claim(self.approval_dir, name)
+    
+    def adopt_record(self, kind: str, name: str, data: Dict[str, Any]) -> bool:
+        """スプールを経由せずに届いたコマンド・承認結果を、自分の処理中として保存する
+
+        停止してもリース切れ・再起動で未処理に戻り、ジャーナルで回復できるようにするため。
+        """
+        self.claimed_dir.mkdir(parents=True, exist_ok=True)
+        return self.write_json_safe(self.claimed_dir / name, data)
+    
+    def renew_leases(self):
+        """処理中のファイルのリースを延長（更新時刻を現在にする）"""
+        for filepath in self.claimed_dir.glob("*.json"):
+            try:
+                os.utime(filepath)
+            except FileNotFoundError:
+                pass
+    
+    def reclaim_expired(self, lease_seconds: float) -> int:
+        """リースが切れた処理中ファイル（停止した実行エンジンのもの）を未処理に戻す"""
+        cutoff = time.time() - lease_seconds
+        reclaimed = 0
+        for filepath in self.claimed_root.glob("*/*.json"):
+            try:
+                if filepath.stat().st_mtime >= cutoff:
+                    continue
+                os.rename(filepath, self._unclaimed_dir(filepath.name) / filepath.name)
+            except FileNotFoundError:
+                # 持ち主が処理を終えたか、他の実行エンジンが先に戻した
+                continue
+            reclaimed += 1
+            logger.warning(f"Reclaimed expired lease: {filepath.parent.name}/{filepath.name}")
+        return reclaimed
+    
+    def _unclaimed_dir(self, name: str) -> Path:
+        """処理中のファイルを戻す先"""
+        return self.approval_dir if name.startswith('approval_') else self.command_dir
+    
+    def release_claims(self) -> int:
+        """自分の処理中ファイルを未処理に戻す（同じ識別子で再起動したときの復旧用）"""
+        released = 0
+        for filepath in self.claimed_dir.glob("*.json"):
+            try:
+                os.rename(filepath, self._unclaimed_dir(filepath.name) / filepath.name)
+                released += 1
+            except FileNotFoundError:
+                pass
+        if released:
+            logger.info(f"Released {released} claims left by a previous run")
+        return released
+    
+    def finish_command(self, name: str):
+        """処理済みコマンドファイルを削除"""
+        (self.claimed_dir / name).unlink(missing_ok=True)
+        (self.command_dir / name).unlink(missing_ok=True)
+    
+    def finish_approval(self, name: str):
+        """処理済みの承認結果ファイルを削除"""
+        (self.claimed_dir / name).unlink(missing_ok=True)
+        (self.approval_dir / name).unlink(missing_ok=True)
+    
+    def move_legacy_approvals(self) -> int:
+        """以前の版がレスポンスのディレクトリに書いた承認結果を承認結果のディレクトリに移す"""
+        moved = 0
+        for filepath in self.response_dir.glob("approval_*.json"):
+            try:
+                os.rename(filepath, self.approval_dir / filepath.name)
+                moved += 1
+            except FileNotFoundError:
+                pass
+        if moved:
+            logger.info(f"Moved {moved} approval files out of {self.response_dir}")
+        return moved
+    
+    def list_responses(self, limit: int = 100) -> List[tuple[str, Dict[str, Any]]]:
+        """未送信のレスポンスファイルを取得"""
+        return self._list_dir(self.response_dir, limit)
+    
+    def ack_response(self, name: str):
+        """送信済みのレスポンスファイルを削除"""
+        (self.response_dir / name).unlink(missing_ok=True)
+    
+    def list_pending(self) -> List[tuple[str, Dict[str, Any]]]:
+        """承認待ちファイルの一覧"""
+        return self._list_dir(self.pending_dir)
+    
+    def list_pending_names(self) -> List[str]:
+        """承認待ちファイル名の一覧（内容は読まない）"""
+        return self._list_names(self.pending_dir)
+    
+    def get_pending(self, name: str) -> Optional[Dict[str, Any]]:
+        """承認待ちファイルを名前で取得"""
+        filepath = self.pending_dir / name
+        if not filepath.exists():
+            return None
+        return self.read_json_safe(filepath)
+    
+    def remove_pending(self, name: str):
+        """承認待ちファイルを削除"""
+        (self.pending_dir / name).unlink(missing_ok=True)
+    
+    def counts(self) -> Dict[str, int]:
+        """ディレクトリごとのファイル数"""
+        return {
+            'commands': len(list(self.command_dir.glob("*.json")))
+                        + len(list(self.claimed_root.glob("*/cmd_*.json"))),
+            'responses': len(list(self.response_dir.glob("*.json"))),
+            'pending': len(list(self.pending_dir.glob("*.json"))),
+        }
+    
     def cleanup_old_files(self, hours: int = 24):
-        """古いファイルを削除"""
+        """古いファイルを削除（全ファイルを走査する。常駐時は SpoolJanitor で少しずつ削除する）"""
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        for directory in [self.command_dir, self.response_dir, self.pending_dir]:
+        for directory in [self.command_dir, self.response_dir, self.pending_dir, self.approval_dir]:
             try:
                 for filepath in directory.glob("*.json"):
                     if filepath.stat().st_mtime < cutoff_time.timestamp():
@@ -143,12 +280,22 @@ class FileCommunicator:
                 logger.error(f"Cleanup error in {directory}: {e}")
 
 
+def default_worker_id() -> str:
+    """実行エンジンの識別子（環境変数 EXECUTOR_ID、未指定なら ホスト名-PID）"""
+    return os.getenv('EXECUTOR_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
 class FileWatcher:
-    """ファイル監視クラス（inotifyの代替）"""
+    """ファイル監視クラス（ポーリング方式、inotifyが使えない環境でのフォールバック）
+    
+    on_remove を渡すと、ファイルが削除・移動されたときにそのパスで呼ぶ。
+    書き込み途中で読めないファイルは渡さず、次の走査で読めるようになってから渡す。
+    """
     
-    def __init__(self, watch_dir: Path, callback):
+    def __init__(self, watch_dir: Path, callback, on_remove=None):
         self.watch_dir = watch_dir
         self.callback = callback
+        self.on_remove = on_remove
         self.running = False
         self.thread = None
         self.processed_files = set()
@@ -167,21 +314,270 @@ class FileWatcher:
             self.thread.join(timeout=5)
         logger.info(f"Stopped watching {self.watch_dir}")
     
+    def _poll_once(self):
+        """ディレクトリを1回走査"""
+        try:
+            # 新しいファイルをチェック
+            for filepath in self.watch_dir.glob("*.json"):
+                if filepath.name not in self.processed_files and self._complete(filepath):
+                    self.processed_files.add(filepath.name)
+                    self.callback(filepath)
+            
+            # 削除されたファイルをセットから削除
+            existing_files = {f.name for f in self.watch_dir.glob("*.json")}
+            removed = self.processed_files - existing_files
+            self.processed_files &= existing_files
+            for name in removed:
+                self._removed(self.watch_dir / name)
+            
+        except Exception as e:
+            logger.error(f"Watch loop error: {e}")
+    
+    @staticmethod
+    def _complete(filepath: Path) -> bool:
+        """ファイルが書き込み済みで読めるか（空・書き込み途中・削除済みならFalse）"""
+        try:
+            with open(filepath, 'rb') as f:
+                decode_record(f.read())
+            return True
+        except Exception:
+            return False
+    
+    def _removed(self, filepath: Path):
+        """削除・移動されたファイルを通知"""
+        if self.on_remove is None:
+            return
+        try:
+            self.on_remove(filepath)
+        except Exception as e:
+            logger.error(f"Watcher remove callback error for {filepath}: {e}")
+    
     def _watch_loop(self):
         """監視ループ"""
+        while self.running:
+            self._poll_once()
+            time.sleep(0.5)  # 0.5秒ごとにチェック
+
+
+# inotify定数（<sys/inotify.h>）
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CLOSE_WRITE = 0x00000008
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _load_libc():
+    """inotify関数を持つlibcを読み込む（非LinuxではNone）"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def inotify_available() -> bool:
+    """inotifyが利用可能か"""
+    return _libc is not None
+
+
+class InotifyFileWatcher(FileWatcher):
+    """inotifyによるイベント駆動のファイル監視クラス
+
+    IN_CLOSE_WRITE / IN_MOVED_TO で書き込み完了したファイルを即座に検知する。
+    SpoolWriter が O_TMPFILE + linkat で置いたファイルは書き込み済みの状態で IN_CREATE として届く。
+    IN_CREATE は他の書き込み方法（cp など）では空・書き込み途中のファイルでも届くので、
+    IN_CLOSE_WRITE 以外は内容を読めるものだけを渡し、残りは IN_CLOSE_WRITE を待つ。
+    起動時には既存ファイルを走査し、停止中に作成されたファイルも拾う。
+    """
+
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MOVED_FROM
+
+    def __init__(self, watch_dir: Path, callback, on_remove=None):
+        super().__init__(watch_dir, callback, on_remove)
+        self.fd = -1
+
+    def start(self):
+        """監視を開始（inotifyの初期化に失敗した場合はポーリングで監視）"""
+        try:
+            self.fd = self._init_inotify()
+        except OSError as e:
+            logger.warning(f"inotify unavailable for {self.watch_dir} ({e}), falling back to polling")
+            super().start()
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self._inotify_loop, daemon=True)
+        self.thread.start()
+        logger.info(f"Started watching {self.watch_dir} (inotify)")
+
+    def _init_inotify(self) -> int:
+        """inotifyインスタンスを作成し監視ディレクトリを登録"""
+        if _libc is None:
+            raise OSError("inotify is not available on this platform")
+
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = _libc.inotify_add_watch(fd, os.fsencode(str(self.watch_dir)), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch failed")
+        return fd
+
+    def stop(self):
+        """監視を停止"""
+        super().stop()
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _dispatch(self, filepath: Path, check: bool = False):
+        """未処理のファイルならコールバックを呼ぶ（check なら読めるファイルだけ）"""
+        if filepath.name in self.processed_files:
+            return
+        if check and not self._complete(filepath):
+            return
+        self.processed_files.add(filepath.name)
+        try:
+            self.callback(filepath)
+        except Exception as e:
+            logger.error(f"Watcher callback error for {filepath}: {e}")
+
+    def _scan_existing(self):
+        """起動時スキャン（監視開始前に作成されたファイルを処理）"""
+        try:
+            for filepath in sorted(self.watch_dir.glob("*.json")):
+                self._dispatch(filepath, check=True)
+        except Exception as e:
+            logger.error(f"Startup scan error: {e}")
+
+    def _inotify_loop(self):
+        """inotifyイベントの監視ループ"""
+        # watch登録後にスキャンするので取りこぼしは発生しない（重複はprocessed_filesで除外）
+        self._scan_existing()
+
         while self.running:
             try:
-                # 新しいファイルをチェック
-                for filepath in self.watch_dir.glob("*.json"):
-                    if filepath.name not in self.processed_files:
-                        self.processed_files.add(filepath.name)
-                        self.callback(filepath)
-                
-                # 削除されたファイルをセットから削除
-                existing_files = {f.name for f in self.watch_dir.glob("*.json")}
-                self.processed_files &= existing_files
-                
-            except Exception as e:
-                logger.error(f"Watch loop error: {e}")
-            
-            time.sleep(0.5)  # 0.5秒ごとにチェック
\ No newline at end of file
+                readable, _, _ = select.select([self.fd], [], [], 0.5)
+                if not readable:
+                    continue
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                if self.running:
+                    logger.error(f"Watch loop error: {e}")
+                break
+
+            self._handle_events(buf)
+    
+    def _handle_events(self, buf: bytes):
+        """読み取ったinotifyイベントを処理"""
+        for mask, name in self._parse_events(buf):
+            if mask & IN_Q_OVERFLOW:
+                # イベントキューが溢れた場合は全体を再スキャン
+                logger.warning(f"inotify queue overflow on {self.watch_dir}, rescanning")
+                self._scan_existing()
+                continue
+            if not name.endswith(".json"):
+                continue
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self.processed_files.discard(name)
+                self._removed(self.watch_dir / name)
+            elif mask & IN_CLOSE_WRITE:
+                self._dispatch(self.watch_dir / name)
+            elif mask & (IN_MOVED_TO | IN_CREATE):
+                self._dispatch(self.watch_dir / name, check=True)
+
+    @staticmethod
+    def _parse_events(buf: bytes):
+        """inotify_eventの列をパース"""
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(buf):
+            _, mask, _, name_len = _INOTIFY_EVENT.unpack_from(buf, offset)
+            offset += _INOTIFY_EVENT.size
+            name = buf[offset:offset + name_len].split(b"\0", 1)[0]
+            offset += name_len
+            yield mask, os.fsdecode(name)
+
+
+class AsyncFileWatcher(InotifyFileWatcher):
+    """asyncioのイベントループ上で動くファイル監視クラス
+
+    inotifyのfdをイベントループに登録するため監視用のスレッドを使わない。
+    inotifyが使えない場合はループ上のポーリングタスクで監視する。
+    """
+    
+    def __init__(self, watch_dir: Path, callback, on_remove=None):
+        super().__init__(watch_dir, callback, on_remove)
+        self.loop = None
+        self.poll_task = None
+    
+    def start(self):
+        """監視を開始（実行中のイベントループから呼ぶ）"""
+        self.loop = asyncio.get_running_loop()
+        self.running = True
+        try:
+            self.fd = self._init_inotify()
+        except OSError as e:
+            logger.warning(f"inotify unavailable for {self.watch_dir} ({e}), falling back to polling")
+            self.poll_task = self.loop.create_task(self._poll_loop())
+            return
+        
+        self._scan_existing()
+        self.loop.add_reader(self.fd, self._on_readable)
+        logger.info(f"Started watching {self.watch_dir} (inotify, asyncio)")
+    
+    def stop(self):
+        """監視を停止"""
+        self.running = False
+        if self.fd >= 0:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = -1
+        if self.poll_task:
+            self.poll_task.cancel()
+            self.poll_task = None
+        logger.info(f"Stopped watching {self.watch_dir}")
+    
+    def _on_readable(self):
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        self._handle_events(buf)
+    
+    async def _poll_loop(self):
+        while self.running:
+            self._poll_once()
+            await asyncio.sleep(0.5)
+
+
+def create_file_watcher(watch_dir: Path, callback, backend: Optional[str] = None,
+                        on_remove=None) -> FileWatcher:
+    """ファイル監視インスタンスを作成
+
+    backend: "inotify" / "polling" / "auto"（未指定時は環境変数 WATCHER_BACKEND、既定は auto）
+    on_remove: ファイルが削除・移動されたときのコールバック
+    """
+    backend = (backend or os.getenv("WATCHER_BACKEND", "auto")).lower()
+
+    if backend in ("auto", "inotify") and inotify_available():
+        return InotifyFileWatcher(watch_dir, callback, on_remove)
+    if backend == "inotify":
+        logger.warning("inotify is not available, falling back to polling watcher")
+    return FileWatcher(watch_dir, callback, on_remove)
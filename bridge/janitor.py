@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+スプール・出力保存領域の掃除
+ファイルを更新時刻順のヒープで管理し、期限切れや容量・件数の上限を超えた分を
+古い順に少しずつ削除する。ディレクトリ全体の走査は最初の1回だけで、
+以後はファイル監視のイベント（作成・削除）と自身の書き込みで索引を更新する。
+"""
+
+import os
+import heapq
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class FileIndex:
+    """期限・上限付きのファイル索引
+
+    - max_age: この秒数より古いファイルを削除（0なら期限なし）
+    - max_bytes / max_files: 合計サイズ・件数の上限（0なら上限なし。超えたら古いものから削除）
+    - protect: 削除してはいけないファイル（書き込み中の出力など）のパスで真を返す関数。
+      走査時に登録せず、掃除でも飛ばす
+    ヒープには (更新時刻, パス) を積み、entries と食い違う古い要素は取り出したときに捨てる。
+    """
+
+    def __init__(self, name: str, directories: Iterable[Path], pattern: str = "*",
+                 max_age: float = 0, max_bytes: int = 0, max_files: int = 0,
+                 protect: Optional[Callable[[str], bool]] = None):
+        self.name = name
+        self.protect = protect
+        self.directories = [Path(d) for d in directories]
+        self.pattern = pattern
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Tuple[float, int]] = {}
+        self.heap: List[Tuple[float, str]] = []
+        self.total_bytes = 0
+        self.seeded = False
+        self.deleted_total = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def seed(self):
+        """ディレクトリを1回だけ走査して既存のファイルを登録"""
+        for directory in self.directories:
+            try:
+                paths = list(directory.glob(self.pattern))
+            except OSError as e:
+                logger.error(f"Failed to scan {directory}: {e}")
+                continue
+            for path in paths:
+                if path.name.startswith('.') or (self.protect is not None and self.protect(str(path))):
+                    continue
+                self.track(path)
+        self.seeded = True
+
+    def track(self, path: Path):
+        """ファイルを登録（登録済みなら更新時刻・サイズを更新）"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.forget(path)
+            return
+        self._set(str(path), st.st_mtime, st.st_size)
+
+    def forget(self, path: Path):
+        """削除・移動されたファイルを索引から外す"""
+        with self.lock:
+            self._drop(str(path))
+
+    def _set(self, key: str, mtime: float, size: int):
+        with self.lock:
+            old = self.entries.get(key)
+            if old is not None:
+                self.total_bytes -= old[1]
+            self.entries[key] = (mtime, size)
+            self.total_bytes += size
+            if old is None or old[0] != mtime:
+                heapq.heappush(self.heap, (mtime, key))
+            # 古い要素が溜まりすぎたら作り直す
+            if len(self.heap) > 2 * len(self.entries) + 1024:
+                self.heap = [(m, k) for k, (m, _) in self.entries.items()]
+                heapq.heapify(self.heap)
+
+    def _drop(self, key: str):
+        """索引から外す（lock保持中に呼ぶ）"""
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+
+    def _over_quota(self) -> bool:
+        return bool((self.max_bytes and self.total_bytes > self.max_bytes)
+                    or (self.max_files and len(self.entries) > self.max_files))
+
+    def _next_candidate(self, now: float) -> Optional[Tuple[float, str]]:
+        """削除対象になる最も古い要素を取り出す（無ければNone、lock保持中に呼ぶ）"""
+        while self.heap:
+            mtime, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != mtime:
+                heapq.heappop(self.heap)
+                continue
+            expired = self.max_age and mtime < now - self.max_age
+            if not expired and not self._over_quota():
+                return None
+            return heapq.heappop(self.heap)
+        return None
+
+    def sweep(self, batch_size: int = 100, now: Optional[float] = None,
+              keep: Optional[Path] = None) -> int:
+        """期限切れ・上限超過のファイルを古い順に最大 batch_size 件削除（削除した件数を返す）"""
+        if not self.seeded:
+            self.seed()
+        now = time.time() if now is None else now
+        keep_key = str(keep) if keep is not None else None
+        deleted = 0
+        skipped = []
+        for _ in range(batch_size):
+            with self.lock:
+                candidate = self._next_candidate(now)
+            if candidate is None:
+                break
+            mtime, key = candidate
+            if key == keep_key or (self.protect is not None and self.protect(key)):
+                skipped.append(candidate)
+                continue
+
+            # 登録後に更新（リース延長など）・移動されていないか確かめてから削除する
+            try:
+                st = os.stat(key)
+            except FileNotFoundError:
+                self.forget(Path(key))
+                continue
+            if st.st_mtime != mtime:
+                self._set(key, st.st_mtime, st.st_size)
+                continue
+            try:
+                os.unlink(key)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to remove {key}: {e}")
+                continue
+            self.forget(Path(key))
+            deleted += 1
+            logger.info(f"Cleaned up {self.name} file: {key}")
+
+        with self.lock:
+            for item in skipped:
+                heapq.heappush(self.heap, item)
+        self.deleted_total += deleted
+        return deleted
+
+
+class SpoolJanitor:
+    """複数の索引を少しずつ掃除する
+
+    run_once を短い間隔で呼ぶと、1回あたり索引ごとに最大 batch_size 件だけ削除する。
+    """
+
+    def __init__(self, indexes: Iterable[FileIndex], batch_size: int = 100):
+        self.indexes = list(indexes)
+        self.batch_size = batch_size
+
+    def run_once(self, now: Optional[float] = None) -> int:
+        """1回分の掃除（削除した件数を返す）"""
+        deleted = 0
+        for index in self.indexes:
+            try:
+                deleted += index.sweep(self.batch_size, now=now)
+            except Exception as e:
+                logger.error(f"Janitor error in {index.name}: {e}")
+        return deleted
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+ジョブごとのリソース制限
+起動するシェルに ulimit で CPU時間・メモリ・ファイルサイズの上限を、exec の前にプロセス数の上限を設定する。
+cgroup v2 の委譲されたディレクトリ（JOB_CGROUP_PARENT）があれば、ジョブごとの cgroup に
+入れてメモリ・プロセス数を子孫まで含めて制限し、使用量もそこから読む。
+上限は既定値（環境変数）にユーザーごとの上書き（JOB_LIMITS_FILE）を重ねて決める。
+メモリ・プロセス数の既定値は cgroup がある場合だけ有効（rlimit では副作用が大きいため）。
+"""
+
+import os
+import re
+import json
+import shlex
+import time
+import logging
+import resource
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+# cgroup がある場合のメモリ（MB）・プロセス数の既定値
+DEFAULT_CGROUP_MEMORY_MB = 4096
+DEFAULT_CGROUP_MAX_PROCESSES = 512
+
+
+class JobLimits:
+    """1ジョブのリソース上限（0なら制限しない）
+
+    - cpu_seconds: CPU時間（RLIMIT_CPU。超えると SIGXCPU、5秒後に SIGKILL）
+    - memory_mb: メモリ（cgroup があれば memory.max、無ければ RLIMIT_DATA でヒープ等を制限。
+      RLIMIT_AS は JVM・node・Go・CUDA が予約する大きな仮想アドレス空間まで数えるので使わない）
+    - file_size_mb: 書き込めるファイルの大きさ（RLIMIT_FSIZE）
+    - max_processes: プロセス数（cgroup があれば pids.max、無ければ RLIMIT_NPROC。
+      RLIMIT_NPROC は同じユーザーの全プロセスを数える点に注意）
+    """
+
+    FIELDS = ('cpu_seconds', 'memory_mb', 'file_size_mb', 'max_processes')
+
+    def __init__(self, cpu_seconds: int = 0, memory_mb: int = 0, file_size_mb: int = 0,
+                 max_processes: int = 0):
+        self.cpu_seconds = int(cpu_seconds)
+        self.memory_mb = int(memory_mb)
+        self.file_size_mb = int(file_size_mb)
+        self.max_processes = int(max_processes)
+
+    def merged(self, overrides: Dict[str, Any]) -> "JobLimits":
+        """上書きを適用したコピー（未知のキーは無視する）"""
+        values = self.to_dict()
+        values.update({k: v for k, v in overrides.items() if k in self.FIELDS})
+        return JobLimits(**values)
+
+    def to_dict(self) -> Dict[str, int]:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def rlimits(self, in_cgroup: bool = False) -> Dict[int, tuple]:
+        """設定する rlimit（リソース → (soft, hard)）"""
+        limits = {}
+        if self.cpu_seconds:
+            limits[resource.RLIMIT_CPU] = (self.cpu_seconds, self.cpu_seconds + 5)
+        if self.file_size_mb:
+            size = self.file_size_mb * 1024 * 1024
+            limits[resource.RLIMIT_FSIZE] = (size, size)
+        # cgroup に入れた場合はメモリ・プロセス数を cgroup 側で制限する
+        if self.memory_mb and not in_cgroup:
+            size = self.memory_mb * 1024 * 1024
+            limits[resource.RLIMIT_DATA] = (size, size)
+        if self.max_processes and not in_cgroup:
+            limits[resource.RLIMIT_NPROC] = (self.max_processes, self.max_processes)
+        return limits
+
+
+class CgroupV2:
+    """委譲された cgroup v2 のディレクトリの下にジョブごとの cgroup を作る"""
+
+    def __init__(self, parent: Path):
+        self.parent = Path(parent)
+        self.available = self._check()
+
+    def _check(self) -> bool:
+        if not (CGROUP_ROOT / "cgroup.controllers").exists():
+            logger.info("cgroup v2 is not mounted, job limits use rlimits only")
+            return False
+        if not (self.parent / "cgroup.procs").exists() or not os.access(self.parent, os.W_OK):
+            logger.warning(f"cgroup {self.parent} is not a writable cgroup v2 directory, job limits use rlimits only")
+            return False
+        # 子の cgroup でメモリ・プロセス数を制御できるようにする（有効化済みなら何もしない）
+        try:
+            (self.parent / "cgroup.subtree_control").write_text("+memory +pids")
+        except OSError as e:
+            logger.warning(f"Failed to enable cgroup controllers in {self.parent}: {e}")
+        return True
+
+    def create(self, job_id: str, limits: JobLimits) -> Optional[Path]:
+        """ジョブの cgroup を作成して上限を書き込む（失敗したらNone）"""
+        if not self.available:
+            return None
+        path = self.parent / ("job-" + re.sub(r"[^A-Za-z0-9_.-]", "_", job_id))
+        try:
+            path.mkdir(exist_ok=True)
+            if limits.memory_mb:
+                (path / "memory.max").write_text(str(limits.memory_mb * 1024 * 1024))
+                _write_optional(path / "memory.swap.max", "0")
+            if limits.max_processes:
+                (path / "pids.max").write_text(str(limits.max_processes))
+        except OSError as e:
+            logger.error(f"Failed to create cgroup {path}: {e}")
+            self.remove(path)
+            return None
+        return path
+
+    @staticmethod
+    def usage(path: Path) -> Dict[str, float]:
+        """cgroup 内の全プロセスのピークメモリ（KB）とCPU時間（秒）"""
+        usage = {}
+        try:
+            usage['peak_rss_kb'] = int((path / "memory.peak").read_text()) // 1024
+        except (OSError, ValueError):
+            pass
+        try:
+            for line in (path / "cpu.stat").read_text().splitlines():
+                key, value = line.split()
+                if key == "usage_usec":
+                    usage['cpu_seconds'] = round(int(value) / 1_000_000, 3)
+        except (OSError, ValueError):
+            pass
+        return usage
+
+    @staticmethod
+    def remove(path: Path):
+        """残っているプロセスを終了させて cgroup を削除"""
+        _write_optional(path / "cgroup.kill", "1")
+        for _ in range(50):
+            try:
+                path.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.01)
+        logger.warning(f"Failed to remove cgroup {path}")
+
+
+def _write_optional(path: Path, value: str):
+    """古いカーネルに無いファイルへの書き込み（失敗しても無視）"""
+    try:
+        path.write_text(value)
+    except OSError:
+        pass
+
+
+class LimitPolicy:
+    """既定の上限とユーザーごとの上書き
+
+    JOB_LIMITS_FILE の形式:
+        {"default": {"memory_mb": 2048}, "users": {"<ユーザーID>": {"memory_mb": 8192, "cpu_seconds": 0}}}
+    """
+
+    def __init__(self, default: JobLimits, users: Optional[Dict[str, Dict[str, Any]]] = None,
+                 cgroup: Optional[CgroupV2] = None):
+        self.default = default
+        self.users = {str(k): v for k, v in (users or {}).items()}
+        self.cgroup = cgroup if cgroup is not None and cgroup.available else None
+
+    @classmethod
+    def from_env(cls) -> "LimitPolicy":
+        """環境変数（と JOB_LIMITS_FILE）の設定で作成"""
+        parent = os.getenv('JOB_CGROUP_PARENT')
+        cgroup = CgroupV2(Path(parent)) if parent else None
+        # メモリ・プロセス数は未設定なら cgroup がある場合だけ制限する
+        in_cgroup = cgroup is not None and cgroup.available
+        default = JobLimits(
+            cpu_seconds=int(os.getenv('JOB_CPU_SECONDS') or 600),
+            memory_mb=int(os.getenv('JOB_MEMORY_MB') or (DEFAULT_CGROUP_MEMORY_MB if in_cgroup else 0)),
+            file_size_mb=int(os.getenv('JOB_FILE_SIZE_MB') or 1024),
+            max_processes=int(os.getenv('JOB_MAX_PROCESSES') or (DEFAULT_CGROUP_MAX_PROCESSES if in_cgroup else 0))
+        )
+        users = {}
+        path = os.getenv('JOB_LIMITS_FILE')
+        if path:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                default = default.merged(config.get('default', {}))
+                users = config.get('users', {})
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load job limits from {path}: {e}")
+        return cls(default, users, cgroup)
+
+    def for_user(self, user_id: Optional[str]) -> JobLimits:
+        """ユーザーの上限（上書きが無ければ既定値）"""
+        overrides = self.users.get(str(user_id)) if user_id is not None else None
+        return self.default.merged(overrides) if overrides else self.default
+
+    def create_cgroup(self, job_id: str, limits: JobLimits) -> Optional[Path]:
+        return self.cgroup.create(job_id, limits) if self.cgroup else None
+
+    def release_cgroup(self, path: Optional[Path]) -> Dict[str, float]:
+        """cgroup の使用量を読んでから削除（cgroup が無ければ空）"""
+        if path is None:
+            return {}
+        usage = CgroupV2.usage(path)
+        CgroupV2.remove(path)
+        return usage
+
+    @staticmethod
+    def wrap(command: str, limits: JobLimits, cgroup: Optional[Path] = None) -> str:
+        """上限を設定してからコマンドを実行するシェルスクリプト（何も無ければそのまま）
+
+        preexec_fn を使うと subprocess が vfork で起動できず1件ごとに1ms以上遅くなるので、
+        起動したシェル自身に cgroup への移動と ulimit をさせる。ulimit は POSIX の単位
+        （-f は512バイト、-t は秒、-d はKB）で、プロセス数はシェルごとにオプションが違うため
+        preexec で exec の前に設定する。
+        """
+        lines = []
+        if cgroup is not None:
+            lines.append(f"echo $$ > {shlex.quote(str(cgroup / 'cgroup.procs'))} 2>/dev/null")
+        rlimits = limits.rlimits(in_cgroup=cgroup is not None)
+        for res, option, unit in _ULIMIT_OPTIONS:
+            if res not in rlimits:
+                continue
+            soft, hard = _capped(res, *rlimits[res])
+            # soft を先に下げないと、hard を soft より小さくできずに失敗する
+            lines.append(f"ulimit -S -{option} {soft // unit} 2>/dev/null; ulimit -H -{option} {hard // unit} 2>/dev/null")
+        if not lines:
+            return command
+        # 改行で区切り、ユーザーのコマンドは独立した行として解釈させる
+        return "\n".join(lines + [command])
+
+    @staticmethod
+    def preexec(limits: JobLimits, cgroup: Optional[Path] = None,
+                wrapped: bool = True) -> Optional[Callable[[], None]]:
+        """exec の前に子プロセスで上限を設定する関数（設定するものが無ければNone）
+
+        wrap したコマンドはシェルが ulimit と cgroup への移動をするので、プロセス数だけを設定する
+        （起動後に prlimit で設定すると、シェルが最初に fork するのに間に合わない）。
+        wrapped=False なら cgroup への移動とすべての rlimit をここで設定する（常駐シェル用）。
+        """
+        rlimits = limits.rlimits(in_cgroup=cgroup is not None)
+        if wrapped:
+            rlimits = {res: value for res, value in rlimits.items() if res == resource.RLIMIT_NPROC}
+            cgroup = None
+        if not rlimits and cgroup is None:
+            return None
+        # fork 後の子プロセスでは計算をしないよう、設定する値は先に決めておく
+        values = [(res, _capped(res, *value)) for res, value in rlimits.items()]
+        procs = str(cgroup / "cgroup.procs") if cgroup is not None else None
+
+        def apply():
+            if procs is not None:
+                try:
+                    with open(procs, "w") as f:
+                        f.write(str(os.getpid()))
+                except OSError:
+                    pass
+            for res, value in values:
+                try:
+                    resource.setrlimit(res, value)
+                except (OSError, ValueError):
+                    pass
+
+        return apply
+
+
+# ulimit で設定する rlimit（リソース, オプション, 単位のバイト数・秒数）
+_ULIMIT_OPTIONS = (
+    (resource.RLIMIT_CPU, "t", 1),
+    (resource.RLIMIT_FSIZE, "f", 512),
+    (resource.RLIMIT_DATA, "d", 1024),
+)
+
+
+def _capped(res: int, soft: int, hard: int) -> tuple:
+    """現在のハードリミットを超えないようにした (soft, hard)（超える値は設定できない）"""
+    _, current_hard = resource.getrlimit(res)
+    if current_hard != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current_hard), min(hard, current_hard)
+    return soft, hard
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+ジョブのプロセス管理
+コマンドは新しいセッション（プロセスグループ）で起動し、タイムアウト・キャンセル時は
+shell=True のシェルが起動した孫プロセスも含めてグループごと終了させる。
+終了は wait4 で待ち、プロセス（と待ち終えた子孫）のピークメモリ・CPU時間を取得する。
+"""
+
+import os
+import time
+import signal
+import asyncio
+import logging
+import subprocess
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def kill_process_tree(proc, process_group: bool = False):
+    """プロセスを強制終了（process_group ならプロセスグループごと）"""
+    if process_group:
+        try:
+            # 親が終了済みでもグループの残りのプロセスは同じIDで終了できる
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        return
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+def usage_dict(usage) -> Optional[Dict[str, Any]]:
+    """rusage をレスポンスに載せる形（ピークメモリKB・CPU秒）に変換"""
+    if usage is None:
+        return None
+    return {
+        'peak_rss_kb': usage.ru_maxrss,
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+    }
+
+
+def wait_process(proc: subprocess.Popen, timeout: float,
+                 process_group: bool = False) -> Tuple[int, Optional[Any]]:
+    """wait4 で終了を待ち (終了コード, rusage) を返す（timeout 秒で終わらなければkillする）"""
+    if proc.returncode is not None:
+        return proc.returncode, None
+
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    try:
+        while True:
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.monotonic() >= deadline:
+                kill_process_tree(proc, process_group)
+                pid, status, usage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    except ChildProcessError:
+        # 他の箇所で回収済み
+        return proc.wait(), None
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage
+
+
+class AsyncProcess:
+    """イベントループ上で待てる subprocess.Popen（asyncio.subprocess.Process と同じ使い方）
+
+    asyncio の子プロセス監視を使わずに pidfd（使えなければポーリング）で終了を検知して
+    wait4 で回収するので、終了後に rusage を参照できる。
+    """
+
+    def __init__(self, popen: subprocess.Popen, loop: asyncio.AbstractEventLoop):
+        self.popen = popen
+        self.pid = popen.pid
+        self.loop = loop
+        self.stdout: Optional[asyncio.StreamReader] = None
+        self.stderr: Optional[asyncio.StreamReader] = None
+        self.returncode: Optional[int] = None
+        self.rusage = None
+        self.exited = loop.create_future()
+        self.pidfd = -1
+        self.poll_task = None
+
+    @classmethod
+    async def spawn(cls, command: str, cwd: Optional[str] = None,
+                    start_new_session: bool = True,
+                    preexec_fn: Optional[Callable[[], None]] = None) -> "AsyncProcess":
+        """シェルでコマンドを起動（標準出力・標準エラーはパイプ、preexec_fn は exec の前に子プロセスで呼ぶ）"""
+        loop = asyncio.get_running_loop()
+        popen = subprocess.Popen(
+            command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            start_new_session=start_new_session,
+            preexec_fn=preexec_fn
+        )
+        proc = cls(popen, loop)
+        proc.stdout = await proc._reader(popen.stdout)
+        proc.stderr = await proc._reader(popen.stderr)
+        proc._watch()
+        return proc
+
+    async def _reader(self, pipe) -> asyncio.StreamReader:
+        reader = asyncio.StreamReader()
+        await self.loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader
+
+    def _watch(self):
+        try:
+            self.pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            self.poll_task = self.loop.create_task(self._poll())
+            return
+        self.loop.add_reader(self.pidfd, self._reap)
+
+    async def _poll(self):
+        while not self.exited.done():
+            self._reap()
+            await asyncio.sleep(0.05)
+
+    def _reap(self):
+        """終了していれば回収する"""
+        try:
+            pid, status, usage = os.wait4(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            pid, status, usage = self.pid, 0, None
+        if not pid:
+            return
+        if self.pidfd >= 0:
+            self.loop.remove_reader(self.pidfd)
+            os.close(self.pidfd)
+            self.pidfd = -1
+        if usage is not None:
+            self.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            self.returncode = self.popen.returncode if self.popen.returncode is not None else -1
+        self.popen.returncode = self.returncode
+        self.rusage = usage
+        if not self.exited.done():
+            self.exited.set_result(self.returncode)
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self.exited)
+
+    def kill(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+実行待ち・実行中のジョブの一覧とキャンセル
+実行エンジンはジョブごとに job_id・PID・ユーザー・開始時刻・出力量を記録し、
+状態ファイル（executor_stats）に載せて Bot の /jobs から見えるようにする。
+Bot の /cancel は状態ディレクトリにキャンセル要求（cancel-<job_id>.json）を書き、
+そのジョブを持っている実行エンジンが拾って処理する（実行エンジンが複数でも届く）。
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from bridge.job_process import kill_process_tree
+
+logger = logging.getLogger(__name__)
+
+# ジョブの状態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+
+# 処理されないキャンセル要求を捨てるまでの秒数（対象のジョブが既に終わっていた場合など）
+CANCEL_REQUEST_EXPIRE = 60
+
+
+class JobEntry:
+    """1件のジョブの情報"""
+
+    def __init__(self, job_id: str, pool_key: str, command: str, user_id: str, user_name: str,
+                 data: Optional[Dict[str, Any]] = None, parent: Optional[str] = None):
+        self.job_id = job_id
+        self.pool_key = pool_key
+        self.command = command
+        self.user_id = user_id
+        self.user_name = user_name
+        self.data = data
+        # バッチのステップなら、バッチのジョブID
+        self.parent = parent
+        self.state = JOB_QUEUED
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.proc = None
+        self.output = None
+        self.cancelled_by: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancelled_by is not None
+
+    @property
+    def output_bytes(self) -> int:
+        return self.output.bytes_received if self.output is not None else 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'state': self.state,
+            'command': self.command[:200],
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'pid': self.proc.pid if self.proc is not None else None,
+            'output_bytes': self.output_bytes,
+            'parent': self.parent,
+        }
+
+
+class JobRegistry:
+    """実行エンジン内のジョブの一覧（スレッドから操作してよい）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, JobEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def add(self, job_id: str, pool_key: str, command: str, user_id: str = "",
+            user_name: str = "", data: Optional[Dict[str, Any]] = None,
+            parent: Optional[str] = None) -> JobEntry:
+        """実行待ちのジョブを登録（parent はバッチのステップの場合のバッチのジョブID）"""
+        entry = JobEntry(job_id, pool_key, command, str(user_id), user_name, data, parent)
+        with self.lock:
+            parent_entry = self.jobs.get(parent) if parent else None
+            if parent_entry is not None and parent_entry.cancelled:
+                # キャンセルされたバッチのステップはすぐに終了させる
+                entry.cancelled_by = parent_entry.cancelled_by
+            self.jobs[job_id] = entry
+        return entry
+
+    def get(self, job_id: str) -> Optional[JobEntry]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def start(self, job_id: str) -> Optional[JobEntry]:
+        """実行を開始した"""
+        with self.lock:
+            entry = self.jobs.get(job_id)
+            if entry is not None:
+                entry.state = JOB_RUNNING
+                entry.started_at = time.time()
+            return entry
+
+    def attach(self, job_id: str, proc=None, output=None):
+        """実行中のプロセス・出力の書き込み先を登録（既にキャンセルされていればすぐに終了させる）"""
+        with self.lock:
+            entry = self.jobs.get(job_id)
+            if entry is None:
+                return
+            if output is not None:
+                entry.output = output
+            if proc is None:
+                return
+            entry.proc = proc
+            cancelled = entry.cancelled
+        if cancelled:
+            kill_process_tree(proc, process_group=True)
+
+    def finish(self, job_id: str) -> Optional[JobEntry]:
+        """終了したジョブを一覧から外して返す"""
+        with self.lock:
+            return self.jobs.pop(job_id, None)
+
+    def cancel(self, job_id: str, requested_by: str = "") -> Optional[JobEntry]:
+        """ジョブをキャンセル済みにし、実行中ならプロセスグループごと終了させる
+
+        実行待ちのジョブはプールから取り除くのが呼び出し側の仕事なので、ここでは印を付けるだけ。
+        バッチならそのステップもすべてキャンセルする。
+        """
+        with self.lock:
+            entry = self.jobs.get(job_id)
+            if entry is None:
+                return None
+            targets = [entry] + [e for e in self.jobs.values() if e.parent == job_id]
+            procs = []
+            for target in targets:
+                target.cancelled_by = requested_by or "unknown"
+                if target.proc is not None:
+                    procs.append(target.proc)
+        for proc in procs:
+            kill_process_tree(proc, process_group=True)
+        return entry
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """状態ファイルに載せる一覧（登録順）"""
+        with self.lock:
+            entries = list(self.jobs.values())
+        return [entry.to_dict() for entry in entries]
+
+
+def _cancel_path(state_dir: Path, job_id: str) -> Path:
+    return Path(state_dir) / ("cancel-" + re.sub(r"[^A-Za-z0-9_.-]", "_", job_id) + ".json")
+
+
+def write_cancel_request(state_dir: Path, job_id: str, **info) -> Path:
+    """キャンセル要求を書き込む（Bot側）"""
+    path = _cancel_path(state_dir, job_id)
+    temp_file = path.with_name("." + path.name + ".tmp")
+    with open(temp_file, 'w') as f:
+        json.dump({'job_id': job_id, 'requested_at': time.time(), **info}, f, separators=(',', ':'))
+    os.replace(temp_file, path)
+    return path
+
+
+def read_cancel_requests(state_dir: Path, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """キャンセル要求を読む（実行エンジン側、古すぎる要求は削除する）"""
+    now = time.time() if now is None else now
+    requests = []
+    try:
+        entries = list(os.scandir(state_dir))
+    except FileNotFoundError:
+        return requests
+    for entry in entries:
+        if not (entry.name.startswith("cancel-") and entry.name.endswith(".json")):
+            continue
+        try:
+            with open(entry.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read cancel request {entry.path}: {e}")
+            remove_cancel_request(Path(entry.path))
+            continue
+        if now - data.get('requested_at', 0) > CANCEL_REQUEST_EXPIRE:
+            logger.info(f"Dropping expired cancel request: {entry.name}")
+            remove_cancel_request(Path(entry.path))
+            continue
+        data['path'] = entry.path
+        requests.append(data)
+    return requests
+
+
+def remove_cancel_request(path: Path):
+    try:
+        Path(path).unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+ジョブ状態のジャーナル（先行書き込みログ）
+状態遷移（received → running → done → delivered）を1行1JSONで追記し、
+起動時に読み直すことで、停止前にどこまで処理したかを復元する。
+キーにはジョブの冪等キー（コマンド名から決まる job_id）を使う。
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 状態
+STATE_RECEIVED = "received"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_DELIVERED = "delivered"
+
+# これ以上進まない状態（保持期間を過ぎたら圧縮で消す）
+TERMINAL_STATES = {STATE_DONE, STATE_DELIVERED}
+
+
+class JobJournal:
+    """追記専用のジョブ状態ジャーナル
+
+    複数のプロセスが同じファイルに追記してよい（追記と圧縮はflockで排他する）。
+    他のプロセスの追記は refresh() で取り込む（前回読んだ位置から先だけを読む）。
+    - fsync: 追記ごとにディスクへ書き出す
+    - retention_hours: 終了状態のエントリを圧縮時に残す時間
+    """
+
+    def __init__(self, path: Path, fsync: bool = True, retention_hours: float = 24):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.retention = retention_hours * 3600
+        self.states: Dict[str, Tuple[str, float]] = {}
+        self.lock = threading.Lock()
+        self.fd = None
+        self.inode = None
+        self.offset = 0
+        self.lines = 0
+
+        with self.lock:
+            self._open()
+            self._read_new()
+        logger.info(f"Replayed {self.lines} journal entries ({len(self.states)} jobs) from {self.path}")
+
+        self.last_compact = time.time()
+        self.compact_if_needed(force=True)
+
+    def _open(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.inode = os.fstat(self.fd).st_ino
+
+    def _rotated(self) -> bool:
+        """他のプロセスが圧縮してファイルが置き換わったか"""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def _reload(self):
+        """置き換わったファイルを最初から読み直す（lock保持中に呼ぶ）"""
+        self._open()
+        self.states.clear()
+        self.offset = 0
+        self.lines = 0
+        self._read_new()
+
+    def _read_new(self):
+        """前回の位置から追記分を読み込む（lock保持中に呼ぶ）"""
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read()
+
+        # 最後の行が書きかけ（改行なし）なら次回に回す
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                entry = json.loads(line)
+                self.states[entry['key']] = (entry['state'], entry.get('ts', 0.0))
+            except (ValueError, KeyError):
+                logger.warning(f"Skipping corrupt journal line in {self.path}")
+                continue
+            self.lines += 1
+        self.offset += end
+
+    def refresh(self):
+        """他のプロセスの追記を取り込む"""
+        with self.lock:
+            if self._rotated():
+                self._reload()
+            else:
+                self._read_new()
+
+    def record(self, key: str, state: str):
+        """状態遷移を追記"""
+        now = time.time()
+        line = json.dumps({'key': key, 'state': state, 'ts': now}, separators=(',', ':')) + "\n"
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                if self._rotated():
+                    self._reload()
+                    fcntl.flock(self.fd, fcntl.LOCK_EX)
+                os.write(self.fd, line.encode('utf-8'))
+                if self.fsync:
+                    os.fsync(self.fd)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.states[key] = (state, now)
+
+    def get(self, key: str) -> Optional[str]:
+        """ジョブの最新の状態（記録が無ければNone）"""
+        entry = self.states.get(key)
+        return entry[0] if entry else None
+
+    def compact_if_needed(self, force: bool = False):
+        """同じジョブの古い行が溜まったか、保持期間が過ぎたら圧縮して読み直しを短く保つ"""
+        if self.lines <= 1000:
+            return
+        if force or self.lines > 2 * len(self.states) or time.time() - self.last_compact > self.retention:
+            self.compact()
+
+    def compact(self):
+        """各ジョブの最新状態だけを残して書き直す（保持期間を過ぎた終了状態は捨てる）"""
+        cutoff = time.time() - self.retention
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                if self._rotated():
+                    self._reload()
+                    fcntl.flock(self.fd, fcntl.LOCK_EX)
+                self._read_new()
+
+                kept = {
+                    key: (state, ts) for key, (state, ts) in self.states.items()
+                    if state not in TERMINAL_STATES or ts >= cutoff
+                }
+                temp_file = self.path.with_suffix('.tmp')
+                with open(temp_file, 'w') as f:
+                    for key, (state, ts) in kept.items():
+                        f.write(json.dumps({'key': key, 'state': state, 'ts': ts}, separators=(',', ':')) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_file, self.path)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+            dropped = self.lines - len(kept)
+            self.states = kept
+            self.lines = len(kept)
+            self._open()
+            self.offset = os.fstat(self.fd).st_size
+            self.last_compact = time.time()
+        logger.info(f"Compacted journal {self.path} (dropped {dropped} entries)")
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
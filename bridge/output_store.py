@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+コマンド出力の保存領域
+全出力をディスクに書き出し、大きいものはgzip圧縮し、合計容量・件数を上限内に保つ
+"""
+
+import io
+import gzip
+import shutil
+import tarfile
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from bridge.janitor import FileIndex
+
+logger = logging.getLogger(__name__)
+
+
+class OutputStore:
+    """容量上限付きの出力保存領域
+
+    - max_bytes: 保存領域全体の上限（超えたら古いファイルから削除）
+    - gzip_threshold: このサイズを超えた出力はgzip圧縮して保存
+    - max_file_bytes: 1出力あたりの上限（超えた分は書き込まない）
+    - max_files: 保存する出力の件数の上限（0なら上限なし）
+    保存済みのファイルは索引（FileIndex）で管理し、上限の確認のたびにディレクトリを走査しない。
+    実行中のジョブが書き込んでいる出力（OutputSpool が開いているファイル）は上限を超えても削除しない。
+    """
+
+    def __init__(self, base_dir: Path, max_bytes: int = 500 * 1024 * 1024,
+                 gzip_threshold: int = 64 * 1024, max_file_bytes: int = 100 * 1024 * 1024,
+                 max_files: int = 0):
+        self.base_dir = Path(base_dir)
+        self.max_bytes = max_bytes
+        self.gzip_threshold = gzip_threshold
+        self.max_file_bytes = max_file_bytes
+        self.lock = threading.Lock()
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        # 書き込み中の出力のパス（set の追加・削除・参照はGILの下でアトミック）
+        self.active = set()
+        self.index = FileIndex("output", [self.base_dir], max_bytes=max_bytes, max_files=max_files,
+                               protect=self.active.__contains__)
+
+    def open_spool(self, job_id: str) -> "OutputSpool":
+        """ジョブの出力書き込み先を作成"""
+        return OutputSpool(self, job_id)
+
+    def finalize(self, filepath: Path) -> Path:
+        """書き込み完了した出力を圧縮し、容量上限を適用"""
+        if filepath.stat().st_size > self.gzip_threshold:
+            gz_path = filepath.with_name(filepath.name + ".gz")
+            with open(filepath, 'rb') as src, gzip.open(gz_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            filepath.unlink()
+            filepath = gz_path
+
+        self.index.track(filepath)
+        self.enforce_quota(keep=filepath)
+        return filepath
+
+    def bundle(self, name: str, members: List[Tuple[str, Path]]) -> Optional[Path]:
+        """複数の出力を1つの tar.gz にまとめて保存し、元の出力は削除する（バッチ実行の添付用）
+
+        members は (アーカイブ内の名前, 保存済みの出力) の一覧。圧縮済みの出力は展開して格納する。
+        """
+        if not members:
+            return None
+        path = self.base_dir / f"{name}.tar.gz"
+        with tarfile.open(path, 'w:gz', compresslevel=6) as tar:
+            for arcname, member in members:
+                opener = gzip.open if member.suffix == '.gz' else open
+                try:
+                    with opener(member, 'rb') as src:
+                        data = src.read(self.max_file_bytes)
+                except OSError as e:
+                    logger.error(f"Failed to bundle output {member}: {e}")
+                    continue
+                info = tarfile.TarInfo(arcname)
+                info.size = len(data)
+                info.mtime = int(member.stat().st_mtime)
+                tar.addfile(info, io.BytesIO(data))
+        for _, member in members:
+            self.discard(member)
+
+        self.index.track(path)
+        self.enforce_quota(keep=path)
+        return path
+
+    def discard(self, filepath: Path):
+        """不要になった出力を削除"""
+        try:
+            filepath.unlink()
+        except FileNotFoundError:
+            pass
+        self.index.forget(filepath)
+
+    def enforce_quota(self, keep: Optional[Path] = None):
+        """合計サイズ・件数が上限を超えていれば古いファイルから削除"""
+        with self.lock:
+            # 上限内に収まるまで、1回に削除する件数を区切って繰り返す
+            while self.index.sweep(batch_size=100, keep=keep):
+                pass
+
+
+class OutputSpool:
+    """1ジョブ分の出力をストリームごとのファイルに書き出すクラス
+
+    stream_process の on_output として feed を渡して使う。
+    """
+
+    def __init__(self, store: OutputStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.files = {}
+        self.paths: Dict[str, Path] = {}
+        self.sizes: Dict[str, int] = {}
+        self.truncated = set()
+        # 受け取った出力の合計バイト数（上限で捨てた分も含む。/jobs の表示用）
+        self.bytes_received = 0
+
+    def feed(self, stream_name: Optional[str], text: str):
+        """出力を書き込む（上限を超えた分は捨てる）"""
+        if stream_name is None or not text:
+            return
+
+        f = self.files.get(stream_name)
+        if f is None:
+            path = self.store.base_dir / f"{self.job_id}_{stream_name}.log"
+            self.store.active.add(str(path))
+            f = open(path, 'wb')
+            self.files[stream_name] = f
+            self.paths[stream_name] = path
+            self.sizes[stream_name] = 0
+
+        data = text.encode('utf-8')
+        self.bytes_received += len(data)
+        room = self.store.max_file_bytes - self.sizes[stream_name]
+        if len(data) > room:
+            data = data[:max(room, 0)]
+            self.truncated.add(stream_name)
+        if data:
+            f.write(data)
+            self.sizes[stream_name] += len(data)
+
+    def close(self) -> Dict[str, Path]:
+        """ファイルを閉じて保存を確定（ストリーム名 → 保存先パス）"""
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+        results = {}
+        for stream_name, path in self.paths.items():
+            # 書き込みを終えたので掃除の対象にする（finalize で索引に登録される）
+            self.store.active.discard(str(path))
+            try:
+                results[stream_name] = self.store.finalize(path)
+            except OSError as e:
+                logger.error(f"Failed to finalize output {path}: {e}")
+        return results
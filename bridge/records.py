@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+通信レコードの定義
+コマンド・レスポンス・承認待ち・承認結果の名前と内容を作る（全バックエンド共通）
+"""
+
+import os
+import itertools
+from datetime import datetime
+from typing import Dict, Any, Tuple
+
+# レコードの種類
+KIND_COMMAND = "command"
+KIND_RESPONSE = "response"
+KIND_PENDING = "pending"
+KIND_APPROVAL = "approval"
+
+
+# 同じマイクロ秒に作られたレコードの名前を区別する連番
+_sequence = itertools.count()
+
+
+def _timestamp() -> str:
+    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def _unique(timestamp: str) -> str:
+    """ファイル名用に時刻へPIDと連番を付ける（時刻順に並び、同じマイクロ秒でも重ならない）"""
+    return f"{timestamp}_{os.getpid()}_{next(_sequence) % 10000:04d}"
+
+
+def build_command(command: str, user_info: Dict[str, str]) -> Tuple[str, Dict[str, Any]]:
+    """コマンドレコード"""
+    timestamp = _timestamp()
+    data = {
+        "command": command,
+        "timestamp": timestamp,
+        "status": "pending",
+        **user_info
+    }
+    return f"cmd_{_unique(timestamp)}.json", data
+
+
+def build_response(message: str, status: str = "success", **kwargs) -> Tuple[str, Dict[str, Any]]:
+    """レスポンスレコード"""
+    timestamp = _timestamp()
+    data = {
+        "message": message,
+        "status": status,
+        "timestamp": timestamp,
+        **kwargs
+    }
+    return f"res_{_unique(timestamp)}.json", data
+
+
+def build_progress(job_id: str, seq: int, output: str, **kwargs) -> Tuple[str, Dict[str, Any]]:
+    """実行中の進捗レコード（ストリーミングモード用、種類はレスポンス）"""
+    data = {
+        "type": "progress",
+        "job_id": job_id,
+        "seq": seq,
+        "output": output,
+        "timestamp": _timestamp(),
+        **kwargs
+    }
+    return f"prog_{job_id}_{seq:06d}.json", data
+
+
+def build_pending(command: str, message: str, **kwargs) -> Tuple[str, Dict[str, Any]]:
+    """承認待ちレコード"""
+    timestamp = _timestamp()
+    data = {
+        "command": command,
+        "message": message,
+        "timestamp": timestamp,
+        "status": "waiting",
+        **kwargs
+    }
+    return f"pending_{_unique(timestamp)}.json", data
+
+
+def job_id_of(pending_name: str) -> str:
+    """承認待ちの名前から、承認後に実行するジョブのIDを得る"""
+    return pending_name[:-len(".json")] if pending_name.endswith(".json") else pending_name
+
+
+def build_approval(pending_name: str, approval: bool, **kwargs) -> Tuple[str, Dict[str, Any]]:
+    """承認/拒否の結果レコード（名前と job_id は承認待ちから決まるので、同じ承認待ちへの回答は1つになる）"""
+    data = {
+        "job_id": job_id_of(pending_name),
+        "approval": approval,
+        "timestamp": datetime.now().isoformat(),
+        **kwargs
+    }
+    return f"approval_{pending_name}", data
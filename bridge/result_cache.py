@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+冪等なコマンドの実行結果キャッシュ
+git status や df -h のような読み取り専用のコマンドが短時間に繰り返されたとき、
+- 実行中の同じコマンドがあればその実行に相乗りし（結果はそれぞれに返す）
+- 直近 ttl 秒以内の結果があれば実行せずにそれを返す
+キーは正規化したコマンドと作業ディレクトリ。許可リストに一致するコマンドだけを対象にする。
+"""
+
+import os
+import re
+import time
+import shlex
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 既定の許可リスト（先頭の単語列が一致するコマンドを対象にする）
+DEFAULT_COMMANDS = (
+    "git status", "git log", "git diff", "git branch",
+    "df", "du", "free", "uptime", "nvidia-smi",
+    "ls", "pwd", "whoami", "hostname", "uname", "ps",
+)
+
+# リダイレクト・パイプ・連結・コマンド置換を含むコマンドは対象外（副作用があり得る）
+_SHELL_META = re.compile(r"[;&|<>`$\\\n]")
+
+CacheKey = Tuple[str, str]
+
+
+def normalize_command(command: str) -> Optional[str]:
+    """空白・引用符の違いを吸収したコマンド（解釈できなければNone）"""
+    try:
+        return " ".join(shlex.split(command))
+    except ValueError:
+        return None
+
+
+class ResultCache:
+    """実行結果のキャッシュ（TTL・LRU）と実行中のコマンドの相乗り
+
+    - commands: 対象にするコマンドの先頭部分（"git status" なら "git status -s" も対象）
+    - ttl: 結果を使い回す秒数
+    - max_entries: 保持する結果の数（超えたら最も使われていないものから捨てる）
+    """
+
+    def __init__(self, commands: Sequence[str] = DEFAULT_COMMANDS, ttl: float = 10,
+                 max_entries: int = 128):
+        self.prefixes = [tuple(shlex.split(c)) for c in commands if c.strip()]
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.results: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.inflight: Dict[CacheKey, List[Any]] = {}
+        self.hits = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultCache"]:
+        """環境変数の設定で作成（RESULT_CACHE が無効ならNone）"""
+        if os.getenv('RESULT_CACHE', 'false').lower() not in ('1', 'true', 'yes'):
+            return None
+        commands = os.getenv('RESULT_CACHE_COMMANDS', '')
+        return cls(
+            commands=[c.strip() for c in commands.split(',')] if commands.strip() else DEFAULT_COMMANDS,
+            ttl=float(os.getenv('RESULT_CACHE_TTL', 10)),
+            max_entries=int(os.getenv('RESULT_CACHE_SIZE', 128))
+        )
+
+    def key(self, command: str, cwd: str) -> Optional[CacheKey]:
+        """キャッシュのキー（対象外のコマンドならNone）"""
+        if _SHELL_META.search(command):
+            return None
+        normalized = normalize_command(command)
+        if not normalized:
+            return None
+        words = tuple(normalized.split(" "))
+        if not any(words[:len(prefix)] == prefix for prefix in self.prefixes):
+            return None
+        return normalized, cwd
+
+    def get(self, key: CacheKey, now: Optional[float] = None) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """有効な結果を (経過秒数, 結果) で返す（無ければNone）"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if now - stored_at > self.ttl:
+                del self.results[key]
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return now - stored_at, result
+
+    def join(self, key: CacheKey, waiter: Any) -> bool:
+        """同じコマンドが実行中なら waiter を相乗りさせてTrue、無ければ自分が実行する側になりFalse"""
+        with self.lock:
+            waiters = self.inflight.get(key)
+            if waiters is None:
+                self.inflight[key] = []
+                return False
+            waiters.append(waiter)
+            self.coalesced += 1
+            return True
+
+    def complete(self, key: CacheKey, result: Optional[Dict[str, Any]],
+                 now: Optional[float] = None) -> List[Any]:
+        """実行を終えた（成功した結果は保存する）。相乗りしていた waiter の一覧を返す"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            waiters = self.inflight.pop(key, [])
+            if result is not None and result.get('success'):
+                self.results[key] = (now, result)
+                self.results.move_to_end(key)
+                while len(self.results) > self.max_entries:
+                    self.results.popitem(last=False)
+        return waiters
+
+    def __len__(self) -> int:
+        return len(self.results)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+実行待ちジョブのスケジューラ
+優先度・ユーザーごとの重み付き公平キューイング（WFQ）・エージングで、
+次に実行するジョブを決める。1人のユーザーが大量に投入しても他のユーザーは待たされない。
+"""
+
+import os
+import time
+import itertools
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 優先度（小さいほど先に実行）
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+PRIORITY_LEVELS = {
+    'high': PRIORITY_HIGH,
+    'normal': PRIORITY_NORMAL,
+    'low': PRIORITY_LOW,
+}
+
+
+def parse_priority(value: Any) -> int:
+    """コマンドJSONの優先度（名前または数値）を優先度に変換（不明な値は normal）"""
+    if isinstance(value, str):
+        return PRIORITY_LEVELS.get(value.strip().lower(), PRIORITY_NORMAL)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return min(max(value, PRIORITY_HIGH), PRIORITY_LOW)
+    return PRIORITY_NORMAL
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """"ユーザーID:重み" のカンマ区切りを辞書に変換（例: "1234:2,5678:0.5"）"""
+    weights = {}
+    for item in (spec or "").split(','):
+        user_id, sep, weight = item.strip().rpartition(':')
+        if not sep or not user_id:
+            continue
+        try:
+            value = float(weight)
+        except ValueError:
+            logger.warning(f"Ignoring invalid scheduler weight: {item}")
+            continue
+        if value > 0:
+            weights[user_id] = value
+    return weights
+
+
+class ScheduledJob:
+    """スケジューラ上の実行待ちジョブ"""
+
+    def __init__(self, job, user_id: str, priority: int, tag: float, seq: int, enqueued: float):
+        self.job = job
+        self.user_id = user_id
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.enqueued = enqueued
+
+
+class FairScheduler:
+    """優先度付きの重み付き公平キュー
+
+    - 同じ優先度の中では、ユーザーごとの仮想終了時刻（tag）が小さい順に取り出す。
+      ユーザーのジョブは前のジョブの tag に 1/重み を足した tag を持つので、
+      多く投入したユーザーのジョブほど後ろに回る。
+    - aging_seconds 待つごとに優先度を1段上げ、低優先度のジョブも必ず実行される。
+    - weights: ユーザーIDごとの重み（既定は1。2なら他のユーザーの2倍の割合で実行される）
+
+    キューの長さは max_queue で抑えられているため、取り出しは全件を見る。
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, aging_seconds: float = 60):
+        self.weights = dict(weights or {})
+        self.aging_seconds = aging_seconds
+        self.entries: Dict[str, ScheduledJob] = {}
+        self.virtual_time = 0.0
+        self.last_tag: Dict[str, float] = {}
+        self.queued_per_user: Dict[str, int] = {}
+        self.counter = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "FairScheduler":
+        """環境変数の設定でスケジューラを作成"""
+        return cls(
+            weights=parse_weights(os.getenv('SCHEDULER_USER_WEIGHTS', '')),
+            aging_seconds=float(os.getenv('SCHEDULER_AGING_SECONDS', 60))
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def push(self, job_id: str, user_id: str, job, priority: int = PRIORITY_NORMAL,
+             now: Optional[float] = None):
+        """ジョブを実行待ちに追加"""
+        now = time.monotonic() if now is None else now
+        user_id = str(user_id)
+        start = max(self.virtual_time, self.last_tag.get(user_id, 0.0))
+        tag = start + 1.0 / self.weights.get(user_id, 1.0)
+        self.last_tag[user_id] = tag
+        self.queued_per_user[user_id] = self.queued_per_user.get(user_id, 0) + 1
+        self.entries[job_id] = ScheduledJob(job, user_id, parse_priority(priority), tag, next(self.counter), now)
+
+    def pop(self, can_run: Callable[[str], bool] = lambda user_id: True,
+            now: Optional[float] = None):
+        """実行できるユーザーのジョブのうち最も先に実行すべきものを取り出す（無ければNone）"""
+        now = time.monotonic() if now is None else now
+        best_id = None
+        best_key = None
+        for job_id, entry in self.entries.items():
+            if not can_run(entry.user_id):
+                continue
+            key = self._sort_key(entry, now)
+            if best_key is None or key < best_key:
+                best_id, best_key = job_id, key
+        if best_id is None:
+            return None
+
+        # 仮想時刻は取り出したジョブの開始時刻まで進める
+        entry = self.entries[best_id]
+        self.virtual_time = max(self.virtual_time, entry.tag - 1.0 / self.weights.get(entry.user_id, 1.0))
+        return self._remove(best_id).job
+
+    def remove(self, job_id: str):
+        """実行待ちのジョブを取り除いて返す（無ければNone）"""
+        if job_id not in self.entries:
+            return None
+        return self._remove(job_id).job
+
+    def position(self, job_id: str, now: Optional[float] = None) -> Optional[int]:
+        """実行待ちの順番（1始まり。実行待ちでなければNone）"""
+        entry = self.entries.get(job_id)
+        if entry is None:
+            return None
+        now = time.monotonic() if now is None else now
+        key = self._sort_key(entry, now)
+        return 1 + sum(1 for other in self.entries.values() if self._sort_key(other, now) < key)
+
+    def jobs(self) -> List[Any]:
+        """実行待ちのジョブ（取り出し順は考慮しない）"""
+        return [entry.job for entry in self.entries.values()]
+
+    def clear(self) -> List[Any]:
+        """全ての実行待ちを取り除いて返す"""
+        jobs = self.jobs()
+        self.entries.clear()
+        self.queued_per_user.clear()
+        self.last_tag.clear()
+        return jobs
+
+    def _sort_key(self, entry: ScheduledJob, now: float) -> tuple:
+        priority = entry.priority
+        if self.aging_seconds > 0:
+            priority = max(PRIORITY_HIGH, priority - int((now - entry.enqueued) // self.aging_seconds))
+        return priority, entry.tag, entry.seq
+
+    def _remove(self, job_id: str) -> ScheduledJob:
+        entry = self.entries.pop(job_id)
+        remaining = self.queued_per_user[entry.user_id] - 1
+        if remaining:
+            self.queued_per_user[entry.user_id] = remaining
+        else:
+            # 待ちが無くなったユーザーの tag は仮想時刻に追い越されたら不要
+            del self.queued_per_user[entry.user_id]
+            if self.last_tag.get(entry.user_id, 0.0) <= self.virtual_time:
+                self.last_tag.pop(entry.user_id, None)
+        return entry
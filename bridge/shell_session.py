@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+ユーザーごとの常駐シェルセッション
+pty上のシェルを使い回すことで、cd・環境変数・venvの有効化がコマンド間で維持される。
+コマンドの終わりは終了コード付きの区切り行（センチネル）で判定する。
+リソース上限はシェルの起動時に設定し、シェルから起動するすべてのコマンドに引き継がれる
+（cgroup があればセッションごとの cgroup に入れ、メモリ・プロセス数はセッション全体で数える）。
+"""
+
+import os
+import pty
+import time
+import shlex
+import signal
+import select
+import secrets
+import termios
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, Any, Optional
+
+from bridge.job_limits import CgroupV2, JobLimits, LimitPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class SessionClosed(Exception):
+    """終了済みのセッションで実行しようとした"""
+
+
+class ShellSession:
+    """pty上で動く1つの常駐シェル
+
+    run() は同時に1つずつ実行する（同じユーザーのコマンドは順番に処理される）。
+    タイムアウトしたセッションは終了させ、以後は使えない（alive が False になる）。
+    limits を指定するとシェルの exec 前に rlimit を設定し、cgroup を指定するとシェルをそこに入れる
+    （cgroup はセッションが所有し、終了時に削除する）。
+    """
+
+    def __init__(self, user_id: str, shell: str = "/bin/bash", cwd: Optional[str] = None,
+                 limits: Optional[JobLimits] = None, cgroup: Optional[Path] = None):
+        self.user_id = user_id
+        self.cgroup = cgroup
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.marker = f"__BRIDGE_DONE_{secrets.token_hex(8)}__"
+
+        master, slave = pty.openpty()
+        # エコーと改行変換を止め、出力をそのまま読めるようにする
+        attrs = termios.tcgetattr(slave)
+        attrs[1] &= ~termios.OPOST
+        attrs[3] &= ~(termios.ECHO | termios.ECHONL)
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+
+        env = dict(os.environ, PS1="", PS2="", PROMPT_COMMAND="", HISTFILE="/dev/null", TERM="dumb")
+        self.proc = subprocess.Popen(
+            [shell, "--noprofile", "--norc"],
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            cwd=cwd or os.path.expanduser("~"),
+            env=env,
+            start_new_session=True,
+            preexec_fn=LimitPolicy.preexec(limits, cgroup, wrapped=False) if limits else None
+        )
+        os.close(slave)
+        self.fd = master
+        logger.info(f"Started shell session for user {user_id} (pid={self.proc.pid})")
+
+    @property
+    def alive(self) -> bool:
+        return self.fd is not None and self.proc.poll() is None
+
+    def run(self, command: str, timeout: float,
+            on_output: Optional[Callable[[Optional[str], str], None]] = None,
+            capture_limit: Optional[int] = None) -> Dict[str, Any]:
+        """コマンドを実行（戻り値は stream_process と同じ形式。標準エラーは標準出力に混ざる）"""
+        with self.lock:
+            if not self.alive:
+                raise SessionClosed(f"shell session for user {self.user_id} is closed")
+            before = CgroupV2.usage(self.cgroup) if self.cgroup is not None else {}
+            try:
+                result = self._run(command, timeout, on_output, capture_limit)
+            finally:
+                self.last_used = time.monotonic()
+            if before:
+                result['rusage'] = self._usage_since(before)
+            return result
+
+    def _usage_since(self, before: Dict[str, float]) -> Dict[str, float]:
+        """cgroup から読んだ今回のコマンドのCPU時間と、セッション全体のピークメモリ"""
+        # タイムアウトで終了した後は cgroup が削除済みなので、開始時点の値しか無い
+        after = CgroupV2.usage(self.cgroup) if self.fd is not None else {}
+        usage = {}
+        if 'cpu_seconds' in after and 'cpu_seconds' in before:
+            usage['cpu_seconds'] = round(after['cpu_seconds'] - before['cpu_seconds'], 3)
+        peak = after.get('peak_rss_kb', before.get('peak_rss_kb'))
+        if peak is not None:
+            usage['peak_rss_kb'] = peak
+        return usage
+
+    def _run(self, command, timeout, on_output, capture_limit) -> Dict[str, Any]:
+        # eval で実行するため cd や export は次のコマンドにも残る。
+        # 標準入力は /dev/null にして、後続の区切り行を読み込まれないようにする
+        line = (
+            f"eval -- {shlex.quote(command)} < /dev/null; "
+            f"printf '\\n{self.marker}:%s\\n' \"$?\"\n"
+        )
+        os.write(self.fd, line.encode('utf-8'))
+
+        deadline = time.monotonic() + timeout
+        pending = ""
+        captured = []
+        captured_len = 0
+        total = 0
+        returncode = None
+
+        def emit(text):
+            nonlocal captured_len, total
+            if not text:
+                return
+            total += len(text)
+            if capture_limit is None or captured_len < capture_limit:
+                captured.append(text)
+                captured_len += len(text)
+            if on_output is not None:
+                on_output('stdout', text)
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                emit(pending)
+                self.close()
+                return self._result(captured, total, None, timed_out=True)
+
+            ready, _, _ = select.select([self.fd], [], [], min(remaining, 0.5))
+            if on_output is not None:
+                on_output(None, "")
+            if not ready:
+                continue
+
+            try:
+                chunk = os.read(self.fd, 65536)
+            except OSError:
+                chunk = b""
+            if not chunk:
+                # シェル自体が終了した（exit など）
+                emit(pending)
+                returncode = self.proc.wait()
+                self.close()
+                return self._result(captured, total, returncode)
+
+            pending += chunk.decode('utf-8', errors='replace')
+            index = pending.find(f"\n{self.marker}:")
+            if index >= 0:
+                end = pending.find("\n", index + 1)
+                if end >= 0:
+                    emit(pending[:index])
+                    code = pending[index + len(self.marker) + 2:end]
+                    returncode = int(code) if code.strip().isdigit() else -1
+                    return self._result(captured, total, returncode)
+                continue
+
+            # 区切り行の途中で切れている可能性がある最後の行だけ保留する
+            cut = pending.rfind("\n")
+            tail = pending[cut + 1:]
+            if cut >= 0 and (self.marker.startswith(tail) or tail.startswith(self.marker)):
+                emit(pending[:cut])
+                pending = pending[cut:]
+            else:
+                emit(pending)
+                pending = ""
+
+    @staticmethod
+    def _result(captured, total, returncode, timed_out=False) -> Dict[str, Any]:
+        return {
+            'stdout': "".join(captured),
+            'stderr': "",
+            'stdout_chars': total,
+            'stderr_chars': 0,
+            'returncode': returncode,
+            'timed_out': timed_out,
+        }
+
+    def close(self):
+        """シェルを終了"""
+        if self.fd is None:
+            return
+        if self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.proc.wait()
+        os.close(self.fd)
+        self.fd = None
+        if self.cgroup is not None:
+            # シェルが裏で起動したまま残っているプロセスも終了させる
+            CgroupV2.remove(self.cgroup)
+        logger.info(f"Closed shell session for user {self.user_id}")
+
+
+class SessionManager:
+    """ユーザーごとのシェルセッションを管理
+
+    - idle_timeout: 最後に使われてからこの秒数が経ったセッションを終了する
+    - max_sessions: 同時に保持するセッションの上限（超えたら最も長く使われていないものを終了）
+    - limits: シェルの起動時に適用するユーザーごとのリソース上限（Noneなら制限しない）
+    """
+
+    def __init__(self, idle_timeout: float = 1800, max_sessions: int = 8, shell: str = "/bin/bash",
+                 limits: Optional[LimitPolicy] = None):
+        self.limits = limits
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max(1, max_sessions)
+        self.shell = shell
+        self.sessions: Dict[str, ShellSession] = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id: str) -> ShellSession:
+        """ユーザーのセッションを取得（無い・終了済みなら作る）"""
+        with self.lock:
+            session = self.sessions.get(user_id)
+            if session is None or not session.alive:
+                session = self._start(user_id)
+                self.sessions[user_id] = session
+            session.last_used = time.monotonic()
+            self._evict_over_limit(keep=user_id)
+            return session
+
+    def _start(self, user_id: str) -> ShellSession:
+        """ユーザーの上限を適用したシェルを起動"""
+        if self.limits is None:
+            return ShellSession(user_id, shell=self.shell)
+        limits = self.limits.for_user(user_id)
+        cgroup = self.limits.create_cgroup(f"session-{user_id}", limits)
+        try:
+            return ShellSession(user_id, shell=self.shell, limits=limits, cgroup=cgroup)
+        except Exception:
+            if cgroup is not None:
+                CgroupV2.remove(cgroup)
+            raise
+
+    def run(self, user_id: str, command: str, timeout: float,
+            on_output: Optional[Callable[[Optional[str], str], None]] = None,
+            capture_limit: Optional[int] = None) -> Dict[str, Any]:
+        """ユーザーのセッションでコマンドを実行"""
+        try:
+            return self.get(str(user_id)).run(command, timeout, on_output, capture_limit)
+        except SessionClosed:
+            # 取得した直後に終了させられた場合は作り直して1回だけ再実行
+            return self.get(str(user_id)).run(command, timeout, on_output, capture_limit)
+
+    def evict_idle(self, now: Optional[float] = None):
+        """一定時間使われていないセッションを終了"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for user_id, session in list(self.sessions.items()):
+                if not session.alive or (
+                    now - session.last_used > self.idle_timeout and not session.lock.locked()
+                ):
+                    self._close(user_id)
+
+    def close_all(self):
+        """全セッションを終了"""
+        with self.lock:
+            for user_id in list(self.sessions):
+                self._close(user_id)
+
+    def _evict_over_limit(self, keep: str):
+        """上限を超えた分を使われていない順に終了（lock保持中に呼ぶ）"""
+        idle = sorted(
+            (s for s in self.sessions.values() if s.user_id != keep and not s.lock.locked()),
+            key=lambda s: s.last_used
+        )
+        while len(self.sessions) > self.max_sessions and idle:
+            self._close(idle.pop(0).user_id)
+
+    def _close(self, user_id: str):
+        self.sessions.pop(user_id).close()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Unixドメインソケットによる低遅延通信
+4バイト長（ビッグエンディアン）+ JSON のフレームでレコードを即座に届ける。
+受け取った側はレコードを保存（または処理）してから受領（ack）フレームを返し、
+送信側は受領を待ってから届いたとみなす。相手が接続していない・受領が返ってこない場合、
+送信側はスプール（ファイル/DB）に書き込む（重複はジャーナルと冪等キーで除く）。
+"""
+
+import os
+import json
+import socket
+import struct
+import queue
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Any, Tuple, Optional, Awaitable
+
+from bridge.records import (
+    KIND_COMMAND, KIND_RESPONSE, KIND_PENDING, KIND_APPROVAL,
+    build_command, build_response, build_progress, build_pending, build_approval,
+)
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("!I")
+MAX_FRAME = 16 * 1024 * 1024
+
+# 受領フレームの種類（name は受け取ったレコードの名前）
+KIND_ACK = "ack"
+# 受領を待つ秒数（過ぎたらスプールに書き込む）
+ACK_TIMEOUT = float(os.getenv('SOCKET_ACK_TIMEOUT', 5))
+
+
+def encode_frame(kind: str, name: str, data: Dict[str, Any]) -> bytes:
+    """レコードを長さ付きフレームに変換"""
+    payload = json.dumps(
+        {"kind": kind, "name": name, "data": data},
+        ensure_ascii=False,
+        separators=(',', ':')
+    ).encode('utf-8')
+    return HEADER.pack(len(payload)) + payload
+
+
+def decode_frame(payload: bytes) -> Tuple[str, str, Dict[str, Any]]:
+    """フレーム本体をレコードに戻す"""
+    message = json.loads(payload.decode('utf-8'))
+    return message["kind"], message["name"], message["data"]
+
+
+def _recv_exact(conn: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = conn.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("peer closed connection")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+class SocketServer:
+    """実行エンジン側のソケットサーバー（スレッド方式）
+
+    接続してきたBotからのレコードを on_message(kind, name, data) に渡し、真が返ったら
+    （レコードを保存できたら）受領を返す。send() で接続中のBotにレコードを送る。
+    on_message は受信とは別の1スレッドで順に呼ぶ（on_message の中の send() が受領を待てるように）。
+    """
+
+    def __init__(self, path: Path, on_message: Callable[[str, str, Dict[str, Any]], bool]):
+        self.path = Path(path)
+        self.on_message = on_message
+        self.sock = None
+        self.clients = []
+        self.lock = threading.Lock()
+        self.running = False
+        # 受領待ちのレコード名 → 受領で立てるイベント
+        self.waiters: Dict[str, threading.Event] = {}
+        self.inbox: "queue.Queue" = queue.Queue()
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.clients)
+
+    def start(self):
+        """待ち受けを開始"""
+        self.path.unlink(missing_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(str(self.path))
+        os.chmod(self.path, 0o600)
+        self.sock.listen(4)
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._handle_loop, daemon=True).start()
+        logger.info(f"Socket channel listening on {self.path}")
+
+    def stop(self):
+        """待ち受けを停止"""
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        with self.lock:
+            for conn in self.clients:
+                conn.close()
+            self.clients = []
+        self.inbox.put(None)
+        self.path.unlink(missing_ok=True)
+
+    def send(self, kind: str, name: str, data: Dict[str, Any],
+             ack_timeout: Optional[float] = None) -> bool:
+        """接続中の相手に送信（誰にも届かなければFalse）
+
+        ack_timeout を指定すると、相手が受領を返すまでその秒数だけ待つ（返ってこなければFalse）。
+        """
+        frame = encode_frame(kind, name, data)
+        delivered = False
+        with self.lock:
+            waiter = None
+            if ack_timeout is not None:
+                # 受領が送信の直後に届いても取りこぼさないよう、送る前に登録する
+                waiter = self.waiters[name] = threading.Event()
+            for conn in list(self.clients):
+                try:
+                    conn.sendall(frame)
+                    delivered = True
+                except OSError as e:
+                    logger.warning(f"Socket send failed, dropping client: {e}")
+                    self._drop(conn)
+        if waiter is None:
+            return delivered
+        try:
+            if delivered and waiter.wait(ack_timeout):
+                return True
+            if delivered:
+                logger.warning(f"No socket ack for {name} within {ack_timeout}s")
+            return False
+        finally:
+            with self.lock:
+                self.waiters.pop(name, None)
+
+    def _drop(self, conn: socket.socket):
+        """切断されたクライアントを外す（lock保持中に呼ぶ）"""
+        if conn in self.clients:
+            self.clients.remove(conn)
+        conn.close()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            with self.lock:
+                self.clients.append(conn)
+            logger.info("Socket channel client connected")
+            threading.Thread(target=self._reader, args=(conn,), daemon=True).start()
+
+    def _reader(self, conn: socket.socket):
+        try:
+            while self.running:
+                (size,) = HEADER.unpack(_recv_exact(conn, HEADER.size))
+                if size > MAX_FRAME:
+                    raise ConnectionError(f"frame too large: {size}")
+                kind, name, data = decode_frame(_recv_exact(conn, size))
+                if kind == KIND_ACK:
+                    with self.lock:
+                        waiter = self.waiters.get(name)
+                    if waiter is not None:
+                        waiter.set()
+                    continue
+                self.inbox.put((conn, kind, name, data))
+        except (OSError, ValueError) as e:
+            if self.running:
+                logger.info(f"Socket channel client disconnected: {e}")
+        finally:
+            with self.lock:
+                self._drop(conn)
+
+    def _handle_loop(self):
+        """受信したレコードを順に処理し、受け付けたものに受領を返す"""
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                break
+            conn, kind, name, data = item
+            try:
+                accepted = self.on_message(kind, name, data)
+            except Exception as e:
+                logger.error(f"Socket message handler error for {name}: {e}")
+                accepted = False
+            if not accepted:
+                continue
+            # 他のスレッドの送信とフレームが混ざらないよう lock を持って書く
+            with self.lock:
+                if conn not in self.clients:
+                    continue
+                try:
+                    conn.sendall(encode_frame(KIND_ACK, name, {}))
+                except OSError as e:
+                    logger.warning(f"Socket ack failed, dropping client: {e}")
+                    self._drop(conn)
+
+
+class AsyncSocketClient:
+    """Bot側のソケットクライアント（asyncio）
+
+    run() は切断されても自動で再接続し続ける。
+    受信したレコードは await on_message(kind, name, data) に渡し、真が返ったら受領を返す。
+    on_message は受信とは別のタスクで順に呼ぶ（処理中も受領を受け取れるように）。
+    """
+
+    def __init__(self, path: Path,
+                 on_message: Callable[[str, str, Dict[str, Any]], Awaitable[bool]],
+                 reconnect_interval: float = 1.0):
+        self.path = Path(path)
+        self.on_message = on_message
+        self.reconnect_interval = reconnect_interval
+        self.writer: Optional[asyncio.StreamWriter] = None
+        # 受領待ちのレコード名 → 受領で完了する Future
+        self.acks: Dict[str, asyncio.Future] = {}
+        # 受信して処理を待っているレコード（名前 → 内容、スプールの重複との照合用）
+        self.queued: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None
+
+    async def run(self):
+        """接続・受信ループ"""
+        inbox: asyncio.Queue = asyncio.Queue()
+        handler = asyncio.ensure_future(self._handle_loop(inbox))
+        try:
+            await self._receive_loop(inbox)
+        finally:
+            handler.cancel()
+
+    async def _receive_loop(self, inbox: asyncio.Queue):
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(str(self.path))
+                logger.info(f"Socket channel connected: {self.path}")
+                while True:
+                    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    if size > MAX_FRAME:
+                        raise ConnectionError(f"frame too large: {size}")
+                    kind, name, data = decode_frame(await reader.readexactly(size))
+                    if kind == KIND_ACK:
+                        future = self.acks.get(name)
+                        if future is not None and not future.done():
+                            future.set_result(True)
+                        continue
+                    self.queued[name] = data
+                    await inbox.put((self.writer, kind, name, data))
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                pass
+            finally:
+                if self.writer is not None:
+                    self.writer.close()
+                    self.writer = None
+            await asyncio.sleep(self.reconnect_interval)
+
+    async def _handle_loop(self, inbox: asyncio.Queue):
+        """受信したレコードを順に処理し、受け付けたものに受領を返す"""
+        while True:
+            writer, kind, name, data = await inbox.get()
+            try:
+                accepted = await self.on_message(kind, name, data)
+            except Exception as e:
+                logger.error(f"Socket message handler error for {name}: {e}")
+                accepted = False
+            finally:
+                self.queued.pop(name, None)
+            # 受け取った接続が切れていれば受領は返さない（送信側がスプールに書き込む）
+            if accepted and writer is self.writer:
+                writer.write(encode_frame(KIND_ACK, name, {}))
+
+    async def send(self, kind: str, name: str, data: Dict[str, Any],
+                   ack_timeout: Optional[float] = None) -> bool:
+        """相手に送信（未接続・失敗時はFalse）
+
+        ack_timeout を指定すると、相手が受領を返すまでその秒数だけ待つ（返ってこなければFalse）。
+        """
+        if self.writer is None:
+            return False
+        future = None
+        if ack_timeout is not None:
+            future = self.acks[name] = asyncio.get_running_loop().create_future()
+        try:
+            self.writer.write(encode_frame(kind, name, data))
+            await self.writer.drain()
+            if future is not None:
+                await asyncio.wait_for(future, ack_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"No socket ack for {name} within {ack_timeout}s")
+            return False
+        except (OSError, ConnectionError) as e:
+            logger.warning(f"Socket send failed: {e}")
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            return False
+        finally:
+            if future is not None:
+                self.acks.pop(name, None)
+
+
+class ChannelCommunicator:
+    """ソケットで即時配信し、届かない場合はスプールに書き込む通信クラス
+
+    送信以外の操作はそのまま元の通信バックエンドに委譲する。
+    最終応答は相手の受領を待ち、返ってこなければスプールに書き込む。
+    進捗は失われても次の進捗・最終応答で補われるので受領を待たない。
+    承認待ちは承認時に参照されるため、常にスプールにも書き込む。
+    """
+
+    def __init__(self, backend, channel: SocketServer, ack_timeout: float = ACK_TIMEOUT):
+        self.backend = backend
+        self.channel = channel
+        self.ack_timeout = ack_timeout
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
+
+    def _deliver(self, kind: str, record: Tuple[str, Dict[str, Any]], ack: bool = True) -> str:
+        name, data = record
+        if self.channel.send(kind, name, data, ack_timeout=self.ack_timeout if ack else None):
+            return name
+        return self.backend.write_record(kind, name, data)
+
+    def create_command(self, command: str, user_info: Dict[str, str]) -> str:
+        return self._deliver(KIND_COMMAND, build_command(command, user_info))
+
+    def create_response(self, message: str, status: str = "success", **kwargs) -> str:
+        return self._deliver(KIND_RESPONSE, build_response(message, status, **kwargs))
+
+    def create_progress(self, job_id: str, seq: int, output: str, **kwargs) -> str:
+        return self._deliver(KIND_RESPONSE, build_progress(job_id, seq, output, **kwargs), ack=False)
+
+    def create_approval(self, pending_name: str, approval: bool, **kwargs) -> str:
+        return self._deliver(KIND_APPROVAL, build_approval(pending_name, approval, **kwargs))
+
+    def create_pending(self, command: str, message: str, **kwargs) -> str:
+        name, data = build_pending(command, message, **kwargs)
+        name = self.backend.write_record(KIND_PENDING, name, data)
+        if name:
+            self.channel.send(KIND_PENDING, name, data)
+        return name
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+スプールファイルの書き込み・読み込み
+Bot と実行エンジンが共通で使う。ファイルは書き終わった状態でしか見えないよう、
+O_TMPFILE で名前の無いファイルに書いてから linkat で名前を付ける
+（使えないファイルシステムでは一時ファイルに書いてから rename する）。
+"""
+
+import os
+import json
+import errno
+import ctypes
+import logging
+import itertools
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+_libc = ctypes.CDLL(None, use_errno=True)
+AT_FDCWD = -100
+AT_EMPTY_PATH = 0x1000
+
+# 同じプロセスの一時ファイル名が重ならないようにする連番
+_temp_counter = itertools.count()
+
+
+def encode_record(data: Dict[str, Any], fmt: str = "json") -> bytes:
+    """レコードをバイト列に変換（json: 改行・インデント無しのJSON / msgpack）"""
+    if fmt == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode_record(raw: bytes) -> Dict[str, Any]:
+    """バイト列をレコードに戻す（先頭の1バイトで JSON か msgpack かを判定する）"""
+    if raw[:1] in (b"{", b" ", b"\n"):
+        return json.loads(raw)
+    if msgpack is None:
+        raise ValueError("record is not JSON and msgpack is not installed")
+    return msgpack.unpackb(raw, raw=False)
+
+
+def read_record(filepath: Path) -> Optional[Dict[str, Any]]:
+    """スプールファイルを読む（書き込みは常に完成したファイルを置くのでロックは不要）"""
+    try:
+        with open(filepath, 'rb') as f:
+            return decode_record(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Failed to read {filepath}: {e}")
+        return None
+
+
+class SpoolWriter:
+    """スプールファイルの書き込み
+
+    - fmt: "json"（既定）または "msgpack"（msgpack が入っている場合のみ。読む側は自動で判定する）
+    - fsync: "none"（しない）/ "always"（書き込みごと）/ "batch"（fsync_interval 秒ごとにまとめて）
+    同じ名前のファイルが既にある場合は置き換える。
+    """
+
+    def __init__(self, fmt: str = "json", fsync: str = "none", fsync_interval: float = 0.05):
+        if fmt == "msgpack" and msgpack is None:
+            logger.warning("msgpack is not installed, writing spool records as JSON")
+            fmt = "json"
+        self.fmt = fmt
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        # O_TMPFILE + linkat が使えるか（最初の失敗で以後は rename にする）
+        self.use_tmpfile = hasattr(os, 'O_TMPFILE')
+        self.link_mode: Optional[str] = None
+        self.lock = threading.Lock()
+        self.unsynced: List[int] = []
+        self.unsynced_dirs = set()
+        self.timer: Optional[threading.Timer] = None
+
+    @classmethod
+    def from_env(cls) -> "SpoolWriter":
+        """環境変数の設定で作成"""
+        return cls(
+            fmt=os.getenv('SPOOL_FORMAT', 'json').lower(),
+            fsync=os.getenv('SPOOL_FSYNC', 'none').lower(),
+            fsync_interval=float(os.getenv('SPOOL_FSYNC_INTERVAL', 0.05))
+        )
+
+    def write(self, filepath: Path, data: Dict[str, Any]) -> bool:
+        """レコードを書き込む（失敗したらFalse）"""
+        filepath = Path(filepath)
+        try:
+            payload = encode_record(data, self.fmt)
+            fd = None
+            if self.use_tmpfile:
+                fd = self._write_tmpfile(filepath, payload)
+            if fd is None:
+                fd = self._write_rename(filepath, payload)
+            self._sync(fd, filepath.parent)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to write {filepath}: {e}")
+            return False
+
+    def _write_tmpfile(self, filepath: Path, payload: bytes) -> Optional[int]:
+        """名前の無いファイルに書いてから名前を付ける（使えなければNone）"""
+        try:
+            fd = os.open(filepath.parent, os.O_TMPFILE | os.O_WRONLY, 0o644)
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL):
+                logger.info(f"O_TMPFILE not supported in {filepath.parent}, using rename")
+                self.use_tmpfile = False
+                return None
+            raise
+
+        try:
+            os.write(fd, payload)
+            if self._link(fd, filepath):
+                return fd
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+        return None
+
+    def _link(self, fd: int, filepath: Path) -> bool:
+        """O_TMPFILE のファイルに名前を付ける（同じ名前が既にあればFalse）
+
+        /proc/self/fd 経由の linkat を使い、使えない環境では AT_EMPTY_PATH
+        （CAP_DAC_READ_SEARCH が必要）を試す。どちらも使えなければ以後は rename にする。
+        """
+        target = os.fsencode(filepath)
+        if self.link_mode in (None, "proc"):
+            try:
+                os.link(f"/proc/self/fd/{fd}", target, follow_symlinks=True)
+                self.link_mode = "proc"
+                return True
+            except FileExistsError:
+                return False
+            except OSError:
+                if self.link_mode == "proc":
+                    raise
+                self.link_mode = "empty_path"
+
+        if _libc.linkat(fd, b"", AT_FDCWD, target, AT_EMPTY_PATH) == 0:
+            return True
+        err = ctypes.get_errno()
+        if err == errno.EEXIST:
+            return False
+        logger.info(f"linkat not available ({os.strerror(err)}), using rename")
+        self.use_tmpfile = False
+        return False
+
+    def _write_rename(self, filepath: Path, payload: bytes) -> int:
+        """一時ファイル（.json で終わらない隠しファイル）に書いてから rename する"""
+        temp_file = filepath.parent / f".{filepath.name}.{os.getpid()}.{next(_temp_counter)}.tmp"
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            os.write(fd, payload)
+            os.rename(temp_file, filepath)
+        except BaseException:
+            os.close(fd)
+            temp_file.unlink(missing_ok=True)
+            raise
+        return fd
+
+    def _sync(self, fd: int, directory: Path):
+        """設定に応じてファイルとディレクトリをディスクに書き出す"""
+        if self.fsync == "always":
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._fsync_dir(directory)
+        elif self.fsync == "batch":
+            with self.lock:
+                self.unsynced.append(fd)
+                self.unsynced_dirs.add(directory)
+                if self.timer is None:
+                    self.timer = threading.Timer(self.fsync_interval, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+        else:
+            os.close(fd)
+
+    @staticmethod
+    def _fsync_dir(directory: Path):
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def flush(self):
+        """まとめて書き出す（batch のとき）"""
+        with self.lock:
+            fds, self.unsynced = self.unsynced, []
+            directories, self.unsynced_dirs = self.unsynced_dirs, set()
+            self.timer = None
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logger.error(f"fsync failed: {e}")
+            finally:
+                os.close(fd)
+        for directory in directories:
+            try:
+                self._fsync_dir(directory)
+            except OSError as e:
+                logger.error(f"fsync failed for {directory}: {e}")
+
+    def close(self):
+        """未書き出しの分を書き出す"""
+        with self.lock:
+            timer = self.timer
+        if timer:
+            timer.cancel()
+        self.flush()
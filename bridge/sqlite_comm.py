@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+SQLiteを使った通信バックエンド
+WALモードのデータベース1つでコマンド・レスポンス・承認待ちを管理する
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.records import (
+    KIND_COMMAND, KIND_RESPONSE, KIND_PENDING, KIND_APPROVAL,
+    build_command, build_response, build_progress, build_pending, build_approval,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_queue ON messages(kind, status, created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_updated ON messages(updated_at);
+"""
+
+# messages.status（キュー上の状態。レスポンス本文のstatusとは別）
+STATUS_QUEUED = "queued"
+STATUS_CLAIMED = "claimed"
+
+
+class SQLiteCommunicator:
+    """SQLite（WALモード）を使った通信クラス
+
+    FileCommunicator と同じAPIを持ち、各レコードにはファイルバックエンドと
+    同じ名前（cmd_*.json など）を付ける。そのため承認などの名前の対応付けは
+    バックエンドによらず共通になる。
+    """
+
+    def __init__(self, base_dir: str = "/tmp/claude-discord", db_path: Optional[str] = None,
+                 worker_id: Optional[str] = None):
+        self.base_dir = Path(base_dir)
+        self.worker_id = worker_id
+        # このインスタンスが処理中にしたレコード（リース延長の対象）
+        self.claimed = set()
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = Path(db_path) if db_path else self.base_dir / "bridge.db"
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=5,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """接続を閉じる"""
+        with self.lock:
+            self.conn.close()
+
+    def _insert(self, kind: str, name: str, data: Dict[str, Any],
+                created_at: Optional[float] = None) -> str:
+        """レコードを追加（同名が既にあれば内容を置き換える）
+
+        ファイルバックエンドが同名のファイルを上書きするのに合わせる（進捗の更新など）。
+        キュー上の状態と作成時刻はそのままにするので、処理中のレコードが未処理に戻ることはない。
+        """
+        now = time.time()
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT INTO messages (kind, name, status, created_at, updated_at, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    (kind, name, STATUS_QUEUED, created_at or now, now, payload)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Failed to insert {name}: {e}")
+            return ""
+        return name
+
+    def _select(self, sql: str, params: tuple = ()) -> List[Tuple[str, Dict[str, Any]]]:
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [(name, json.loads(data)) for name, data in rows]
+
+    def _delete(self, name: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM messages WHERE name = ?", (name,))
+
+    def _claim(self, kind: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """最も古い未処理レコードを取得し、処理中にする（アトミック）"""
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                row = self.conn.execute(
+                    "SELECT id, name, data FROM messages "
+                    "WHERE kind = ? AND status = ? ORDER BY created_at, id LIMIT 1",
+                    (kind, STATUS_QUEUED)
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE messages SET status = ?, updated_at = ? WHERE id = ?",
+                        (STATUS_CLAIMED, time.time(), row[0])
+                    )
+                self.conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                logger.error(f"Failed to claim {kind}: {e}")
+                return None
+
+        if row:
+            self.claimed.add(row[1])
+            return row[1], json.loads(row[2])
+        return None
+
+    def _claim_named(self, kind: str, name: str) -> Optional[Dict[str, Any]]:
+        """名前を指定して未処理レコードを処理中にする（他が取得済みならNone）"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE messages SET status = ?, updated_at = ? "
+                "WHERE kind = ? AND name = ? AND status = ?",
+                (STATUS_CLAIMED, time.time(), kind, name, STATUS_QUEUED)
+            )
+            if cursor.rowcount != 1:
+                return None
+            row = self.conn.execute("SELECT data FROM messages WHERE name = ?", (name,)).fetchone()
+        self.claimed.add(name)
+        return json.loads(row[0]) if row else None
+
+    def write_record(self, kind: str, name: str, data: Dict[str, Any]) -> str:
+        """レコードを追加"""
+        return self._insert(kind, name, data)
+
+    def create_command(self, command: str, user_info: Dict[str, str]) -> str:
+        """コマンドを作成"""
+        return self._insert(KIND_COMMAND, *build_command(command, user_info))
+
+    def create_response(self, message: str, status: str = "success", **kwargs) -> str:
+        """レスポンスを作成"""
+        return self._insert(KIND_RESPONSE, *build_response(message, status, **kwargs))
+
+    def create_progress(self, job_id: str, seq: int, output: str, **kwargs) -> str:
+        """実行中の進捗レコードを作成（ストリーミングモード用）"""
+        return self._insert(KIND_RESPONSE, *build_progress(job_id, seq, output, **kwargs))
+
+    def create_pending(self, command: str, message: str, **kwargs) -> str:
+        """承認待ちを作成"""
+        return self._insert(KIND_PENDING, *build_pending(command, message, **kwargs))
+
+    def create_approval(self, pending_name: str, approval: bool, **kwargs) -> str:
+        """承認/拒否の結果を作成"""
+        return self._insert(KIND_APPROVAL, *build_approval(pending_name, approval, **kwargs))
+
+    def get_oldest_command(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """最も古い未処理コマンドを取得"""
+        rows = self._select(
+            "SELECT name, data FROM messages WHERE kind = ? AND status = ? "
+            "ORDER BY created_at, id LIMIT 1",
+            (KIND_COMMAND, STATUS_QUEUED)
+        )
+        return rows[0] if rows else None
+
+    def claim_next_command(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """最も古い未処理コマンドを取得して処理中にする"""
+        return self._claim(KIND_COMMAND)
+
+    def claim_next_approval(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """最も古い未処理の承認結果を取得して処理中にする"""
+        return self._claim(KIND_APPROVAL)
+
+    def claim_command(self, name: str) -> Optional[Dict[str, Any]]:
+        """コマンドを取得して処理中にする（他の実行エンジンが取得済みならNone）"""
+        return self._claim_named(KIND_COMMAND, name)
+
+    def claim_approval(self, name: str) -> Optional[Dict[str, Any]]:
+        """承認結果を取得して処理中にする（他の実行エンジンが取得済みならNone）"""
+        return self._claim_named(KIND_APPROVAL, name)
+
+    def adopt_record(self, kind: str, name: str, data: Dict[str, Any]) -> bool:
+        """スプールを経由せずに届いたコマンド・承認結果を、処理中のレコードとして保存する"""
+        now = time.time()
+        try:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO messages (kind, name, status, created_at, updated_at, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (kind, name, STATUS_CLAIMED, now, now,
+                     json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Failed to store {name}: {e}")
+            return False
+        self.claimed.add(name)
+        return True
+
+    def renew_leases(self):
+        """処理中のレコードのリースを延長"""
+        names = list(self.claimed)
+        if not names:
+            return
+        placeholders = ",".join("?" * len(names))
+        with self.lock:
+            self.conn.execute(
+                f"UPDATE messages SET updated_at = ? WHERE status = ? AND name IN ({placeholders})",
+                (time.time(), STATUS_CLAIMED, *names)
+            )
+
+    def reclaim_expired(self, lease_seconds: float) -> int:
+        """リースが切れた処理中レコード（停止した実行エンジンのもの）を未処理に戻す"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE messages SET status = ?, updated_at = ? "
+                "WHERE status = ? AND kind IN (?, ?) AND updated_at < ?",
+                (STATUS_QUEUED, time.time(), STATUS_CLAIMED,
+                 KIND_COMMAND, KIND_APPROVAL, time.time() - lease_seconds)
+            )
+        if cursor.rowcount:
+            logger.warning(f"Reclaimed {cursor.rowcount} expired leases")
+        return cursor.rowcount
+
+    def release_claims(self) -> int:
+        """前回の処理中レコードはどの実行エンジンのものか区別できないため、リース切れで戻す"""
+        return 0
+
+    def finish_command(self, name: str):
+        """処理済みコマンドを削除"""
+        self.claimed.discard(name)
+        self._delete(name)
+
+    def finish_approval(self, name: str):
+        """処理済みの承認結果を削除"""
+        self.claimed.discard(name)
+        self._delete(name)
+
+    def list_responses(self, limit: int = 100) -> List[Tuple[str, Dict[str, Any]]]:
+        """未送信のレスポンスを古い順に取得"""
+        return self._select(
+            "SELECT name, data FROM messages WHERE kind = ? ORDER BY created_at, id LIMIT ?",
+            (KIND_RESPONSE, limit)
+        )
+
+    def ack_response(self, name: str):
+        """送信済みのレスポンスを削除"""
+        self._delete(name)
+
+    def list_pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """承認待ちの一覧"""
+        return self._select(
+            "SELECT name, data FROM messages WHERE kind = ? ORDER BY created_at, id",
+            (KIND_PENDING,)
+        )
+
+    def list_pending_names(self) -> List[str]:
+        """承認待ちの名前の一覧（内容は読まない）"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM messages WHERE kind = ? ORDER BY created_at, id",
+                (KIND_PENDING,)
+            ).fetchall()
+        return [name for (name,) in rows]
+
+    def get_pending(self, name: str) -> Optional[Dict[str, Any]]:
+        """承認待ちを名前で取得"""
+        rows = self._select(
+            "SELECT name, data FROM messages WHERE kind = ? AND name = ?",
+            (KIND_PENDING, name)
+        )
+        return rows[0][1] if rows else None
+
+    def remove_pending(self, name: str):
+        """承認待ちを削除"""
+        self._delete(name)
+
+    def counts(self) -> Dict[str, int]:
+        """種類ごとの件数"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT kind, COUNT(*) FROM messages GROUP BY kind"
+            ).fetchall()
+        found = dict(rows)
+        return {
+            'commands': found.get(KIND_COMMAND, 0),
+            'responses': found.get(KIND_RESPONSE, 0),
+            'pending': found.get(KIND_PENDING, 0),
+        }
+
+    def cleanup_old_files(self, hours: int = 24):
+        """古いレコードを削除"""
+        cutoff = time.time() - hours * 3600
+        with self.lock:
+            cur = self.conn.execute("DELETE FROM messages WHERE updated_at < ?", (cutoff,))
+        if cur.rowcount:
+            logger.info(f"Cleaned up {cur.rowcount} old records")
+
+    def migrate_from_spool(self, file_comm) -> int:
+        """ファイルスプールの既存ファイルを取り込み、取り込んだファイルを削除
+
+        複数の実行エンジンが同時に移行しないよう、通信ディレクトリのロックファイルを持って行う。
+        処理中（claimed/）のファイルは以前の実行エンジンのものなので未処理として取り込む
+        （再実行してよいかは取得したときにジャーナルで判断される）。
+        ファイルは取り込みをコミットしてから削除する。
+        """
+        sources = [
+            (file_comm.command_dir, "cmd_*.json", KIND_COMMAND),
+            (file_comm.claimed_root, "*/cmd_*.json", KIND_COMMAND),
+            (file_comm.pending_dir, "pending_*.json", KIND_PENDING),
+            (file_comm.approval_dir, "approval_*.json", KIND_APPROVAL),
+            (file_comm.claimed_root, "*/approval_*.json", KIND_APPROVAL),
+            (file_comm.response_dir, "approval_*.json", KIND_APPROVAL),
+            (file_comm.response_dir, "res_*.json", KIND_RESPONSE),
+            (file_comm.response_dir, "prog_*.json", KIND_RESPONSE),
+        ]
+
+        with open(self.base_dir / ".migrate.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return self._migrate(file_comm, sources)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _migrate(self, file_comm, sources) -> int:
+        """ファイルを1トランザクションで取り込み、コミット後に削除（移行のロック保持中に呼ぶ）"""
+        rows = []
+        for directory, pattern, kind in sources:
+            for filepath in sorted(directory.glob(pattern)):
+                data = file_comm.read_json_safe(filepath)
+                if data is None:
+                    continue
+                try:
+                    created_at = filepath.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                rows.append((filepath, kind, data, created_at))
+        if not rows:
+            return 0
+
+        imported = 0
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                for filepath, kind, data, created_at in rows:
+                    cur = self.conn.execute(
+                        "INSERT OR IGNORE INTO messages "
+                        "(kind, name, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                        (kind, filepath.name, STATUS_QUEUED, created_at, time.time(),
+                         json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+                    )
+                    imported += cur.rowcount
+                self.conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                logger.error(f"Failed to migrate spool files: {e}")
+                return 0
+
+        for filepath, _, _, _ in rows:
+            filepath.unlink(missing_ok=True)
+        if imported:
+            logger.info(f"Migrated {imported} spool files into {self.db_path}")
+        return imported
+
+
+def main():
+    """ファイルスプールをSQLiteに移行する"""
+    from bridge.file_comm import FileCommunicator
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    base_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv('COMM_DIR', '/tmp/claude-discord')
+    comm = SQLiteCommunicator(base_dir)
+    count = comm.migrate_from_spool(FileCommunicator(base_dir))
+    logger.info(f"{count}件のファイルを {comm.db_path} に移行しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+コマンド出力のストリーミング
+実行中のプロセスの標準出力/標準エラーを逐次読み取り、進捗レコードとして配信する
+"""
+
+import os
+import time
+import codecs
+import asyncio
+import logging
+import selectors
+import subprocess
+from typing import Callable, Dict, Any, Optional
+
+from bridge.job_process import kill_process_tree, usage_dict, wait_process
+
+logger = logging.getLogger(__name__)
+
+# on_output(stream_name, text) のstream_name（アイドル時のtickはNone）
+STDOUT = "stdout"
+STDERR = "stderr"
+
+
+def stream_process(proc: subprocess.Popen, timeout: float,
+                   on_output: Callable[[Optional[str], str], None],
+                   tick: float = 0.5, capture_limit: Optional[int] = None,
+                   process_group: bool = False) -> Dict[str, Any]:
+    """プロセスの出力を逐次読み取る
+
+    出力を受け取るたびに on_output(stream_name, text) を呼び、
+    出力が無い間も tick 秒ごとに on_output(None, "") を呼ぶ。
+    タイムアウト時はプロセスをkillして timed_out=True を返す
+    （process_group なら新しいセッションで起動したプロセスグループごとkillする）。
+    capture_limit を指定すると、戻り値に保持する出力は先頭のその文字数までになる
+    （全出力は on_output 側でディスク等に書き出す）。
+    戻り値の rusage はプロセスのピークメモリ（KB）とCPU時間（秒）。
+    """
+    selector = selectors.DefaultSelector()
+    decoders = {}
+    chunks = {STDOUT: [], STDERR: []}
+    captured = {STDOUT: 0, STDERR: 0}
+    total = {STDOUT: 0, STDERR: 0}
+
+    for name, pipe in ((STDOUT, proc.stdout), (STDERR, proc.stderr)):
+        if pipe is not None:
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ, name)
+            decoders[name] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    deadline = time.monotonic() + timeout
+    timed_out = False
+
+    try:
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                kill_process_tree(proc, process_group)
+                break
+
+            events = selector.select(timeout=min(tick, remaining))
+            if not events:
+                on_output(None, "")
+                continue
+
+            for key, _ in events:
+                name = key.data
+                try:
+                    data = os.read(key.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    selector.unregister(key.fileobj)
+                    text = decoders[name].decode(b"", final=True)
+                else:
+                    text = decoders[name].decode(data)
+                if text:
+                    total[name] += len(text)
+                    keep = text
+                    if capture_limit is not None:
+                        keep = text[:max(capture_limit - captured[name], 0)]
+                    if keep:
+                        chunks[name].append(keep)
+                        captured[name] += len(keep)
+                    on_output(name, text)
+    finally:
+        selector.close()
+        for pipe in (proc.stdout, proc.stderr):
+            if pipe is not None:
+                pipe.close()
+
+    returncode, usage = wait_process(proc, timeout=5, process_group=process_group)
+
+    return {
+        'stdout': "".join(chunks[STDOUT]),
+        'stderr': "".join(chunks[STDERR]),
+        'stdout_chars': total[STDOUT],
+        'stderr_chars': total[STDERR],
+        'returncode': returncode,
+        'timed_out': timed_out,
+        'rusage': usage_dict(usage),
+    }
+
+
+async def stream_process_async(proc, timeout: float,
+                               on_output: Callable[[Optional[str], str], None],
+                               tick: float = 0.5, capture_limit: Optional[int] = None,
+                               process_group: bool = False) -> Dict[str, Any]:
+    """stream_process のasyncio版（proc は asyncio.subprocess.Process または AsyncProcess）
+
+    タイムアウト時はプロセスをkillして timed_out=True を返す。
+    呼び出し側でキャンセルされた場合もプロセスをkillしてから CancelledError を送出する。
+    rusage は AsyncProcess で起動した場合だけ取得できる。
+    """
+    chunks = {STDOUT: [], STDERR: []}
+    captured = {STDOUT: 0, STDERR: 0}
+    total = {STDOUT: 0, STDERR: 0}
+
+    async def pump(name: str, stream: asyncio.StreamReader):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await stream.read(64 * 1024)
+            text = decoder.decode(data, final=not data)
+            if text:
+                total[name] += len(text)
+                keep = text
+                if capture_limit is not None:
+                    keep = text[:max(capture_limit - captured[name], 0)]
+                if keep:
+                    chunks[name].append(keep)
+                    captured[name] += len(keep)
+                on_output(name, text)
+            if not data:
+                return
+
+    async def ticker():
+        while True:
+            await asyncio.sleep(tick)
+            on_output(None, "")
+
+    tasks = [asyncio.ensure_future(pump(name, stream))
+             for name, stream in ((STDOUT, proc.stdout), (STDERR, proc.stderr))
+             if stream is not None]
+    tick_task = asyncio.ensure_future(ticker())
+    timed_out = False
+    completed = False
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*tasks, proc.wait()), timeout=timeout)
+        completed = True
+    except asyncio.TimeoutError:
+        timed_out = True
+    finally:
+        tick_task.cancel()
+        for task in tasks:
+            task.cancel()
+        if not completed:
+            kill_process_tree(proc, process_group)
+        if proc.returncode is None:
+            await proc.wait()
+
+    return {
+        'stdout': "".join(chunks[STDOUT]),
+        'stderr': "".join(chunks[STDERR]),
+        'stdout_chars': total[STDOUT],
+        'stderr_chars': total[STDERR],
+        'returncode': proc.returncode,
+        'timed_out': timed_out,
+        'rusage': usage_dict(getattr(proc, 'rusage', None)),
+    }
+
+
+class ProgressPublisher:
+    """実行中の出力を一定間隔で進捗レコードとして書き出すクラス
+
+    各レコードは job_id ごとに連番(seq)を持ち、出力の末尾 tail_chars 文字を含む。
+    Bot側は最大のseqのレコードだけを表示すればよい。
+    """
+
+    def __init__(self, comm, job_id: str, command: str,
+                 interval: float = 1.0, tail_chars: int = 1500):
+        self.comm = comm
+        self.job_id = job_id
+        self.command = command
+        self.interval = interval
+        self.tail_chars = tail_chars
+
+        self.seq = 0
+        self.tail = ""
+        self.total_chars = 0
+        self.dirty = False
+        self.last_publish = 0.0
+
+    def feed(self, stream_name: Optional[str], text: str):
+        """stream_process の on_output として使う"""
+        if text:
+            self.tail = (self.tail + text)[-self.tail_chars:]
+            self.total_chars += len(text)
+            self.dirty = True
+
+        if self.dirty and time.monotonic() - self.last_publish >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """未送信の出力があれば進捗レコードを書き出す"""
+        if not self.dirty:
+            return
+        self.seq += 1
+        self.comm.create_progress(
+            job_id=self.job_id,
+            seq=self.seq,
+            command=self.command,
+            output=self.tail,
+            total_chars=self.total_chars
+        )
+        self.dirty = False
+        self.last_publish = time.monotonic()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+通信バックエンドの選択
+Botと実行エンジンは以下の共通APIだけを使う
+
+- create_command / create_response / create_progress / create_pending / create_approval
+- get_oldest_command / finish_command / finish_approval
+- claim_command / claim_approval / renew_leases / reclaim_expired / release_claims
+- list_responses / ack_response
+- list_pending / get_pending / remove_pending
+- counts / cleanup_old_files
+"""
+
+import os
+import logging
+from typing import Optional
+
+from bridge.file_comm import FileCommunicator
+from bridge.sqlite_comm import SQLiteCommunicator
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("file", "sqlite")
+
+
+def create_communicator(base_dir: Optional[str] = None, backend: Optional[str] = None,
+                        worker_id: Optional[str] = None, migrate: bool = False):
+    """通信バックエンドを作成
+
+    base_dir: 通信ディレクトリ（未指定時は環境変数 COMM_DIR）
+    backend: "file" / "sqlite"（未指定時は環境変数 BRIDGE_TRANSPORT、既定は file）
+    worker_id: 実行エンジンの識別子（未指定時は環境変数 EXECUTOR_ID、なければ ホスト名-PID）
+    migrate: sqlite のとき旧バックエンドのファイルを取り込む（実行エンジンだけが指定する）
+    """
+    base_dir = str(base_dir or os.getenv('COMM_DIR', '/tmp/claude-discord'))
+    backend = (backend or os.getenv('BRIDGE_TRANSPORT', 'file')).lower()
+
+    if backend == "sqlite":
+        comm = SQLiteCommunicator(base_dir, worker_id=worker_id)
+        if migrate:
+            # 旧バックエンドのファイルが残っていれば取り込む
+            comm.migrate_from_spool(FileCommunicator(base_dir))
+        return comm
+    if backend != "file":
+        logger.warning(f"Unknown transport '{backend}', using file backend")
+    return FileCommunicator(base_dir, worker_id=worker_id)
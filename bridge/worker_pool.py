@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+コマンド実行用のワーカープール
+同時実行数・ユーザーごとの同時実行数・キュー長を制限する
+実行待ちの順番は FairScheduler（優先度・ユーザーごとの公平キューイング）で決める
+"""
+
+import asyncio
+import threading
+import logging
+from typing import Callable, Dict, Any, Optional
+
+from bridge.scheduler import FairScheduler, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+
+class PoolJob:
+    """プールに投入されたジョブ"""
+
+    def __init__(self, job_id: str, user_id: str, func: Callable, args: tuple):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+
+
+class WorkerPool:
+    """上限付きのワーカースレッドプール
+
+    - max_workers: 全体の最大同時実行数
+    - per_user_limit: 1ユーザーあたりの最大同時実行数
+    - max_queue: 実行待ちジョブの上限（超えた投入は拒否）
+    - scheduler: 実行待ちの順番を決めるスケジューラ（省略時は既定設定）
+    """
+
+    def __init__(self, max_workers: int = 4, per_user_limit: int = 2, max_queue: int = 100,
+                 scheduler: Optional[FairScheduler] = None):
+        self.max_workers = max(1, max_workers)
+        self.per_user_limit = max(1, per_user_limit)
+        self.max_queue = max(0, max_queue)
+
+        self.scheduler = scheduler or FairScheduler()
+        self.running_per_user: Dict[str, int] = {}
+        self.active = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        """ワーカースレッドを起動"""
+        with self.cond:
+            self.running = True
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(
+            f"Worker pool started (workers={self.max_workers}, "
+            f"per_user={self.per_user_limit}, max_queue={self.max_queue})"
+        )
+
+    def stop(self, timeout: Optional[float] = None):
+        """新規取り出しを止めて、実行中のジョブの終了を待つ"""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads = []
+        logger.info("Worker pool stopped")
+
+    def submit(self, job_id: str, user_id: str, func: Callable, *args,
+               priority: int = PRIORITY_NORMAL) -> bool:
+        """ジョブを投入（キューが満杯ならFalse）"""
+        with self.cond:
+            if len(self.scheduler) >= self.max_queue:
+                logger.warning(f"Queue full ({self.max_queue}), rejected job {job_id}")
+                return False
+            self.scheduler.push(job_id, str(user_id), PoolJob(job_id, str(user_id), func, args), priority)
+            self.cond.notify()
+        return True
+
+    def position(self, job_id: str) -> Optional[int]:
+        """実行待ちの順番（1始まり。実行中・終了済みならNone）"""
+        with self.cond:
+            return self.scheduler.position(job_id)
+
+    def cancel(self, job_id: str) -> Optional[PoolJob]:
+        """実行待ちのジョブを取り消して返す（実行中・終了済みならNone）"""
+        with self.cond:
+            return self.scheduler.remove(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """現在のキュー状態"""
+        with self.cond:
+            return {
+                'queued': len(self.scheduler),
+                'active': self.active,
+                'max_workers': self.max_workers,
+            }
+
+    def _can_run(self, user_id: str) -> bool:
+        return self.running_per_user.get(user_id, 0) < self.per_user_limit
+
+    def _next_runnable(self) -> Optional[PoolJob]:
+        """ユーザー上限に達していないジョブをスケジューラの順で取り出す（cond保持中に呼ぶ）"""
+        return self.scheduler.pop(self._can_run)
+
+    def _worker_loop(self):
+        """ワーカーループ"""
+        while True:
+            with self.cond:
+                job = None
+                while self.running:
+                    job = self._next_runnable()
+                    if job:
+                        break
+                    self.cond.wait()
+                if job is None:
+                    return
+                self.active += 1
+                self.running_per_user[job.user_id] = self.running_per_user.get(job.user_id, 0) + 1
+
+            try:
+                job.func(*job.args)
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed: {e}")
+            finally:
+                with self.cond:
+                    self.active -= 1
+                    remaining = self.running_per_user[job.user_id] - 1
+                    if remaining:
+                        self.running_per_user[job.user_id] = remaining
+                    else:
+                        del self.running_per_user[job.user_id]
+                    # ユーザー上限で待っていたジョブが実行可能になった可能性がある
+                    self.cond.notify_all()
+
+
+class AsyncJobPool:
+    """asyncio版のジョブプール（スレッドを使わずにタスクで並行実行する）
+
+    WorkerPool と同じ上限とスケジューラを持ち、submit() にはコルーチン関数を渡す。
+    枠が空いたときだけタスクを作るので、実行待ちのジョブはタスクを持たない。
+    submit() は別スレッド（ソケット受信など）からも呼べる。
+    """
+
+    def __init__(self, max_workers: int = 4, per_user_limit: int = 2, max_queue: int = 100,
+                 scheduler: Optional[FairScheduler] = None):
+        self.max_workers = max(1, max_workers)
+        self.per_user_limit = max(1, per_user_limit)
+        self.max_queue = max(0, max_queue)
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.scheduler = scheduler or FairScheduler()
+        self.running_per_user: Dict[str, int] = {}
+        self.tasks = set()
+        self.active = 0
+        self.accepting = True
+        self.lock = threading.Lock()
+
+    def start(self):
+        """実行中のイベントループに結び付ける"""
+        self.loop = asyncio.get_running_loop()
+        self.accepting = True
+        logger.info(
+            f"Async job pool started (concurrency={self.max_workers}, "
+            f"per_user={self.per_user_limit}, max_queue={self.max_queue})"
+        )
+
+    def submit(self, job_id: str, user_id: str, func: Callable, *args,
+               priority: int = PRIORITY_NORMAL) -> bool:
+        """ジョブを投入（キューが満杯・停止中ならFalse）"""
+        with self.lock:
+            if not self.accepting or len(self.scheduler) >= self.max_queue:
+                logger.warning(f"Queue full or draining, rejected job {job_id}")
+                return False
+            self.scheduler.push(job_id, str(user_id), PoolJob(job_id, str(user_id), func, args), priority)
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self._dispatch()
+        else:
+            self.loop.call_soon_threadsafe(self._dispatch)
+        return True
+
+    def position(self, job_id: str) -> Optional[int]:
+        """実行待ちの順番（1始まり。実行中・終了済みならNone）"""
+        with self.lock:
+            return self.scheduler.position(job_id)
+
+    def cancel(self, job_id: str) -> Optional[PoolJob]:
+        """実行待ちのジョブを取り消して返す（実行中・終了済みならNone）"""
+        with self.lock:
+            return self.scheduler.remove(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """現在のキュー状態"""
+        with self.lock:
+            return {
+                'queued': len(self.scheduler),
+                'active': self.active,
+                'max_workers': self.max_workers,
+            }
+
+    def _can_run(self, user_id: str) -> bool:
+        return self.running_per_user.get(user_id, 0) < self.per_user_limit
+
+    def _dispatch(self):
+        """空いている枠の分だけスケジューラの順でジョブを開始（イベントループ上で呼ぶ）"""
+        with self.lock:
+            while self.accepting and self.active < self.max_workers:
+                job = self.scheduler.pop(self._can_run)
+                if job is None:
+                    break
+                self.active += 1
+                self.running_per_user[job.user_id] = self.running_per_user.get(job.user_id, 0) + 1
+                task = self.loop.create_task(self._run(job))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, job: PoolJob):
+        try:
+            await job.func(*job.args)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}")
+        finally:
+            with self.lock:
+                self.active -= 1
+                remaining = self.running_per_user[job.user_id] - 1
+                if remaining:
+                    self.running_per_user[job.user_id] = remaining
+                else:
+                    del self.running_per_user[job.user_id]
+            self._dispatch()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """新規受付を止め、未開始のジョブを取り消し、実行中のジョブの完了を待つ
+
+        timeout を過ぎても終わらないジョブはキャンセルする。
+        取り消されたジョブは完了扱いにならないため、再起動後に再び処理される。
+        """
+        with self.lock:
+            self.accepting = False
+            dropped = self.scheduler.clear()
+        if dropped:
+            logger.info(f"Dropped {len(dropped)} queued jobs")
+
+        running = [t for t in self.tasks if not t.done()]
+        if running:
+            logger.info(f"Draining {len(running)} in-flight jobs...")
+            _, pending = await asyncio.wait(running, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Cancelled {len(pending)} jobs after drain timeout")
+                await asyncio.wait(pending)
+        logger.info("Async job pool drained")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+危険コマンド判定のマイクロベンチマーク
+以前の部分文字列による判定と、ルールをまとめた判定器（キャッシュなし/あり）を比較する。
+
+使い方:
+    python scripts/bench_classifier.py [コマンド一覧ファイル (例: ~/.bash_history)]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.command_rules import CommandClassifier
+
+# 実際に /execute で使われる典型的なコマンド
+CORPUS = [
+    "ls -la",
+    "git status",
+    "git log --oneline -20",
+    "git pull && git log -1",
+    "df -h",
+    "free -m",
+    "uptime",
+    "ps aux | grep python | head -20",
+    "tail -n 100 logs/command_executor.log",
+    "du -sh * 2>/dev/null | sort -h | tail",
+    "cat /etc/os-release",
+    "nvidia-smi",
+    "tmux ls",
+    "docker ps --format '{{.Names}}: {{.Status}}'",
+    "find . -name '*.pyc' -delete",
+    "python3 -m pytest -q tests/",
+    "pip list --outdated",
+    "systemctl status nginx",
+    "journalctl -u nginx --since '1 hour ago' | tail -50",
+    "curl -s https://example.com/health",
+    "cd ~/projects/app && npm run build",
+    "echo $(date) >> ~/log.txt",
+    "rm -rf build dist",
+    "sudo systemctl restart nginx",
+    "rm -rf /",
+    "dd if=/dev/zero of=/dev/sda bs=1M",
+    "bash -c 'rm -rf ~'",
+    ":(){ :|:& };:",
+]
+
+LEGACY_PATTERNS = [
+    'rm -rf /',
+    'rm -rf ~',
+    'dd if=/dev/zero',
+    'mkfs',
+    ':(){ :|:& };:',
+    'sudo rm',
+    'chmod -R 000',
+    '> /dev/sda',
+]
+
+
+def legacy_is_dangerous(command: str) -> bool:
+    """以前の CommandExecutor.is_dangerous_command と同じ判定"""
+    command_lower = command.lower().strip()
+    for pattern in LEGACY_PATTERNS:
+        if pattern.lower() in command_lower:
+            return True
+    if 'sudo' in command_lower:
+        return True
+    if '>' in command and ('/dev/' in command or '/sys/' in command):
+        return True
+    return False
+
+
+def bench(label: str, func, commands, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for command in commands:
+            func(command)
+    elapsed = time.perf_counter() - start
+    per_call = elapsed / (rounds * len(commands)) * 1e6
+    print(f"{label:<24} {per_call:8.2f} us/command")
+
+
+def main():
+    commands = list(CORPUS)
+    if len(sys.argv) > 1:
+        with open(Path(sys.argv[1]).expanduser(), 'r', encoding='utf-8', errors='replace') as f:
+            commands = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    rounds = max(1, 20000 // len(commands))
+    print(f"{len(commands)} commands x {rounds} rounds")
+
+    uncached = CommandClassifier.from_file(cache_size=0)
+    cached = CommandClassifier.from_file()
+
+    bench("legacy substring", legacy_is_dangerous, commands, rounds)
+    bench("classifier (no cache)", uncached.is_dangerous, commands, rounds)
+    bench("classifier (cached)", cached.is_dangerous, commands, rounds)
+
+    changed = [c for c in commands if legacy_is_dangerous(c) != cached.is_dangerous(c)]
+    print(f"\n{len(changed)} commands classified differently from the legacy check:")
+    for command in changed[:20]:
+        print(f"  legacy={legacy_is_dangerous(command)!s:<5} new={cached.classify(command)}  {command}")
+
+
+if __name__ == "__main__":
+    main()
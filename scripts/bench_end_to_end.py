@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Bot と実行エンジンを通したエンドツーエンドの負荷試験
+Discordの代わりにプロセス内の偽クライアントを使い、ネットワーク無しで
+/execute と承認リアクションを大量に発生させる。実行エンジンは本物を別プロセスで起動する。
+
+計測する値:
+    - 処理したコマンド数/秒
+    - /execute から結果がDiscordに送られるまでの p50 / p99
+    - コマンド1件あたりのCPU時間（Bot・実行エンジン別）
+
+使い方:
+    python scripts/bench_end_to_end.py [--commands 2000] [--approval-ratio 0.05] [--json]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import signal
+import asyncio
+import argparse
+import resource
+import tempfile
+import itertools
+import subprocess
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class FakeMessage:
+    """送信済みメッセージ（編集・リアクションは記録するだけ）"""
+
+    ids = itertools.count(1)
+
+    def __init__(self, channel, kwargs):
+        self.id = next(self.ids)
+        self.channel = channel
+        self.kwargs = kwargs
+
+    async def edit(self, **kwargs):
+        await self.channel.latency()
+        self.kwargs.update(kwargs)
+        return self
+
+    async def add_reaction(self, emoji):
+        await self.channel.latency()
+
+
+class FakeChannel:
+    """テキストチャンネル（送信のたびに latency 秒待つ）"""
+
+    def __init__(self, delay: float):
+        self.id = 0
+        self.delay = delay
+        self.sent = 0
+
+    async def latency(self):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def send(self, **kwargs):
+        await self.latency()
+        self.sent += 1
+        return FakeMessage(self, kwargs)
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.bot = False
+
+
+class FakeResponse:
+    async def defer(self):
+        pass
+
+
+class FakeFollowup:
+    async def send(self, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    """スラッシュコマンドの呼び出し"""
+
+    def __init__(self, user: FakeUser, channel_id: int):
+        self.user = user
+        self.channel_id = channel_id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+class FakeReaction:
+    def __init__(self, message: FakeMessage, emoji: str):
+        self.message = message
+        self.emoji = emoji
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def child_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def self_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def run_benchmark(args, workdir: Path) -> dict:
+    import bot.discord_bridge as bridge
+    import bot.outbound as outbound
+    # 1件ごとのINFOログは計測の邪魔になるので抑える
+    logging.getLogger().setLevel(logging.WARNING)
+
+    channel = FakeChannel(args.discord_latency)
+    bridge.bot.get_channel = lambda channel_id: channel
+    if not args.discord_rate_limits:
+        # Discord側の制限を外し、ブリッジ自身の処理速度を測る
+        for route in outbound.ROUTE_LIMITS:
+            outbound.ROUTE_LIMITS[route] = (1_000_000, 1.0)
+
+    # 送信時刻と結果の送信時刻を job_id（コマンド名）で対応付ける
+    sent_at = {}
+    latencies = []
+    statuses = {}
+    approved_done = set()
+    build_command = bridge.build_command
+    handle_response = bridge.handle_response
+
+    def timed_build_command(command, user_info):
+        record = build_command(command, user_info)
+        sent_at[Path(record[0]).stem] = time.monotonic()
+        return record
+
+    async def timed_handle_response(channel, data):
+        await handle_response(channel, data)
+        started = sent_at.pop(data.get('job_id'), None)
+        if started is not None:
+            latencies.append(time.monotonic() - started)
+            statuses[data.get('status')] = statuses.get(data.get('status'), 0) + 1
+            return
+        match = re.search(r"approve-(\d+)", data.get('message', ''))
+        if match:
+            approved_done.add(match.group(1))
+
+    bridge.build_command = timed_build_command
+    bridge.handle_response = timed_handle_response
+    bridge.bot.outbound.start()
+
+    # 実行エンジンを起動（承認対象は "echo approve-" で始まるコマンドだけにする）
+    rules_file = workdir / "rules.json"
+    rules_file.write_text(json.dumps({"command_rules": [{"name": "loadtest", "pattern": "^echo approve-"}]}))
+    env = dict(
+        os.environ,
+        COMM_DIR=str(bridge.COMM_DIR),
+        DANGEROUS_RULES_FILE=str(rules_file),
+        EXECUTOR_MAX_QUEUE=str(args.commands),
+        EXECUTOR_MAX_WORKERS=str(args.workers),
+        EXECUTOR_PER_USER_LIMIT=str(args.workers),
+        EXECUTOR_RUNTIME=args.runtime,
+    )
+    executor = subprocess.Popen(
+        [sys.executable, str(PROJECT_ROOT / "bridge" / "command_executor.py")],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    await asyncio.sleep(args.warmup)
+
+    approvals = set()
+    reacted = set()
+    stop = asyncio.Event()
+
+    async def poll():
+        """Botの監視ループと同じ処理を poll_interval ごとに回し、承認要求には✅を付ける"""
+        while not stop.is_set():
+            await bridge.check_pending()
+            await bridge.check_responses()
+            for name, info in list(bridge.bot.pending_confirmations.entries.items()):
+                if name not in reacted:
+                    reacted.add(name)
+                    await bridge.on_reaction_add(FakeReaction(info['message'], "✅"), FakeUser(1))
+            await asyncio.sleep(args.poll_interval)
+
+    users = [FakeUser(1000 + i) for i in range(args.users)]
+    cpu_bot_start = self_cpu()
+    started = time.monotonic()
+    poller = asyncio.create_task(poll())
+
+    # /execute を一定の並行数で発行する
+    for i in range(args.commands):
+        if args.approval_ratio and i % round(1 / args.approval_ratio) == 0:
+            command = f"echo approve-{i}"
+            approvals.add(str(i))
+        else:
+            command = f"echo load-{i}"
+        await bridge.execute.callback(FakeInteraction(users[i % len(users)], channel.id), command)
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    submitted = time.monotonic()
+
+    # 通常のコマンドが揃ったら、承認されたコマンドの結果は approval_wait 秒だけ待つ
+    expected = args.commands - len(approvals)
+    deadline = submitted + args.timeout
+    while len(latencies) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    finished = time.monotonic()
+    deadline = min(deadline, finished + args.approval_wait)
+    while len(approved_done) < len(approvals) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    stop.set()
+    await poller
+    cpu_bot = self_cpu() - cpu_bot_start
+
+    executor.send_signal(signal.SIGTERM)
+    executor.wait(timeout=60)
+    cpu_executor = child_cpu()
+    bridge.bot.outbound.stop()
+
+    completed = len(latencies) + len(approved_done)
+    elapsed = finished - started
+    return {
+        'commands': args.commands,
+        'completed': completed,
+        'lost': args.commands - completed,
+        'approvals_requested': len(approvals),
+        'approvals_completed': len(approved_done),
+        'statuses': statuses,
+        'elapsed_s': round(elapsed, 3),
+        'submit_s': round(submitted - started, 3),
+        'commands_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'cpu_ms_per_command_bot': round(cpu_bot / max(completed, 1) * 1000, 3),
+        'cpu_ms_per_command_executor': round(cpu_executor / max(completed, 1) * 1000, 3),
+        'discord_messages': channel.sent,
+        'rate_limited': bridge.bot.outbound.stats['rate_limited'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="偽のDiscordを使ったエンドツーエンド負荷試験")
+    parser.add_argument('--commands', type=int, default=2000, help="発行する /execute の数")
+    parser.add_argument('--approval-ratio', type=float, default=0.05, help="承認が必要なコマンドの割合")
+    parser.add_argument('--users', type=int, default=8, help="コマンドを発行するユーザー数")
+    parser.add_argument('--rate', type=float, default=0, help="1秒あたりの発行数（0なら一度に発行）")
+    parser.add_argument('--workers', type=int, default=8, help="実行エンジンの同時実行数")
+    parser.add_argument('--runtime', choices=['thread', 'asyncio'], default='thread', help="実行エンジンの実行方式")
+    parser.add_argument('--transport', choices=['file', 'sqlite'], default='file', help="通信バックエンド")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="Botの監視間隔（秒）")
+    parser.add_argument('--discord-latency', type=float, default=0.0, help="偽Discordの1操作あたりの遅延（秒）")
+    parser.add_argument('--discord-rate-limits', action='store_true', help="送信キューのレート制限を有効にする")
+    parser.add_argument('--warmup', type=float, default=2.0, help="実行エンジンの起動を待つ秒数")
+    parser.add_argument('--timeout', type=float, default=120, help="通常のコマンドの完了を待つ最大秒数")
+    parser.add_argument('--approval-wait', type=float, default=10, help="承認されたコマンドの結果を追加で待つ秒数")
+    parser.add_argument('--json', action='store_true', help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bridge-bench-") as tmp:
+        workdir = Path(tmp)
+        (workdir / "logs").mkdir()
+        os.environ.update({
+            'COMM_DIR': str(workdir / "comm"),
+            'BRIDGE_TRANSPORT': args.transport,
+            'BRIDGE_SOCKET': 'false',
+            'STREAM_OUTPUT': 'false',
+            'SESSION_MODE': 'false',
+        })
+        # Bot・実行エンジンのログ（logs/）は作業ディレクトリに書き出す
+        os.chdir(workdir)
+        result = asyncio.run(run_benchmark(args, workdir))
+        logging.shutdown()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    print(f"commands:        {result['completed']}/{result['commands']} completed "
+          f"({result['approvals_completed']}/{result['approvals_requested']} approvals, {result['lost']} lost)")
+    print(f"throughput:      {result['commands_per_s']} commands/s over {result['elapsed_s']}s")
+    print(f"end-to-end:      p50 {result['latency_p50_ms']} ms / p99 {result['latency_p99_ms']} ms")
+    print(f"cpu per command: bot {result['cpu_ms_per_command_bot']} ms / "
+          f"executor {result['cpu_ms_per_command_executor']} ms")
+    print(f"discord:         {result['discord_messages']} messages, {result['rate_limited']} rate limited")
+    print(f"statuses:        {result['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+スプール書き込みのマイクロベンチマーク
+以前の書き込み（インデント付きJSON・flock・同名の一時ファイル）と、
+SpoolWriter の各設定（O_TMPFILE / rename、fsync なし / まとめて / 毎回）の files/sec を比較する。
+
+使い方:
+    python scripts/bench_spool_writer.py [書き込むディレクトリ（既定は一時ディレクトリ）] [件数]
+"""
+
+import sys
+import json
+import time
+import fcntl
+import shutil
+import tempfile
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.records import build_response
+from bridge.spool_writer import SpoolWriter, msgpack
+
+
+def legacy_write_json_safe(filepath: Path, data) -> bool:
+    """以前の FileCommunicator.write_json_safe と同じ書き込み"""
+    temp_file = filepath.with_suffix('.tmp')
+    with open(temp_file, 'w') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    temp_file.replace(filepath)
+    return True
+
+
+def sample_record(i: int):
+    """典型的な実行結果のレスポンス"""
+    output = "\n".join(f"line {n}: total 48 drwxr-xr-x 5 user user 4096" for n in range(20))
+    return build_response(
+        message=f"**コマンド実行完了**\n`ls -la`\n\n**出力:**\n```\n{output}\n```",
+        status='success',
+        command='ls -la',
+        job_id=f"cmd_{i}",
+        return_code=0,
+        idempotency_key=f"cmd_{i}",
+    )
+
+
+def bench(label: str, write, directory: Path, count: int, flush=None, rounds: int = 3):
+    """rounds 回書き込んで最も速かった回の files/sec を表示（ディスクの揺らぎを抑える）"""
+    records = [sample_record(i) for i in range(count)]
+    best = 0.0
+    size = 0.0
+    for _ in range(rounds):
+        directory.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        for name, data in records:
+            write(directory / name, data)
+        if flush:
+            flush()
+        elapsed = time.perf_counter() - start
+        best = max(best, count / elapsed)
+        size = sum(p.stat().st_size for p in directory.glob("*.json")) / max(count, 1)
+        shutil.rmtree(directory)
+    print(f"{label:<32} {best:10.0f} files/s  {size:7.0f} bytes/file")
+
+
+def main():
+    temporary = len(sys.argv) <= 1 or not sys.argv[1]
+    base = Path(tempfile.mkdtemp(prefix="spool-bench-")) if temporary else Path(sys.argv[1])
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    print(f"{count} records in {base}")
+
+    bench("legacy (indent, flock)", legacy_write_json_safe, base / "legacy", count)
+
+    writer = SpoolWriter()
+    bench(f"json, {'O_TMPFILE' if writer.use_tmpfile else 'rename'}", writer.write, base / "tmpfile", count)
+
+    rename = SpoolWriter()
+    rename.use_tmpfile = False
+    bench("json, rename", rename.write, base / "rename", count)
+
+    if msgpack is not None:
+        packed = SpoolWriter(fmt="msgpack")
+        bench("msgpack", packed.write, base / "msgpack", count)
+
+    batch = SpoolWriter(fsync="batch", fsync_interval=0.05)
+    bench("json, fsync batch (50ms)", batch.write, base / "batch", count, flush=batch.flush)
+
+    always = SpoolWriter(fsync="always")
+    bench("json, fsync always", always.write, base / "always", max(1, count // 10))
+
+    if temporary:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
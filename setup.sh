@@ -61,6 +61,11 @@ if [ ! -d "$COMM_DIR" ]; then
     mkdir -p "$COMM_DIR/commands"
     mkdir -p "$COMM_DIR/responses"
     mkdir -p "$COMM_DIR/pending"
+    mkdir -p "$COMM_DIR/approvals"
+    mkdir -p "$COMM_DIR/outputs"
+    mkdir -p "$COMM_DIR/claimed"
+    mkdir -p "$COMM_DIR/journal"
+    mkdir -p "$COMM_DIR/state"
     chmod 700 "$COMM_DIR"
     echo "通信用ディレクトリを作成しました: $COMM_DIR"
 fi
@@ -77,6 +82,88 @@ DISCORD_CHANNEL_ID=your_channel_id_here
 LOG_LEVEL=INFO
 COMMAND_TIMEOUT=300
 CHECK_INTERVAL=1
+# 通信バックエンド (file / sqlite)
+BRIDGE_TRANSPORT=file
+# Botと実行エンジンをUnixソケットで直接接続する（未接続時はスプール経由）
+BRIDGE_SOCKET=false
+# ソケットで送ったレコードの受領を待つ秒数（返ってこなければスプール経由で送る）
+SOCKET_ACK_TIMEOUT=5
+# 危険コマンドの判定ルール（空なら bridge/dangerous_commands.json）
+DANGEROUS_RULES_FILE=
+# ファイル監視方式 (auto / inotify / polling)
+WATCHER_BACKEND=auto
+# 実行ワーカー数 / ユーザーごとの同時実行数 / 実行待ちキューの上限
+EXECUTOR_MAX_WORKERS=4
+EXECUTOR_PER_USER_LIMIT=2
+EXECUTOR_MAX_QUEUE=100
+# ユーザーごとの実行割合の重み（ユーザーID:重み のカンマ区切り、既定は1）
+SCHEDULER_USER_WEIGHTS=
+# この秒数待つごとに実行待ちジョブの優先度を1段上げる（/execute の priority オプションの低優先度も必ず実行される）
+SCHEDULER_AGING_SECONDS=60
+# ユーザーごとの常駐シェルで実行する（/execute の session オプションで個別指定も可能）
+SESSION_MODE=false
+# 常駐シェルを終了するまでの未使用秒数 / 同時に保持する常駐シェルの上限
+SESSION_IDLE_TIMEOUT=1800
+SESSION_MAX=8
+# 実行エンジンの識別子（複数台で動かす場合。空なら ホスト名-PID）
+EXECUTOR_ID=
+# 取得したコマンドのリース秒数（延長されなければ他の実行エンジンが再取得する）
+LEASE_SECONDS=60
+# ジョブ状態のジャーナルを追記ごとにディスクへ書き出す
+JOURNAL_FSYNC=true
+# スプールファイルの形式 (json / msgpack)
+SPOOL_FORMAT=json
+# スプールファイルをディスクへ書き出すタイミング (none / always / batch) と batch の間隔（秒）
+SPOOL_FSYNC=none
+SPOOL_FSYNC_INTERVAL=0.05
+# 統計と死活情報（/status 用）を書き出す間隔（秒）
+STATS_INTERVAL=5
+# Prometheus形式のメトリクスを公開するポート（0なら公開しない）と待ち受けアドレス
+EXECUTOR_METRICS_PORT=9464
+BOT_METRICS_PORT=9465
+METRICS_HOST=127.0.0.1
+# ジョブごとのリソース上限（0なら制限しない）: CPU秒 / メモリMB / 書き込めるファイルの大きさMB / プロセス数
+# メモリ・プロセス数は空なら cgroup（JOB_CGROUP_PARENT）がある場合だけ 4096MB / 512 で制限する
+JOB_CPU_SECONDS=600
+JOB_MEMORY_MB=
+JOB_FILE_SIZE_MB=1024
+JOB_MAX_PROCESSES=
+# ユーザーごとの上限の上書き（JSON: {"users": {"<ユーザーID>": {"memory_mb": 8192}}}）
+JOB_LIMITS_FILE=
+# ジョブごとの cgroup を作る cgroup v2 のディレクトリ（実行エンジン自身は入っていない、書き込み可能な委譲先。空なら setrlimit のみ）
+JOB_CGROUP_PARENT=
+# 読み取り専用のコマンドの結果を再利用する（同じコマンドの同時実行は1回にまとめる）
+RESULT_CACHE=false
+# 結果を再利用する秒数 / 保持する結果の数 / 対象のコマンド（カンマ区切り、空なら git status・df などの既定）
+RESULT_CACHE_TTL=10
+RESULT_CACHE_SIZE=128
+RESULT_CACHE_COMMANDS=
+# 実行方式（thread または asyncio）
+EXECUTOR_RUNTIME=thread
+# 停止時に実行中のジョブを待つ最大秒数
+EXECUTOR_DRAIN_TIMEOUT=300
+# 実行中の出力を逐次表示する（/execute の stream オプションで個別指定も可能）
+STREAM_OUTPUT=false
+STREAM_INTERVAL=1
+STREAM_EDIT_INTERVAL=1
+# 出力保存領域（上限MB / gzip圧縮する閾値バイト / 1出力あたりの上限MB / 添付上限MB）
+OUTPUT_STORE_MAX_MB=500
+OUTPUT_GZIP_THRESHOLD=65536
+OUTPUT_MAX_FILE_MB=100
+# 保存する出力の件数の上限（0なら上限なし）
+OUTPUT_STORE_MAX_FILES=0
+# スプールの掃除（この時間より古いファイル・件数/容量の上限を超えた分を古い順に削除。
+# 件数/容量の上限で削除するのはレスポンスだけで、未処理のコマンド・承認待ちは期限切れのときだけ削除する）
+SPOOL_MAX_AGE_HOURS=24
+SPOOL_MAX_FILES=50000
+SPOOL_MAX_MB=512
+# 掃除の間隔（秒）と1回に削除する最大件数
+JANITOR_INTERVAL=1
+JANITOR_BATCH=100
+ATTACHMENT_MAX_MB=10
+# 承認要求を自動で拒否するまでの秒数 / 同時に追跡する承認待ちの上限
+PENDING_EXPIRE=3600
+PENDING_MAX=200
 
 # ファイルパス
 COMM_DIR=/tmp/claude-discord
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+承認待ちのコマンドの保持のテスト
+"""
+
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.approvals import HeldCommands
+from bridge.records import build_approval, job_id_of
+
+
+def test_take_returns_held_command_once():
+    held = HeldCommands()
+    held.hold("pending_1", {"command": "sudo ls", "user_id": "42"})
+
+    assert held.take("pending_1") == {"command": "sudo ls", "user_id": "42"}
+    assert held.take("pending_1") is None
+    assert len(held) == 0
+
+
+def test_oldest_entries_are_dropped_over_limit():
+    """上限を超えたら古いものから手放す（手放したものはスプールから読まれる）"""
+    held = HeldCommands(max_entries=2)
+    for i in range(3):
+        held.hold(f"pending_{i}", {"command": f"cmd {i}"})
+
+    assert held.take("pending_0") is None
+    assert held.take("pending_2") == {"command": "cmd 2"}
+
+
+def test_approval_is_keyed_by_job_id():
+    name, data = build_approval("pending_20260101_000000_000000_1_0001.json", True)
+    assert name == "approval_pending_20260101_000000_000000_1_0001.json"
+    assert data["job_id"] == job_id_of("pending_20260101_000000_000000_1_0001.json")
+    assert data["job_id"] == "pending_20260101_000000_000000_1_0001"
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+スプールへの非同期アクセスとイベントループ遅延の計測のテスト
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.file_comm import FileCommunicator
+from bridge.journal import JobJournal, STATE_DELIVERED
+from bot.async_spool import AsyncSpool
+from bot.loop_monitor import LoopLagMonitor
+
+
+def test_spool_operations_run_off_the_event_loop(tmp_path):
+    comm = FileCommunicator(str(tmp_path))
+    journal = JobJournal(tmp_path / "journal.log", fsync=False)
+    spool = AsyncSpool(comm, journal)
+    threads = set()
+    original = comm.list_responses
+
+    def list_responses(limit=100):
+        threads.add(threading.current_thread().name)
+        return original(limit)
+
+    comm.list_responses = list_responses
+
+    async def scenario():
+        first = comm.create_response("a", job_id="cmd_1")
+        comm.create_response("b", job_id="cmd_2")
+        known = comm.create_pending("sudo ls", "approve?")
+        new = comm.create_pending("sudo rm x", "approve?")
+
+        responses = await spool.list_responses(limit=1)
+        names, entries = await spool.pending_snapshot({known})
+        await spool.ack([first], [("cmd_1", STATE_DELIVERED)])
+        return first, responses, names, entries, new, known
+
+    first, responses, names, entries, new, known = asyncio.run(scenario())
+    spool.close()
+
+    assert threads and threading.main_thread().name not in threads
+    assert [name for name, _ in responses] == [first]
+    assert sorted(names) == sorted([known, new])
+    assert [name for name, _ in entries] == [new]
+    assert not (comm.response_dir / first).exists()
+    assert journal.get("cmd_1") == STATE_DELIVERED
+
+
+def test_loop_lag_monitor_detects_blocking():
+    monitor = LoopLagMonitor(interval=0.01)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        # イベントループを止めるブロッキング処理
+        time.sleep(0.2)
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    asyncio.run(scenario())
+    assert monitor.recent_max() >= 0.15
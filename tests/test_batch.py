@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+バッチ実行のテスト
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from bridge.batch import (
+    BatchError, BatchPlan, parse_batch, run_plan, run_plan_async,
+    STEP_SUCCESS, STEP_FAILED, STEP_SKIPPED, STEP_CANCELLED,
+)
+
+
+def _ok(returncode=0):
+    return {'success': True, 'returncode': returncode, 'outputs': {}}
+
+
+def test_parse_lines_and_json():
+    steps = parse_batch("""
+        # コメント
+        build: make
+        test [build]: make test
+        echo a:b
+    """)
+    assert steps == [
+        {'name': 'build', 'command': 'make', 'needs': []},
+        {'name': 'test', 'command': 'make test', 'needs': ['build']},
+        {'name': 'step3', 'command': 'echo a:b', 'needs': []},
+    ]
+    assert parse_batch('[{"name": "a", "command": "true"}, {"command": "false", "needs": "a"}]') == [
+        {'name': 'a', 'command': 'true', 'needs': []},
+        {'name': 'step2', 'command': 'false', 'needs': ['a']},
+    ]
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "a: true\na: false",
+    "a [missing]: true",
+    "a [b]: true\nb [a]: true",
+    "[1, 2]",
+])
+def test_invalid_batches_are_rejected(text):
+    with pytest.raises(BatchError):
+        parse_batch(text)
+
+
+def test_failure_skips_only_dependents():
+    """失敗したステップに（間接的にでも）依存するステップだけをスキップする"""
+    plan = BatchPlan(parse_batch("a: false\nb [a]: true\nc [b]: true\nd: true"))
+    results = run_plan(plan, lambda step: _ok(1 if step['name'] == 'a' else 0))
+
+    assert plan.states == {'a': STEP_FAILED, 'b': STEP_SKIPPED, 'c': STEP_SKIPPED, 'd': STEP_SUCCESS}
+    assert set(results) == {'a', 'd'}
+
+
+def test_independent_steps_run_in_parallel_after_dependencies():
+    started = {}
+
+    def run_step(step):
+        started[step['name']] = time.monotonic()
+        time.sleep(0.3)
+        return _ok()
+
+    plan = BatchPlan(parse_batch("a: x\nb: x\nc [a, b]: x"))
+    start = time.monotonic()
+    results = run_plan(plan, run_step, max_parallel=4)
+
+    assert abs(started['a'] - started['b']) < 0.2
+    assert started['c'] - start >= 0.3
+    assert time.monotonic() - start < 0.85
+    assert all(result['duration'] >= 0.3 for result in results.values())
+
+
+def test_cancel_stops_pending_steps():
+    cancelled = threading.Event()
+
+    def run_step(step):
+        cancelled.set()
+        return {'success': False, 'cancelled': True, 'error': 'Cancelled by alice'}
+
+    plan = BatchPlan(parse_batch("a: x\nb [a]: x\nc: x"))
+    run_plan(plan, run_step, max_parallel=1, is_cancelled=cancelled.is_set)
+
+    assert plan.states == {'a': STEP_CANCELLED, 'b': STEP_SKIPPED, 'c': STEP_CANCELLED}
+
+
+def test_run_plan_async_limits_parallelism():
+    running = 0
+    peak = 0
+
+    async def run_step(step):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return _ok()
+
+    plan = BatchPlan(parse_batch("\n".join(f"s{i}: x" for i in range(6)) + "\nlast [s0, s5]: x"))
+    results = asyncio.run(run_plan_async(plan, run_step, max_parallel=2))
+
+    assert peak == 2
+    assert len(results) == 7
+    assert plan.counts() == {STEP_SUCCESS: 7}
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+危険コマンド判定のテスト
+"""
+
+import sys
+import json
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.command_rules import CommandClassifier
+
+
+def test_default_rules_detect_nested_and_wrapped_commands():
+    """パイプ・サブシェル・sh -c・ラッパー越しの危険なコマンドも検出する"""
+    classifier = CommandClassifier.from_file()
+
+    assert classifier.classify("rm -rf /") == "rm_recursive_root"
+    assert classifier.classify("ls | xargs rm -fr ~/") == "rm_recursive_root"
+    assert classifier.classify("echo \"$(rm -r -f /)\"") == "rm_recursive_root"
+    assert classifier.classify("bash -c 'sudo reboot'") == "privilege"
+    assert classifier.classify("env FOO=1 nohup /bin/rm -rf $HOME") == "rm_recursive_root"
+    assert classifier.classify("echo x > /dev/sda") == "redirect_device"
+    assert classifier.classify(":(){ :|:& };:") == "fork_bomb"
+
+
+def test_default_rules_detect_eval_shell_flags_pipes_and_literals():
+    """eval・-c と組み合わせたフラグ・シェルへのパイプ・コード中の文字列も検出する（旧判定で検出できていたもの）"""
+    classifier = CommandClassifier.from_file()
+
+    assert classifier.classify('eval "rm -rf /"') == "rm_recursive_root"
+    assert classifier.classify("echo 'rm -rf /' | sh") == "pipe_to_shell"
+    assert classifier.classify("bash -lc 'rm -rf /'") == "rm_recursive_root"
+    assert classifier.classify("sh -ec 'rm -rf /'") == "rm_recursive_root"
+    assert classifier.classify("python3 -c 'os.system(\"rm -rf /\")'") == "rm_recursive_root"
+    # 標準入力をスクリプトとして読まないシェル・インタプリタは対象外
+    assert not classifier.is_dangerous("ls | bash -c 'wc -l'")
+    assert not classifier.is_dangerous("cat data.json | python3 -m json.tool")
+
+
+def test_default_rules_allow_common_commands():
+    """よく使う安全なコマンドは承認不要"""
+    classifier = CommandClassifier.from_file()
+
+    for command in ["ls -la", "du -sh * 2>/dev/null", "echo 'rm -rf /'", "rm -rf build", "echo pseudo"]:
+        assert not classifier.is_dangerous(command), command
+
+
+def test_rules_file_and_cache(tmp_path):
+    """設定ファイルのルールを使い、同じコマンドの判定はキャッシュされる"""
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps({
+        "command_rules": [{"name": "reboot", "pattern": "^(reboot|shutdown)( |$)"}]
+    }))
+    classifier = CommandClassifier.from_file(rules_file)
+
+    assert classifier.classify("uptime; reboot") == "reboot"
+    assert classifier.classify("uptime; reboot") == "reboot"
+    assert classifier.classify("rm -rf /") is None
+    assert classifier.cache_info().hits == 1
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+実行エンジン統計のテスト
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.executor_stats import ExecutorStats, percentile, read_executor_states
+
+
+def test_latency_percentiles_and_throughput_windows(tmp_path):
+    """キュー待ち時間のパーセンタイルと期間ごとのスループットを集計する"""
+    stats = ExecutorStats("w1", tmp_path)
+    for i in range(10):
+        stats.job_queued(f"job{i}", now=0)
+        stats.job_started(f"job{i}", now=i + 1)
+    stats.job_queued("rejected", now=0)
+    stats.job_rejected("rejected")
+
+    # 完了: 14分前に3件、4分前に6件、30秒前に3件（20分前の1件は集計対象外）
+    for at in [0] + [360] * 3 + [960] * 6 + [1170] * 3:
+        stats.job_finished("job", now=at)
+
+    snapshot = stats.snapshot(queued=2, active=1, now=1200)
+    assert snapshot['latency']['p50'] == 5
+    assert snapshot['latency']['p99'] == 10
+    assert snapshot['latency']['samples'] == 10
+    assert snapshot['throughput_per_min'] == {'1m': 3.0, '5m': 9 / 5, '15m': 12 / 15}
+    assert snapshot['completed_total'] == 13
+    assert stats.enqueued == {}
+    assert percentile([], 50) is None
+
+
+def test_state_file_round_trip_and_stale_cleanup(tmp_path):
+    """状態ファイルを書き出して読め、更新が途絶えたファイルは削除される"""
+    ExecutorStats("live", tmp_path).write(queued=3, active=1)
+    stale = ExecutorStats("dead", tmp_path)
+    stale.write(queued=0, active=0)
+    old = time.time() - 7200
+    os.utime(stale.path, (old, old))
+
+    states = read_executor_states(tmp_path)
+    assert [(s['worker_id'], s['queued'], s['active']) for s in states] == [("live", 3, 1)]
+    assert not stale.path.exists()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+ファイル通信ライブラリのテスト
+"""
+
+import os
+import sys
+import time
+import threading
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from bridge.file_comm import (
+    FileCommunicator,
+    FileWatcher,
+    InotifyFileWatcher,
+    create_file_watcher,
+    inotify_available,
+)
+
+
+def _wait_for(predicate, timeout=3.0):
+    """条件が満たされるまで待機"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def _collecting_watcher(watcher_cls, watch_dir):
+    seen = []
+    lock = threading.Lock()
+
+    def callback(filepath):
+        with lock:
+            seen.append(filepath.name)
+
+    return watcher_cls(watch_dir, callback), seen
+
+
+@pytest.mark.parametrize("watcher_cls", [FileWatcher, InotifyFileWatcher])
+def test_watcher_picks_up_existing_and_new_files(tmp_path, watcher_cls):
+    """起動前のファイルと起動後のファイルの両方を1回ずつ処理する"""
+    if watcher_cls is InotifyFileWatcher and not inotify_available():
+        pytest.skip("inotify not available")
+
+    comm = FileCommunicator(str(tmp_path))
+    before = comm.create_command("echo before", {"user_name": "tester"})
+
+    watcher, seen = _collecting_watcher(watcher_cls, comm.command_dir)
+    watcher.start()
+    try:
+        assert _wait_for(lambda: before in seen)
+        after = comm.create_command("echo after", {"user_name": "tester"})
+        assert _wait_for(lambda: after in seen)
+    finally:
+        watcher.stop()
+
+    assert sorted(seen) == sorted([before, after])
+
+
+def test_inotify_watcher_ignores_temp_files(tmp_path):
+    """書き込み途中の一時ファイルは通知しない"""
+    if not inotify_available():
+        pytest.skip("inotify not available")
+
+    watcher, seen = _collecting_watcher(InotifyFileWatcher, tmp_path)
+    watcher.start()
+    try:
+        (tmp_path / "cmd_x.tmp").write_text("{}")
+        (tmp_path / "cmd_x.tmp").rename(tmp_path / "cmd_x.json")
+        assert _wait_for(lambda: "cmd_x.json" in seen)
+    finally:
+        watcher.stop()
+
+    assert seen == ["cmd_x.json"]
+
+
+@pytest.mark.parametrize("watcher_cls", [FileWatcher, InotifyFileWatcher])
+def test_watcher_waits_for_files_written_in_place(tmp_path, watcher_cls):
+    """その場で書かれるファイルは書き終わるまで通知せず、読めない取得済みファイルは元に戻す"""
+    if watcher_cls is InotifyFileWatcher and not inotify_available():
+        pytest.skip("inotify not available")
+
+    comm = FileCommunicator(str(tmp_path))
+    watcher, seen = _collecting_watcher(watcher_cls, comm.command_dir)
+    watcher.start()
+    try:
+        target = comm.command_dir / "cmd_partial.json"
+        with open(target, "w") as f:
+            f.write('{"command": "echo')
+            f.flush()
+            time.sleep(0.7)
+            assert seen == []
+            # 書き込み途中で取得しても削除されずに戻される
+            assert comm.claim_command(target.name) is None
+            assert target.exists()
+            f.write(' hi"}')
+        assert _wait_for(lambda: target.name in seen)
+    finally:
+        watcher.stop()
+
+    assert comm.claim_command(target.name)["command"] == "echo hi"
+
+
+def test_create_file_watcher_backend_selection(tmp_path):
+    """バックエンド指定に応じた監視クラスを返す"""
+    assert type(create_file_watcher(tmp_path, print, backend="polling")) is FileWatcher
+    expected = InotifyFileWatcher if inotify_available() else FileWatcher
+    assert type(create_file_watcher(tmp_path, print, backend="auto")) is expected
+
+
+def test_claim_is_exclusive_and_expired_leases_are_reclaimed(tmp_path):
+    """同じコマンドを取得できるのは1つの実行エンジンだけで、停止した実行エンジンの分は再取得される"""
+    first = FileCommunicator(str(tmp_path), worker_id="host-a")
+    second = FileCommunicator(str(tmp_path), worker_id="host-b")
+    name = first.create_command("echo hi", {"user_id": "1"})
+
+    assert first.claim_command(name)["command"] == "echo hi"
+    assert second.claim_command(name) is None
+    assert first.counts()["commands"] == 1
+
+    # host-a が停止してリースが延長されなかった
+    assert second.reclaim_expired(lease_seconds=60) == 0
+    claimed = tmp_path / "claimed" / "host-a" / name
+    old = time.time() - 120
+    os.utime(claimed, (old, old))
+    assert second.reclaim_expired(lease_seconds=60) == 1
+
+    assert second.claim_command(name)["command"] == "echo hi"
+    second.finish_command(name)
+    assert second.counts()["commands"] == 0
+
+
+def test_approvals_stay_out_of_responses(tmp_path):
+    """承認結果は専用のディレクトリに置かれ、レスポンスとして一覧されない"""
+    comm = FileCommunicator(str(tmp_path), worker_id="host-a")
+    pending = comm.create_pending("rm -rf /tmp/x", "approve?")
+    name = comm.create_approval(pending, True, user_name="alice")
+
+    assert comm.list_responses() == []
+    assert comm.claim_approval(name)["job_id"] == Path(pending).stem
+    # 停止して戻された承認結果も承認結果のディレクトリに戻る
+    assert comm.release_claims() == 1
+    assert (comm.approval_dir / name).exists()
+    comm.finish_approval(name)
+    assert not list(comm.approval_dir.glob("*.json"))
+
+    # 以前の版がレスポンスのディレクトリに書いた承認結果を移す
+    comm.write_json_safe(comm.response_dir / name, {"approval": False})
+    assert comm.move_legacy_approvals() == 1
+    assert comm.list_responses() == []
+    assert comm.claim_approval(name) == {"approval": False}
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+スプール掃除のテスト
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from bridge.file_comm import FileWatcher, InotifyFileWatcher, inotify_available
+from bridge.janitor import FileIndex, SpoolJanitor
+
+
+def _make(directory: Path, name: str, age: float, size: int = 10) -> Path:
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    past = time.time() - age
+    os.utime(path, (past, past))
+    return path
+
+
+def test_expired_files_are_deleted_in_batches(tmp_path):
+    """期限切れのファイルだけを、1回あたり batch_size 件ずつ古い順に削除する"""
+    old = [_make(tmp_path, f"res_{i}.json", age=1000 + i) for i in range(5)]
+    fresh = _make(tmp_path, "res_new.json", age=0)
+    index = FileIndex("spool", [tmp_path], "*.json", max_age=500)
+
+    assert index.sweep(batch_size=2) == 2
+    # 最も古いものから消える
+    assert not old[4].exists() and not old[3].exists() and old[2].exists()
+
+    janitor = SpoolJanitor([index], batch_size=100)
+    assert janitor.run_once() == 3
+    assert fresh.exists()
+    assert len(index) == 1
+
+
+def test_count_and_size_quotas(tmp_path):
+    for i in range(10):
+        _make(tmp_path, f"cmd_{i}.json", age=100 - i, size=100)
+    index = FileIndex("spool", [tmp_path], "*.json", max_files=6)
+    index.sweep()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [f"cmd_{i}.json" for i in range(4, 10)]
+
+    index.max_bytes = 300
+    index.sweep()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cmd_7.json", "cmd_8.json", "cmd_9.json"]
+    assert index.total_bytes == 300
+
+
+def test_renewed_and_removed_files_are_not_deleted(tmp_path):
+    """索引に登録した後に更新・削除されたファイルは、削除せずに索引を直す"""
+    renewed = _make(tmp_path, "a.json", age=1000)
+    gone = _make(tmp_path, "b.json", age=1000)
+    index = FileIndex("spool", [tmp_path], "*.json", max_age=500)
+    index.seed()
+
+    os.utime(renewed)
+    gone.unlink()
+    assert index.sweep() == 0
+    assert renewed.exists()
+    assert len(index) == 1
+
+    index.forget(renewed)
+    assert len(index) == 0 and index.total_bytes == 0
+
+
+@pytest.mark.parametrize("watcher_cls", [FileWatcher, InotifyFileWatcher])
+def test_watcher_reports_removed_files(tmp_path, watcher_cls):
+    """監視中のファイルが削除されると on_remove が呼ばれる"""
+    if watcher_cls is InotifyFileWatcher and not inotify_available():
+        pytest.skip("inotify not available")
+
+    index = FileIndex("spool", [tmp_path], "*.json")
+    watcher = watcher_cls(tmp_path, index.track, on_remove=index.forget)
+    watcher.start()
+    try:
+        path = tmp_path / "res_1.json"
+        path.write_text('{"message": "ok"}')
+        deadline = time.time() + 3
+        while len(index) != 1 and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(index) == 1
+
+        path.unlink()
+        deadline = time.time() + 3
+        while len(index) != 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(index) == 0
+    finally:
+        watcher.stop()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+ジョブのリソース制限とプロセスグループ管理のテスト
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.job_limits import JobLimits, LimitPolicy
+from bridge.job_process import AsyncProcess
+from bridge.streaming import stream_process, stream_process_async
+
+
+def _popen(command, limits=None):
+    return subprocess.Popen(
+        LimitPolicy.wrap(command, limits) if limits else command,
+        shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 回収されていないゾンビは終了済みとみなす
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().split(")")[-1].split()[0] != "Z"
+
+
+def test_user_overrides_from_file(tmp_path, monkeypatch):
+    config = tmp_path / "limits.json"
+    config.write_text(json.dumps({
+        "default": {"cpu_seconds": 60},
+        "users": {"42": {"memory_mb": 8192, "unknown": 1}}
+    }))
+    monkeypatch.setenv('JOB_LIMITS_FILE', str(config))
+    monkeypatch.setenv('JOB_MEMORY_MB', '1024')
+    monkeypatch.delenv('JOB_CGROUP_PARENT', raising=False)
+
+    policy = LimitPolicy.from_env()
+    assert policy.for_user("7").to_dict()['memory_mb'] == 1024
+    assert policy.for_user(42).to_dict() == {
+        'cpu_seconds': 60, 'memory_mb': 8192, 'file_size_mb': 1024, 'max_processes': 0
+    }
+
+
+def test_memory_and_process_limits_are_off_without_cgroup(monkeypatch):
+    for name in ('JOB_LIMITS_FILE', 'JOB_CGROUP_PARENT', 'JOB_MEMORY_MB', 'JOB_MAX_PROCESSES'):
+        monkeypatch.delenv(name, raising=False)
+    limits = LimitPolicy.from_env().default
+    assert limits.memory_mb == 0
+    assert limits.max_processes == 0
+    assert LimitPolicy.preexec(limits) is None
+
+
+def test_file_size_limit_is_applied_in_child(tmp_path):
+    target = tmp_path / "big"
+    result = stream_process(
+        _popen(f"head -c 3000000 /dev/zero > {target}", JobLimits(file_size_mb=1)),
+        timeout=10, on_output=lambda *_: None, process_group=True
+    )
+    assert result['returncode'] != 0
+    assert target.stat().st_size <= 1024 * 1024
+
+
+def test_wrap_sets_limits_in_shell():
+    limits = JobLimits(cpu_seconds=30, memory_mb=512, file_size_mb=2)
+    proc = _popen("ulimit -S -t; ulimit -H -t; ulimit -f; ulimit -d", limits)
+    out, _ = proc.communicate(timeout=10)
+    assert out.decode().split() == ["30", "35", "4096", str(512 * 1024)]
+    assert LimitPolicy.wrap("echo hi", JobLimits()) == "echo hi"
+
+
+def test_process_limit_is_set_before_exec():
+    limits = JobLimits(max_processes=64)
+    proc = subprocess.Popen(
+        LimitPolicy.wrap("cat /proc/self/limits", limits), shell=True,
+        stdout=subprocess.PIPE, preexec_fn=LimitPolicy.preexec(limits)
+    )
+    out, _ = proc.communicate(timeout=10)
+    line = next(l for l in out.decode().splitlines() if l.startswith("Max processes"))
+    assert line.split()[2:4] == ["64", "64"]
+
+
+def test_timeout_kills_grandchildren_and_reports_usage(tmp_path):
+    pid_file = tmp_path / "pid"
+    result = stream_process(
+        _popen(f"sleep 30 & echo $! > {pid_file}; wait"),
+        timeout=0.5, on_output=lambda *_: None, process_group=True
+    )
+    assert result['timed_out']
+    time.sleep(0.1)
+    assert not _alive(int(pid_file.read_text()))
+    assert result['rusage'] is not None
+
+    result = stream_process(
+        _popen(f"{sys.executable} -c 'b = bytearray(64 * 1024 * 1024)'"),
+        timeout=10, on_output=lambda *_: None, process_group=True
+    )
+    assert result['returncode'] == 0
+    assert result['rusage']['peak_rss_kb'] > 60 * 1024
+    assert result['rusage']['cpu_seconds'] >= 0
+
+
+def test_async_process_cancellation_kills_group(tmp_path):
+    pid_file = tmp_path / "pid"
+
+    async def scenario():
+        proc = await AsyncProcess.spawn(f"sleep 30 & echo $! > {pid_file}; wait")
+        task = asyncio.ensure_future(
+            stream_process_async(proc, timeout=30, on_output=lambda *_: None, process_group=True)
+        )
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        done = await AsyncProcess.spawn("echo ok")
+        return await stream_process_async(done, timeout=10, on_output=lambda *_: None, process_group=True)
+
+    result = asyncio.run(scenario())
+    time.sleep(0.1)
+    assert not _alive(int(pid_file.read_text()))
+    assert result['stdout'] == "ok\n"
+    assert result['returncode'] == 0
+    assert result['rusage'] is not None
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+ジョブ一覧とキャンセルのテスト
+"""
+
+import os
+import sys
+import time
+import threading
+import subprocess
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.job_registry import (
+    JobRegistry, JOB_QUEUED, JOB_RUNNING,
+    write_cancel_request, read_cancel_requests, remove_cancel_request,
+)
+from bridge.worker_pool import WorkerPool
+from bridge.streaming import stream_process
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 回収されていないゾンビは終了済みとみなす
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().split(")")[-1].split()[0] != "Z"
+
+
+def test_queued_job_is_removed_from_pool():
+    """実行待ちのジョブは開始前に取り消せ、枠は他のジョブに回る"""
+    pool = WorkerPool(max_workers=1, per_user_limit=1, max_queue=10)
+    release = threading.Event()
+    ran = []
+
+    pool.start()
+    try:
+        assert pool.submit("busy", "alice", release.wait)
+        assert pool.submit("queued", "bob", ran.append, "queued")
+        assert pool.submit("next", "carol", ran.append, "next")
+        time.sleep(0.1)
+        assert pool.cancel("queued") is not None
+        assert pool.cancel("busy") is None
+        release.set()
+        time.sleep(0.2)
+        assert ran == ["next"]
+    finally:
+        release.set()
+        pool.stop(timeout=2)
+
+
+def test_cancel_kills_running_process_group(tmp_path):
+    registry = JobRegistry()
+    registry.add("job1", "cmd_1.json", "sleep 30", "42", "alice")
+    assert registry.snapshot()[0]['state'] == JOB_QUEUED
+    registry.start("job1")
+
+    pid_file = tmp_path / "pid"
+    proc = subprocess.Popen(
+        f"sleep 30 & echo $! > {pid_file}; wait", shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True
+    )
+    registry.attach("job1", proc)
+    job = registry.snapshot()[0]
+    assert job['state'] == JOB_RUNNING and job['pid'] == proc.pid
+
+    time.sleep(0.2)
+    threading.Timer(0.2, registry.cancel, ("job1", "bob")).start()
+    start = time.monotonic()
+    result = stream_process(proc, timeout=30, on_output=lambda *_: None, process_group=True)
+    assert time.monotonic() - start < 5
+    assert result['returncode'] != 0
+    assert registry.get("job1").cancelled_by == "bob"
+    time.sleep(0.1)
+    assert not _alive(int(pid_file.read_text()))
+
+    assert registry.finish("job1") is not None
+    assert registry.snapshot() == []
+
+
+def test_process_attached_after_cancel_is_killed():
+    """開始直後（プロセス起動前）に届いたキャンセルも効く"""
+    registry = JobRegistry()
+    registry.add("job1", "cmd_1.json", "sleep 30")
+    registry.start("job1")
+    registry.cancel("job1", "alice")
+    proc = subprocess.Popen("sleep 30", shell=True, start_new_session=True)
+    registry.attach("job1", proc)
+    assert proc.wait(timeout=5) != 0
+
+
+def test_cancel_requests_round_trip_and_expire(tmp_path):
+    write_cancel_request(tmp_path, "cmd_1", user_name="alice")
+    (tmp_path / "executor-w1.json").write_text("{}")
+    requests = read_cancel_requests(tmp_path)
+    assert [(r['job_id'], r['user_name']) for r in requests] == [("cmd_1", "alice")]
+
+    # 誰も処理しない古い要求は捨てる
+    assert read_cancel_requests(tmp_path, now=time.time() + 3600) == []
+    assert not Path(requests[0]['path']).exists()
+
+    write_cancel_request(tmp_path, "cmd_2")
+    remove_cancel_request(read_cancel_requests(tmp_path)[0]['path'])
+    assert read_cancel_requests(tmp_path) == []
+
+
+def test_cancelling_batch_cancels_its_steps():
+    """バッチをキャンセルすると実行中のステップも終了し、後から始まるステップもキャンセル済みになる"""
+    registry = JobRegistry()
+    registry.add("batch1", "cmd_1.json", "batch: a, b")
+    registry.add("batch1.a", "batch1.a", "sleep 30", parent="batch1")
+    proc = subprocess.Popen("sleep 30", shell=True, start_new_session=True)
+    registry.attach("batch1.a", proc)
+
+    registry.cancel("batch1", "alice")
+    assert proc.wait(timeout=5) != 0
+    assert registry.get("batch1.a").cancelled_by == "alice"
+    assert registry.add("batch1.b", "batch1.b", "true", parent="batch1").cancelled
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+ジョブ状態ジャーナルのテスト
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.journal import JobJournal, STATE_RECEIVED, STATE_RUNNING, STATE_DONE
+
+
+def test_replay_restores_latest_state_and_ignores_torn_line(tmp_path):
+    """再起動後に各ジョブの最新の状態が復元され、書きかけの行は無視される"""
+    path = tmp_path / "executor.log"
+    journal = JobJournal(path, fsync=False)
+    journal.record("job_a", STATE_RECEIVED)
+    journal.record("job_a", STATE_RUNNING)
+    journal.record("job_b", STATE_RECEIVED)
+    journal.record("job_b", STATE_RUNNING)
+    journal.record("job_b", STATE_DONE)
+    journal.close()
+
+    with open(path, "a") as f:
+        f.write('{"key":"job_c","sta')
+
+    replayed = JobJournal(path, fsync=False)
+    assert replayed.get("job_a") == STATE_RUNNING
+    assert replayed.get("job_b") == STATE_DONE
+    assert replayed.get("job_c") is None
+
+
+def test_refresh_sees_other_writers_and_survives_compaction(tmp_path):
+    """他のプロセスの追記や圧縮後の書き込みも取り込める"""
+    path = tmp_path / "executor.log"
+    first = JobJournal(path, fsync=False)
+    second = JobJournal(path, fsync=False)
+
+    first.record("job_a", STATE_RUNNING)
+    second.refresh()
+    assert second.get("job_a") == STATE_RUNNING
+
+    for i in range(1200):
+        first.record(f"old_{i}", STATE_DONE)
+    first.retention = 0
+    time.sleep(0.01)
+    first.compact()
+    assert path.read_text().count("\n") == 1
+
+    first.record("job_a", STATE_DONE)
+    second.refresh()
+    assert second.get("job_a") == STATE_DONE
+    assert second.get("old_0") is None
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+メトリクスのテスト
+"""
+
+import sys
+import urllib.request
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from bridge.metrics import MetricsRegistry, MetricsServer
+
+
+def test_render_prometheus_text_format():
+    """カウンタ・ゲージ・ヒストグラムをPrometheusのテキスト形式で出力する"""
+    registry = MetricsRegistry()
+    commands = registry.counter('commands_total', 'Commands', ['outcome'])
+    depth = [3]
+    registry.gauge('queue_depth', 'Queue depth', func=lambda: depth[0])
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+
+    commands.inc(outcome='queued')
+    commands.inc(2, outcome='queued')
+    commands.inc(outcome='rejected')
+    for value in (0.05, 0.1, 0.5, 5):
+        latency.observe(value)
+    with pytest.raises(ValueError):
+        commands.inc(kind='x')
+
+    text = registry.render()
+    assert '# TYPE commands_total counter' in text
+    assert 'commands_total{outcome="queued"} 3' in text
+    assert 'commands_total{outcome="rejected"} 1' in text
+    assert 'queue_depth 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert 'latency_seconds_sum 5.65' in text
+    assert 'latency_seconds_count 4' in text
+
+
+def test_http_endpoint():
+    """/metrics で現在の値を返す"""
+    registry = MetricsRegistry()
+    registry.counter('jobs_total', 'Jobs').inc()
+    server = MetricsServer(registry, port=0)
+    assert server.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+            body = response.read().decode()
+        assert response.status == 200
+        assert 'jobs_total 1' in body
+    finally:
+        server.stop()
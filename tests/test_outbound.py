@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Discord送信キューのテスト（Discordには接続しない）
+"""
+
+import sys
+import asyncio
+import logging
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import discord
+
+from bot.outbound import OutboundQueue, PRIORITY_APPROVAL, PRIORITY_RESPONSE
+
+
+class FakeMessage:
+    def __init__(self, channel, kwargs):
+        self.channel = channel
+        self.kwargs = kwargs
+        self.reactions = []
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+
+class FakeChannel:
+    def __init__(self, channel_id=1):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, **kwargs):
+        message = FakeMessage(self, kwargs)
+        self.sent.append(message)
+        return message
+
+
+def test_backlog_is_coalesced_and_approvals_go_first():
+    """滞留した応答は1メッセージにまとめられ、承認要求が先に送られる"""
+    channel = FakeChannel()
+
+    async def scenario():
+        queue = OutboundQueue()
+        responses = [
+            queue.send(channel, PRIORITY_RESPONSE, coalesce=True, embed=discord.Embed(description=f"r{i}"))
+            for i in range(12)
+        ]
+        approval = queue.send(channel, PRIORITY_APPROVAL, embed=discord.Embed(description="approve?"))
+        tasks = [asyncio.ensure_future(c) for c in responses + [approval]]
+        await asyncio.sleep(0)
+
+        queue.start()
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), timeout=5)
+        finally:
+            queue.stop()
+        return queue.stats
+
+    stats = asyncio.run(scenario())
+
+    assert channel.sent[0].kwargs['embed'].description == "approve?"
+    assert [len(m.kwargs['embeds']) for m in channel.sent[1:]] == [10, 2]
+    assert stats['coalesced'] == 10
+
+
+def test_rate_limited_route_is_retried():
+    """429を受けた送信は待ってから再送される"""
+    class FlakyChannel(FakeChannel):
+        failed = False
+
+        async def send(self, **kwargs):
+            if not self.failed:
+                self.failed = True
+                response = type("Response", (), {"status": 429, "reason": "Too Many Requests"})()
+                error = discord.HTTPException(response, "rate limited")
+                error.retry_after = 0.05
+                raise error
+            return await super().send(**kwargs)
+
+    channel = FlakyChannel()
+
+    async def scenario():
+        queue = OutboundQueue()
+        queue.start()
+        try:
+            message = await asyncio.wait_for(queue.send(channel, embed=discord.Embed()), timeout=2)
+            await queue.add_reaction(message, "✅")
+        finally:
+            queue.stop()
+        return queue.stats
+
+    stats = asyncio.run(scenario())
+
+    assert stats['rate_limited'] == 1
+    assert channel.sent[0].reactions == ["✅"]
+
+
+def test_rate_limits_retried_inside_discord_py_are_counted():
+    """discord.py が内部で待って再送したレート制限も、HTTPクライアントの警告ログから数える"""
+    http_log = logging.getLogger('discord.http')
+
+    async def scenario():
+        queue = OutboundQueue()
+        queue.start()
+        try:
+            http_log.warning('We are being rate limited. %s %s responded with 429. Retrying in %.2f seconds.',
+                             'POST', '/channels/1/messages', 0.5)
+            http_log.warning('Global rate limit has been hit. Retrying in %.2f seconds.', 1.0)
+            http_log.warning('Unrelated warning')
+        finally:
+            queue.stop()
+        # 停止後のログは数えない
+        http_log.warning('We are being rate limited. %s %s responded with 429. Retrying in %.2f seconds.',
+                         'POST', '/channels/1/messages', 0.5)
+        return queue.stats
+
+    stats = asyncio.run(scenario())
+
+    assert stats['rate_limited'] == 2
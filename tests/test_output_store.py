@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+出力保存領域のテスト
+"""
+
+import os
+import sys
+import gzip
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.output_store import OutputStore
+
+
+def test_large_output_is_gzipped(tmp_path):
+    """閾値を超えた出力は圧縮され、小さい出力はそのまま保存される"""
+    store = OutputStore(tmp_path, gzip_threshold=100)
+    spool = store.open_spool("job1")
+    spool.feed("stdout", "x" * 1000)
+    spool.feed("stderr", "warn\n")
+    spool.feed(None, "")
+
+    outputs = spool.close()
+
+    assert outputs["stdout"].name == "job1_stdout.log.gz"
+    assert gzip.decompress(outputs["stdout"].read_bytes()) == b"x" * 1000
+    assert outputs["stderr"].read_text() == "warn\n"
+
+
+def test_per_file_limit_truncates(tmp_path):
+    """1出力あたりの上限を超えた分は書き込まれない"""
+    store = OutputStore(tmp_path, max_file_bytes=10)
+    spool = store.open_spool("job1")
+    spool.feed("stdout", "0123456789abcdef")
+
+    outputs = spool.close()
+
+    assert outputs["stdout"].read_text() == "0123456789"
+    assert "stdout" in spool.truncated
+
+
+def test_quota_evicts_oldest_files(tmp_path):
+    """容量上限を超えると古い出力から削除される"""
+    store = OutputStore(tmp_path, max_bytes=250, gzip_threshold=10_000)
+    old = tmp_path / "old_stdout.log"
+    old.write_bytes(b"o" * 200)
+    past = time.time() - 60
+    os.utime(old, (past, past))
+
+    spool = store.open_spool("new")
+    spool.feed("stdout", "n" * 200)
+    outputs = spool.close()
+
+    assert not old.exists()
+    assert outputs["stdout"].exists()
+
+
+def test_quota_keeps_outputs_still_being_written(tmp_path):
+    """実行中のジョブが書き込んでいる出力は、上限を超えても走査・削除の対象にしない"""
+    running = OutputStore(tmp_path, max_bytes=100, gzip_threshold=10_000).open_spool("running")
+    running.feed("stdout", "r" * 200)
+    running.files["stdout"].flush()
+    past = time.time() - 60
+    os.utime(tmp_path / "running_stdout.log", (past, past))
+
+    store = running.store
+    spool = store.open_spool("new")
+    spool.feed("stdout", "n" * 200)
+    spool.close()
+
+    assert (tmp_path / "running_stdout.log").exists()
+    assert str(tmp_path / "running_stdout.log") not in store.index.entries
+    running.close()
+
+
+def test_bundle_collects_outputs_into_one_archive(tmp_path):
+    """複数ジョブの出力を1つの tar.gz にまとめ、元の出力は削除する"""
+    import tarfile
+
+    store = OutputStore(tmp_path / "out", gzip_threshold=100)
+    members = []
+    for name, text in (("build", "x" * 1000), ("test", "ok\n")):
+        spool = store.open_spool(f"job1.{name}")
+        spool.feed("stdout", text)
+        members.append((f"{name}/stdout.log", spool.close()["stdout"]))
+
+    bundle = store.bundle("job1_batch", members)
+
+    with tarfile.open(bundle) as tar:
+        assert sorted(tar.getnames()) == ["build/stdout.log", "test/stdout.log"]
+        assert tar.extractfile("build/stdout.log").read() == b"x" * 1000
+    assert not any(path.exists() for _, path in members)
+    assert store.bundle("empty", []) is None
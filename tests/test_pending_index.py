@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+承認待ち索引のテスト
+"""
+
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bot.pending_index import PendingIndex
+
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+
+
+def test_lookup_by_message_and_answered_entries_stay_known():
+    """メッセージIDで引け、回答済みの承認待ちはスプールから消えるまで再通知しない"""
+    index = PendingIndex()
+    index.add("pending_a.json", FakeMessage(10), {"command": "sudo ls"})
+
+    name, info = index.get_by_message(10)
+    assert name == "pending_a.json"
+    assert info['data']['command'] == "sudo ls"
+    assert index.get_by_message(11) is None
+
+    index.pop(name)
+    assert index.get_by_message(10) is None
+    assert index.is_known("pending_a.json")
+
+    index.retain_closed([])
+    assert not index.is_known("pending_a.json")
+
+
+def test_expiry_and_eviction():
+    """期限切れと上限超過で古い承認待ちから取り除かれる"""
+    index = PendingIndex(expire_after=60, max_entries=2)
+    index.add("p1", FakeMessage(1), {}, now=0)
+    index.add("p2", FakeMessage(2), {}, now=30)
+    evicted = index.add("p3", FakeMessage(3), {}, now=40)
+
+    assert [name for name, _ in evicted] == ["p1"]
+    assert [name for name, _ in index.expire(now=95)] == ["p2"]
+    assert len(index) == 1
+    assert index.get_by_message(3)[0] == "p3"
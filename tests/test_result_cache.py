@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+実行結果キャッシュのテスト
+"""
+
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.result_cache import ResultCache
+
+OK = {'success': True, 'stdout': 'clean', 'returncode': 0}
+
+
+def test_key_normalizes_and_checks_allowlist():
+    cache = ResultCache(commands=["git status", "df"])
+    assert cache.key("git   status", "/home") == cache.key("'git' status", "/home") == ("git status", "/home")
+    assert cache.key("git status -s", "/home") == ("git status -s", "/home")
+    assert cache.key("git status", "/home") != cache.key("git status", "/tmp")
+    # 許可リスト外・副作用があり得るコマンドは対象外
+    assert cache.key("git push", "/home") is None
+    assert cache.key("df -h > out.txt", "/home") is None
+    assert cache.key("df; rm -rf x", "/home") is None
+    assert cache.key("df $(whoami)", "/home") is None
+
+
+def test_ttl_and_lru():
+    cache = ResultCache(commands=["df"], ttl=10, max_entries=2)
+    a, b, c = ("df", "/a"), ("df", "/b"), ("df", "/c")
+    for key in (a, b):
+        assert cache.join(key, None) is False
+        cache.complete(key, OK, now=100)
+
+    assert cache.get(a, now=105) == (5, OK)
+    # b が最も使われていないので c を入れると捨てられる
+    cache.join(c, None)
+    cache.complete(c, OK, now=106)
+    assert cache.get(b, now=106) is None
+    assert cache.get(a, now=111) is None
+
+
+def test_inflight_requests_share_one_execution():
+    cache = ResultCache(commands=["git status"])
+    key = cache.key("git status", "/repo")
+
+    assert cache.join(key, "leader") is False
+    assert cache.join(key, "w1") is True
+    assert cache.join(key, "w2") is True
+    assert cache.complete(key, OK) == ["w1", "w2"]
+    assert cache.get(key) is not None
+    # 実行が終わった後は新しく実行する側になる
+    assert cache.join(key, "next") is False
+
+
+def test_failed_results_are_not_cached():
+    cache = ResultCache(commands=["df"])
+    key = cache.key("df", "/")
+    cache.join(key, None)
+    assert cache.complete(key, {'success': False, 'error': 'timeout'}) == []
+    assert cache.get(key) is None
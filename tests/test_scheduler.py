@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+実行待ちスケジューラのテスト
+"""
+
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.scheduler import (
+    FairScheduler, PRIORITY_HIGH, PRIORITY_LOW, parse_priority, parse_weights
+)
+
+
+def drain(scheduler, now=0):
+    order = []
+    while len(scheduler):
+        order.append(scheduler.pop(now=now))
+    return order
+
+
+def test_users_are_interleaved_and_weighted():
+    """大量に投入したユーザーがいても他のユーザーのジョブが順番に挟まり、重みの分だけ多く実行される"""
+    scheduler = FairScheduler()
+    for i in range(3):
+        scheduler.push(f"a{i}", "alice", f"a{i}", now=0)
+    scheduler.push("b0", "bob", "b0", now=0)
+    assert scheduler.position("b0", now=0) == 2
+    assert drain(scheduler) == ["a0", "b0", "a1", "a2"]
+
+    scheduler = FairScheduler(weights=parse_weights("alice:2, bob:1, bad"))
+    for i in range(4):
+        scheduler.push(f"a{i}", "alice", f"a{i}", now=0)
+        scheduler.push(f"b{i}", "bob", f"b{i}", now=0)
+    assert drain(scheduler)[:6] == ["a0", "b0", "a1", "a2", "b1", "a3"]
+
+
+def test_priority_aging_and_user_limit():
+    """高優先度が先に実行され、待ち続けた低優先度は昇格し、実行できないユーザーは飛ばされる"""
+    scheduler = FairScheduler(aging_seconds=60)
+    scheduler.push("low", "alice", "low", priority=PRIORITY_LOW, now=0)
+    scheduler.push("normal", "bob", "normal", now=100)
+    scheduler.push("high", "carol", "high", priority=PRIORITY_HIGH, now=100)
+
+    assert scheduler.pop(now=100) == "high"
+    # low は100秒待って normal と同じ段になり、先に投入されているので先に実行される
+    assert scheduler.pop(can_run=lambda user_id: user_id != "alice", now=100) == "normal"
+    assert scheduler.pop(now=100) == "low"
+    assert scheduler.pop(now=100) is None
+
+    assert parse_priority("HIGH") == PRIORITY_HIGH
+    assert parse_priority("unknown") == parse_priority(None) == 1
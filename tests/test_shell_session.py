@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+常駐シェルセッションのテスト
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.job_limits import JobLimits, LimitPolicy
+from bridge.shell_session import SessionManager
+
+
+def test_state_persists_between_commands(tmp_path):
+    """cd や export は同じユーザーの次のコマンドに引き継がれる"""
+    sessions = SessionManager()
+    try:
+        first = sessions.run("alice", f"cd {tmp_path} && export GREETING=hello", timeout=5)
+        assert first['returncode'] == 0
+
+        result = sessions.run("alice", "pwd; echo $GREETING; false", timeout=5)
+        assert result['stdout'] == f"{tmp_path}\nhello\n"
+        assert result['returncode'] == 1
+
+        other = sessions.run("bob", "echo ${GREETING:-none}", timeout=5)
+        assert other['stdout'] == "none\n"
+    finally:
+        sessions.close_all()
+
+
+def test_timeout_and_idle_eviction():
+    """タイムアウトしたセッションは作り直され、使われていないセッションは終了する"""
+    sessions = SessionManager(idle_timeout=60)
+    try:
+        chunks = []
+        result = sessions.run("alice", "echo start; sleep 5", timeout=0.5,
+                              on_output=lambda name, text: name and chunks.append(text))
+        assert result['timed_out']
+        assert "".join(chunks) == "start\n"
+
+        assert sessions.run("alice", "echo again", timeout=5)['stdout'] == "again\n"
+
+        sessions.evict_idle(now=time.monotonic() + 120)
+        assert sessions.sessions == {}
+    finally:
+        sessions.close_all()
+
+
+def test_user_limits_apply_to_session_shell():
+    """常駐シェルで実行するコマンドにもユーザーのリソース上限がかかる"""
+    policy = LimitPolicy(JobLimits(file_size_mb=1), users={"alice": {"cpu_seconds": 30}})
+    sessions = SessionManager(limits=policy)
+    try:
+        result = sessions.run("alice", "ulimit -f; ulimit -t", timeout=5)
+        assert result['stdout'].split() == ["1024", "30"]
+        assert sessions.run("bob", "ulimit -t", timeout=5)['stdout'] == "unlimited\n"
+    finally:
+        sessions.close_all()
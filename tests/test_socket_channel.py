@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+ソケット通信のテスト
+"""
+
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.file_comm import FileCommunicator
+from bridge.records import KIND_COMMAND, KIND_RESPONSE
+from bridge.socket_channel import SocketServer, AsyncSocketClient, ChannelCommunicator
+
+
+def test_records_flow_both_ways(tmp_path):
+    """Botからのコマンドと実行エンジンからのレスポンスが即座に届き、受領が返る"""
+    server_received = []
+
+    def on_server_message(*msg):
+        server_received.append(msg)
+        return True
+
+    server = SocketServer(tmp_path / "bridge.sock", on_server_message)
+    server.start()
+    comm = ChannelCommunicator(FileCommunicator(str(tmp_path)), server, ack_timeout=2)
+
+    async def scenario():
+        client_received = asyncio.Queue()
+
+        async def on_message(kind, name, data):
+            await client_received.put((kind, name, data))
+            return True
+
+        client = AsyncSocketClient(tmp_path / "bridge.sock", on_message, reconnect_interval=0.05)
+        task = asyncio.create_task(client.run())
+        try:
+            while not (client.connected and server.connected):
+                await asyncio.sleep(0.01)
+
+            assert await client.send(KIND_COMMAND, "cmd_1.json", {"command": "ls"}, ack_timeout=2)
+            # 受領を待つ間もイベントループを止めないよう別スレッドで送る
+            name = await asyncio.to_thread(comm.create_response, "done", job_id="cmd_1")
+            return name, await asyncio.wait_for(client_received.get(), timeout=2)
+        finally:
+            task.cancel()
+
+    try:
+        name, (kind, received_name, data) = asyncio.run(scenario())
+        deadline = time.time() + 2
+        while not server_received and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        server.stop()
+
+    assert server_received == [(KIND_COMMAND, "cmd_1.json", {"command": "ls"})]
+    assert (kind, received_name, data["job_id"]) == (KIND_RESPONSE, name, "cmd_1")
+    # ソケットで届いたレコードはスプールに書き込まれない
+    assert not list(comm.response_dir.glob("*.json"))
+
+
+def test_falls_back_to_spool_without_peer(tmp_path):
+    """相手が接続していなければスプールに書き込む"""
+    server = SocketServer(tmp_path / "bridge.sock", lambda *msg: None)
+    server.start()
+    try:
+        comm = ChannelCommunicator(FileCommunicator(str(tmp_path)), server)
+        name = comm.create_response("done")
+        pending = comm.create_pending("sudo ls", "approve?")
+    finally:
+        server.stop()
+
+    assert (comm.response_dir / name).exists()
+    assert (comm.pending_dir / pending).exists()
+
+
+def test_unacknowledged_records_fall_back_to_spool(tmp_path):
+    """受け取った側が保存できず受領を返さなければ、送信側はスプールに書き込む"""
+    server = SocketServer(tmp_path / "bridge.sock", lambda *msg: False)
+    server.start()
+    comm = ChannelCommunicator(FileCommunicator(str(tmp_path)), server, ack_timeout=0.2)
+
+    async def scenario():
+        async def on_message(kind, name, data):
+            return False
+
+        client = AsyncSocketClient(tmp_path / "bridge.sock", on_message, reconnect_interval=0.05)
+        task = asyncio.create_task(client.run())
+        try:
+            while not (client.connected and server.connected):
+                await asyncio.sleep(0.01)
+            sent = await client.send(KIND_COMMAND, "cmd_1.json", {"command": "ls"}, ack_timeout=0.2)
+            name = await asyncio.to_thread(comm.create_response, "done", job_id="cmd_1")
+            return sent, name
+        finally:
+            task.cancel()
+
+    try:
+        sent, name = asyncio.run(scenario())
+    finally:
+        server.stop()
+
+    assert not sent
+    assert (comm.response_dir / name).exists()
+
+
+def test_records_waiting_for_the_handler_are_visible(tmp_path):
+    """処理を待っているレコードは queued に載り（スプールの重複との照合用）、処理後に外れる"""
+    server = SocketServer(tmp_path / "bridge.sock", lambda *msg: True)
+    server.start()
+
+    async def scenario():
+        release = asyncio.Event()
+        seen = []
+
+        async def on_message(kind, name, data):
+            seen.append(dict(client.queued))
+            await release.wait()
+            return True
+
+        client = AsyncSocketClient(tmp_path / "bridge.sock", on_message, reconnect_interval=0.05)
+        task = asyncio.create_task(client.run())
+        try:
+            while not (client.connected and server.connected):
+                await asyncio.sleep(0.01)
+            for index in (1, 2):
+                await asyncio.to_thread(server.send, KIND_RESPONSE, f"response_{index}.json", {"job_id": f"cmd_{index}"})
+            while len(client.queued) < 2:
+                await asyncio.sleep(0.01)
+            release.set()
+            while client.queued:
+                await asyncio.sleep(0.01)
+            return seen
+        finally:
+            task.cancel()
+
+    try:
+        seen = asyncio.run(scenario())
+    finally:
+        server.stop()
+
+    assert "response_1.json" in seen[0]
+    assert set(seen[1]) == {"response_2.json"}
+
+
+def test_adopted_records_are_recovered_after_restart(tmp_path):
+    """ソケットで届いて保存したコマンドは、停止後に未処理として戻る"""
+    comm = FileCommunicator(str(tmp_path), worker_id="host-a")
+    assert comm.adopt_record(KIND_COMMAND, "cmd_1.json", {"command": "ls"})
+    assert (comm.claimed_dir / "cmd_1.json").exists()
+    assert not list(comm.command_dir.glob("*.json"))
+
+    restarted = FileCommunicator(str(tmp_path), worker_id="host-a")
+    assert restarted.release_claims() == 1
+    assert restarted.claim_command("cmd_1.json") == {"command": "ls"}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+スプール書き込みのテスト
+"""
+
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+
+from bridge.records import build_command
+from bridge.spool_writer import SpoolWriter, decode_record, encode_record, read_record
+
+
+@pytest.mark.parametrize("use_tmpfile", [True, False])
+def test_write_round_trip_and_overwrite(tmp_path, use_tmpfile):
+    """書いた内容をそのまま読め、同じ名前への書き込みは置き換えになる"""
+    writer = SpoolWriter()
+    writer.use_tmpfile = writer.use_tmpfile and use_tmpfile
+    path = tmp_path / "res_1.json"
+
+    assert writer.write(path, {"message": "完了\n出力", "n": 1})
+    assert read_record(path) == {"message": "完了\n出力", "n": 1}
+
+    assert writer.write(path, {"message": "上書き", "n": 2})
+    assert read_record(path) == {"message": "上書き", "n": 2}
+    # 一時ファイルが残らない
+    assert [p.name for p in tmp_path.iterdir()] == ["res_1.json"]
+
+
+def test_encoded_json_is_compact():
+    raw = encode_record({"a": 1, "b": "日本語"})
+    assert raw == '{"a":1,"b":"日本語"}'.encode('utf-8')
+    assert decode_record(raw) == {"a": 1, "b": "日本語"}
+
+
+def test_batch_fsync_flushes_on_close(tmp_path):
+    writer = SpoolWriter(fsync="batch", fsync_interval=60)
+    for i in range(5):
+        assert writer.write(tmp_path / f"cmd_{i}.json", {"i": i})
+    assert len(writer.unsynced) == 5
+    writer.close()
+    assert writer.unsynced == []
+    assert read_record(tmp_path / "cmd_4.json") == {"i": 4}
+
+
+def test_read_record_missing_file(tmp_path):
+    assert read_record(tmp_path / "missing.json") is None
+
+
+def test_command_names_are_unique_within_the_same_second():
+    """同じ秒に作られたコマンドでもファイル名が重ならない"""
+    names = {build_command("echo hi", {"user_name": "tester"})[0] for _ in range(100)}
+    assert len(names) == 100
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+SQLite通信バックエンドのテスト
+"""
+
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.file_comm import FileCommunicator
+from bridge.records import KIND_COMMAND, KIND_RESPONSE
+from bridge.sqlite_comm import SQLiteCommunicator
+from bridge.transport import create_communicator
+
+
+def test_claim_next_command_is_exclusive(tmp_path):
+    """同じコマンドを2つの接続から重複して取得しない"""
+    first = SQLiteCommunicator(str(tmp_path))
+    second = SQLiteCommunicator(str(tmp_path))
+
+    name = first.create_command("echo 1", {"user_name": "tester"})
+    first.create_command("echo 2", {"user_name": "tester"})
+
+    claimed_a = first.claim_next_command()
+    claimed_b = second.claim_next_command()
+
+    assert claimed_a[0] == name
+    assert claimed_a[1]["command"] == "echo 1"
+    assert claimed_b[1]["command"] == "echo 2"
+    assert first.claim_next_command() is None
+    assert first.get_oldest_command() is None
+
+
+def test_responses_and_pending_roundtrip(tmp_path):
+    """レスポンスと承認待ちを作成・取得・削除できる"""
+    comm = SQLiteCommunicator(str(tmp_path))
+    res = comm.create_response("done", status="success", job_id="cmd_1")
+    pending = comm.create_pending("sudo ls", "approve?", original_file="cmd_1.json")
+
+    assert comm.list_responses() == [(res, comm.list_responses()[0][1])]
+    assert comm.list_responses()[0][1]["job_id"] == "cmd_1"
+    assert comm.get_pending(pending)["original_file"] == "cmd_1.json"
+    assert comm.counts() == {"commands": 0, "responses": 1, "pending": 1}
+
+    comm.create_approval(pending, True, user_name="tester")
+    approval_name, approval = comm.claim_next_approval()
+    assert approval_name == f"approval_{pending}"
+    assert approval["approval"] is True
+
+    comm.ack_response(res)
+    comm.remove_pending(pending)
+    assert comm.counts() == {"commands": 0, "responses": 0, "pending": 0}
+
+
+def test_migration_imports_spool_files(tmp_path):
+    """既存のスプールファイルを名前を保ったまま取り込む（実行エンジンだけが取り込む）"""
+    files = FileCommunicator(str(tmp_path), worker_id="old-executor")
+    cmd = files.create_command("echo old", {"user_name": "tester"})
+    res = files.create_response("old response")
+    pending = files.create_pending("sudo ls", "approve?")
+    # 以前の実行エンジンが処理中のまま停止したコマンド
+    running = files.create_command("echo running", {"user_name": "tester"})
+    files.claim_command(running)
+
+    bot_side = create_communicator(str(tmp_path), backend="sqlite")
+    assert bot_side.get_oldest_command() is None
+    assert (files.command_dir / cmd).exists()
+
+    comm = create_communicator(str(tmp_path), backend="sqlite", migrate=True)
+
+    assert comm.get_oldest_command()[0] == cmd
+    assert comm.claim_command(running)["command"] == "echo running"
+    assert not list(files.claimed_root.glob("*/*.json"))
+    assert [name for name, _ in comm.list_responses()] == [res]
+    assert comm.get_pending(pending)["command"] == "sudo ls"
+    assert not list(files.command_dir.glob("*.json"))
+    assert not list(files.response_dir.glob("*.json"))
+
+
+def test_named_claim_and_lease_reclaim(tmp_path):
+    """名前指定の取得は1回だけ成功し、延長されないリースは未処理に戻る"""
+    first = SQLiteCommunicator(str(tmp_path))
+    second = SQLiteCommunicator(str(tmp_path))
+    name = first.create_command("echo hi", {"user_id": "1"})
+
+    assert first.claim_command(name)["command"] == "echo hi"
+    assert second.claim_command(name) is None
+
+    first.renew_leases()
+    assert second.reclaim_expired(lease_seconds=60) == 0
+    assert second.reclaim_expired(lease_seconds=-1) == 1
+    assert second.claim_next_command()[0] == name
+
+
+def test_same_name_replaces_record(tmp_path):
+    """同名のレコードはファイルバックエンドと同じく置き換え、処理中の状態は保つ"""
+    comm = SQLiteCommunicator(str(tmp_path))
+    assert comm.write_record(KIND_RESPONSE, "prog_1.json", {"seq": 1}) == "prog_1.json"
+    assert comm.write_record(KIND_RESPONSE, "prog_1.json", {"seq": 2}) == "prog_1.json"
+    assert comm.list_responses() == [("prog_1.json", {"seq": 2})]
+
+    name = comm.create_command("echo hi", {"user_id": "1"})
+    comm.claim_command(name)
+    comm.write_record(KIND_COMMAND, name, {"command": "echo hi"})
+    assert comm.claim_next_command() is None
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+出力ストリーミングのテスト
+"""
+
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.file_comm import FileCommunicator
+from bridge.streaming import stream_process, ProgressPublisher
+
+
+def _popen(command):
+    return subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def test_stream_process_delivers_output_incrementally():
+    """出力が届くたびにコールバックされ、全出力も返される"""
+    chunks = []
+    result = stream_process(
+        _popen("echo one; sleep 0.3; echo two; echo err >&2"),
+        timeout=5,
+        on_output=lambda name, text: text and chunks.append((name, text)),
+        tick=0.1
+    )
+
+    assert result['stdout'] == "one\ntwo\n"
+    assert result['stderr'] == "err\n"
+    assert result['returncode'] == 0
+    assert not result['timed_out']
+    assert chunks[0] == ("stdout", "one\n")
+
+
+def test_stream_process_timeout_kills_process():
+    """タイムアウト時はプロセスを終了させる"""
+    result = stream_process(_popen("exec sleep 5"), timeout=0.3, on_output=lambda *_: None)
+    assert result['timed_out']
+
+
+def test_progress_publisher_writes_sequenced_records(tmp_path):
+    """進捗レコードは連番付きで出力の末尾を含む"""
+    comm = FileCommunicator(str(tmp_path))
+    publisher = ProgressPublisher(comm, "job1", "make", interval=0, tail_chars=5)
+
+    publisher.feed("stdout", "abcdef")
+    publisher.feed(None, "")
+    publisher.feed("stdout", "gh")
+
+    records = [json.loads(p.read_text()) for p in sorted(comm.response_dir.glob("prog_job1_*.json"))]
+    assert [r['seq'] for r in records] == [1, 2]
+    assert records[-1]['output'] == "defgh"
+    assert records[-1]['total_chars'] == 8
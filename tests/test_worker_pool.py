@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+ワーカープールのテスト
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bridge.worker_pool import WorkerPool, AsyncJobPool
+
+
+def test_slow_job_does_not_block_other_users():
+    """遅いジョブがあっても他ユーザーのジョブは並行して実行される"""
+    pool = WorkerPool(max_workers=2, per_user_limit=1, max_queue=10)
+    release = threading.Event()
+    done = threading.Event()
+
+    pool.start()
+    try:
+        assert pool.submit("slow", "alice", release.wait)
+        assert pool.submit("fast", "bob", done.set)
+        assert done.wait(timeout=2)
+    finally:
+        release.set()
+        pool.stop(timeout=2)
+
+
+def test_per_user_limit_and_queue_depth():
+    """ユーザー上限を超えたジョブは待機し、キュー上限を超えた投入は拒否される"""
+    pool = WorkerPool(max_workers=4, per_user_limit=1, max_queue=2)
+    release = threading.Event()
+    order = []
+
+    def job(name):
+        order.append(name)
+        release.wait()
+
+    pool.start()
+    try:
+        assert pool.submit("a1", "alice", job, "a1")
+        time.sleep(0.1)
+        assert pool.submit("a2", "alice", job, "a2")
+        assert pool.submit("a3", "alice", job, "a3")
+        assert not pool.submit("a4", "alice", job, "a4")
+
+        time.sleep(0.1)
+        assert order == ["a1"]
+        assert pool.stats()["queued"] == 2
+    finally:
+        release.set()
+        time.sleep(0.2)
+        pool.stop(timeout=2)
+
+    assert order == ["a1", "a2", "a3"]
+
+
+def test_async_pool_drain_waits_running_and_cancels_queued():
+    """drainは実行中のジョブを待ち、未開始のジョブは取り消す"""
+    finished = []
+
+    async def job(name, delay):
+        await asyncio.sleep(delay)
+        finished.append(name)
+
+    async def scenario():
+        pool = AsyncJobPool(max_workers=1, per_user_limit=1, max_queue=10)
+        pool.start()
+        assert pool.submit("a1", "alice", job, "a1", 0.1)
+        assert pool.submit("a2", "alice", job, "a2", 0.1)
+        await asyncio.sleep(0.01)
+        await pool.drain(timeout=2)
+        assert not pool.submit("a3", "alice", job, "a3", 0)
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert finished == ["a1"]
+    assert stats["queued"] == 0 and stats["active"] == 0